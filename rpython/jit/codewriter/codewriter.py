@@ -8,6 +8,7 @@ from rpython.jit.codewriter.liveness import compute_liveness
 from rpython.jit.codewriter.call import CallControl
 from rpython.jit.codewriter.policy import log
 from rpython.flowspace.model import copygraph
+from rpython.rlib.objectmodel import compute_hash
 from rpython.tool.udir import udir
 
 
@@ -75,6 +76,14 @@ class CodeWriter(object):
         self.assembler.finished(self.callcontrol.callinfocollection)
         log.info("there are %d JitCode instances." % count)
 
+    def compute_jitcodes_hash(self):
+        """Return a hash of all the JitCodes.  It changes whenever the
+        interpreter is changed and translated again."""
+        keys = ['%s\x00%s' % (jitcode.name, jitcode.code)
+                for jitcode in self.callcontrol.jitcodes.values()]
+        keys.sort()
+        return compute_hash('\x00'.join(keys))
+
     def setup_vrefinfo(self, vrefinfo):
         # must be called at most once
         assert self.callcontrol.virtualref_info is None
@@ -208,12 +208,13 @@ def record_loop_or_bridge(metainterp_sd, loop):
 
 
 def compile_simple_loop(metainterp, greenkey, start, inputargs, ops, jumpargs,
-                        enable_opts):
+                        enable_opts, baseline=False):
     from rpython.jit.metainterp.optimizeopt import optimize_trace
 
     jitdriver_sd = metainterp.jitdriver_sd
     metainterp_sd = metainterp.staticdata
     jitcell_token = make_jitcell_token(jitdriver_sd)
+    jitcell_token.baseline = baseline
     label = ResOperation(rop.LABEL, inputargs[:], descr=jitcell_token)
     jump_op = ResOperation(rop.JUMP, jumpargs[:], descr=jitcell_token)
     call_pure_results = metainterp.call_pure_results
@@ -256,7 +257,13 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
     history = metainterp.history
     warmstate = jitdriver_sd.warmstate
 
-    enable_opts = jitdriver_sd.warmstate.enable_opts
+    # the first version of a loop may be compiled with fewer optimizations,
+    # see the 'baseline_threshold' parameter
+    baseline = warmstate.use_baseline_tier(greenkey)
+    if baseline:
+        enable_opts = warmstate.baseline_opts
+    else:
+        enable_opts = warmstate.enable_opts
     if try_disabling_unroll:
         if 'unroll' not in enable_opts:
             return None
@@ -266,8 +273,9 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
     ops = history.operations[start:]
     if 'unroll' not in enable_opts or not metainterp.cpu.supports_guard_gc_type:
         return compile_simple_loop(metainterp, greenkey, start, inputargs, ops,
-                                   jumpargs, enable_opts)
+                                   jumpargs, enable_opts, baseline)
     jitcell_token = make_jitcell_token(jitdriver_sd)
+    jitcell_token.baseline = baseline
     label = ResOperation(rop.LABEL, inputargs,
                          descr=TargetToken(jitcell_token))
     end_label = ResOperation(rop.LABEL, jumpargs, descr=jitcell_token)
@@ -300,7 +308,8 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
     except InvalidLoop:
         return None
 
-    if ((warmstate.vec and jitdriver_sd.vec) or warmstate.vec_all):
+    if not baseline and ((warmstate.vec and jitdriver_sd.vec) or
+                         warmstate.vec_all):
         from rpython.jit.metainterp.optimizeopt.vector import optimize_vector
         loop_info, loop_ops = optimize_vector(metainterp_sd,
                                               jitdriver_sd, warmstate,
@@ -15,7 +15,7 @@ ENTRY = lltype.Struct('timetable_entry',
 
 class JitCounter:
     """A process translated with the JIT contains one prebuilt instance
-    of this class.  It is used for three things:
+    of this class.  It is used for four things:
 
     * It maps greenkey hashes to counters, to know when we have seen this
       greenkey enough to reach the 'threshold' or 'function_threshold'
@@ -24,6 +24,12 @@ class JitCounter:
     * It handles the counters on the failing guards, for 'trace_eagerness'.
       This is done in the same 'timetable'.
 
+    * If 'baseline_threshold' is set, it counts how many times we enter
+      the first, less optimized version of a loop, to know when to compile
+      it again with all optimizations.  This reuses the timetable entry
+      of the loop's greenkey, which is otherwise unused once the loop is
+      compiled; the increment is per-JitCell (see warmstate.py).
+
     * It records the JitCell objects that are created when we compile
       a loop, in a non-lossy dictionary-like strurcture.  This is done
       in the 'celltable'.
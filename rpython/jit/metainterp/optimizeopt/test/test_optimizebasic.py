@@ -15,7 +15,7 @@ from rpython.jit.tool.oparser import parse
 
 def test_store_final_boxes_in_guard():
     from rpython.jit.metainterp.compile import ResumeGuardDescr
-    from rpython.jit.metainterp.resume import tag, TAGBOX
+    from rpython.jit.metainterp.resume import tag, TAGBOX, unpack_numbering
     b0 = InputArgInt()
     b1 = InputArgInt()
     opt = optimizeopt.Optimizer(FakeMetaInterpStaticData(LLtypeMixin.cpu),
@@ -30,12 +30,12 @@ def test_store_final_boxes_in_guard():
     opt.store_final_boxes_in_guard(op, [])
     fdescr = op.getdescr()
     if op.getfailargs() == [b0, b1]:
-        assert list(fdescr.rd_numb.nums)      == [tag(1, TAGBOX)]
-        assert list(fdescr.rd_numb.prev.nums) == [tag(0, TAGBOX)]
+        assert unpack_numbering(fdescr.rd_numb)      == [tag(1, TAGBOX)]
+        assert unpack_numbering(fdescr.rd_numb.prev) == [tag(0, TAGBOX)]
     else:
         assert op.getfailargs() == [b1, b0]
-        assert list(fdescr.rd_numb.nums)      == [tag(0, TAGBOX)]
-        assert list(fdescr.rd_numb.prev.nums) == [tag(1, TAGBOX)]
+        assert unpack_numbering(fdescr.rd_numb)      == [tag(0, TAGBOX)]
+        assert unpack_numbering(fdescr.rd_numb.prev) == [tag(1, TAGBOX)]
     assert fdescr.rd_virtuals is None
     assert fdescr.rd_consts == []
 
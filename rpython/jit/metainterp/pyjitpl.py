@@ -13,6 +13,7 @@ from rpython.jit.metainterp.jitprof import EmptyProfiler
 from rpython.jit.metainterp.logger import Logger
 from rpython.jit.metainterp.optimizeopt.util import args_dict
 from rpython.jit.metainterp.resoperation import rop, OpHelpers, GuardResOp
+from rpython.jit.metainterp.warmstate import JC_TIERING_UP
 from rpython.rlib import nonconst, rstack
 from rpython.rlib.debug import debug_start, debug_stop, debug_print
 from rpython.rlib.debug import have_debug_prints, make_sure_not_resized
@@ -2523,6 +2524,10 @@ class MetaInterp(object):
         cell = JitCell.get_jit_cell_at_key(greenkey)
         if cell is None:
             return None
+        if cell.flags & JC_TIERING_UP:
+            # ignore the baseline version of the loop that we are now
+            # tracing again
+            return None
         token = cell.get_procedure_token()
         if with_compiled_targets:
             if not token:
@@ -137,17 +137,25 @@ def capture_resumedata(framestack, virtualizable_boxes, virtualref_boxes,
 #
 # The following is equivalent to the RPython-level declaration:
 #
-#     class Numbering: __slots__ = ['prev', 'nums']
+#     class Numbering: __slots__ = ['prev', 'code']
 #
 # except that it is more compact in translated programs, because the
-# array 'nums' is inlined in the single NUMBERING object.  This is
+# array 'code' is inlined in the single NUMBERING object.  This is
 # important because this is often the biggest single consumer of memory
-# in a pypy-c-jit.
+# in a pypy-c-jit.  For the same reason, the tagged numbers are not
+# stored as shorts, but compressed in 'code': each one is zigzag-encoded
+# (it may be negative), and then written 7 bits at a time, lowest bits
+# first, with the high bit of a byte set if more bytes follow.  Most
+# numbers take a single byte.  Use unpack_numbering() to get the list
+# of tagged numbers back.
+#
+# Numberings with the same content and the same 'prev' are shared by
+# all the guards of a loop, see ResumeDataLoopMemo.
 #
 NUMBERINGP = lltype.Ptr(lltype.GcForwardReference())
 NUMBERING = lltype.GcStruct('Numbering',
                             ('prev', NUMBERINGP),
-                            ('nums', lltype.Array(rffi.SHORT)))
+                            ('code', lltype.Array(lltype.Char)))
 NUMBERINGP.TO.become(NUMBERING)
 
 PENDINGFIELDSTRUCT = lltype.Struct('PendingField',
@@ -162,6 +170,55 @@ TAGMASK = 3
 class TagOverflow(Exception):
     pass
 
+def append_numbering(code, tagged):
+    value = rarithmetic.widen(tagged)
+    if value < 0:
+        value = ((-value - 1) << 1) | 1
+    else:
+        value = value << 1
+    while value >= 0x80:
+        code.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    code.append(chr(value))
+
+def read_numbering(code, pos):
+    # returns the tagged number at 'pos' and the position of the next one
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(code[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    if value & 1:
+        value = -(value >> 1) - 1
+    else:
+        value = value >> 1
+    return rffi.r_short(value), pos
+
+def _new_numbering(code, prev):
+    numb = lltype.malloc(NUMBERING, len(code))
+    for i in range(len(code)):
+        numb.code[i] = code[i]
+    numb.prev = prev
+    return numb
+
+def create_numbering(nums, prev):
+    code = []
+    for tagged in nums:
+        append_numbering(code, tagged)
+    return _new_numbering(code, prev)
+
+def unpack_numbering(numb):
+    nums = []
+    pos = 0
+    while pos < len(numb.code):
+        tagged, pos = read_numbering(numb.code, pos)
+        nums.append(tagged)
+    return nums
+
 def tag(value, tagbits):
     assert 0 <= tagbits <= 3
     sx = value >> 13
@@ -206,6 +263,8 @@ class ResumeDataLoopMemo(object):
         self.large_ints = {}
         self.refs = self.cpu.ts.new_ref_dict_2()
         self.numberings = {}
+        self.shared_numberings = []
+        self.shared_numbering_ids = {}
         self.cached_boxes = {}
         self.cached_virtuals = {}
 
@@ -249,17 +308,22 @@ class ResumeDataLoopMemo(object):
     # env numbering
 
     def number(self, optimizer, snapshot):
+        numb, liveboxes, v, _ = self._number(optimizer, snapshot)
+        return numb, liveboxes, v
+
+    def _number(self, optimizer, snapshot):
         if snapshot is None:
-            return lltype.nullptr(NUMBERING), {}, 0
+            return lltype.nullptr(NUMBERING), {}, 0, -1
         if snapshot in self.numberings:
-            numb, liveboxes, v = self.numberings[snapshot]
-            return numb, liveboxes.copy(), v
+            numb, liveboxes, v, numb_id = self.numberings[snapshot]
+            return numb, liveboxes.copy(), v, numb_id
 
-        numb1, liveboxes, v = self.number(optimizer, snapshot.prev)
+        numb1, liveboxes, v, numb1_id = self._number(optimizer,
+                                                     snapshot.prev)
         n = len(liveboxes) - v
         boxes = snapshot.boxes
         length = len(boxes)
-        numb = lltype.malloc(NUMBERING, length)
+        code = []
         for i in range(length):
             box = boxes[i]
             box = optimizer.get_box_replacement(box)
@@ -283,11 +347,25 @@ class ResumeDataLoopMemo(object):
                     tagged = tag(n, TAGBOX)
                     n += 1
                 liveboxes[box] = tagged
-            numb.nums[i] = tagged
+            append_numbering(code, tagged)
         #
-        numb.prev = numb1
-        self.numberings[snapshot] = numb, liveboxes, v
-        return numb, liveboxes.copy(), v
+        numb, numb_id = self._get_shared_numbering(code, numb1, numb1_id)
+        self.numberings[snapshot] = numb, liveboxes, v, numb_id
+        return numb, liveboxes.copy(), v, numb_id
+
+    def _get_shared_numbering(self, code, prev, prev_id):
+        # The content of a numbering is made only of tagged numbers,
+        # whose meaning depends on the guard using it.  So guards whose
+        # snapshots differ can still share the same numbering, and in
+        # particular the same chain of parent frames.
+        key = '%d:%s' % (prev_id, ''.join(code))
+        try:
+            numb_id = self.shared_numbering_ids[key]
+        except KeyError:
+            numb_id = len(self.shared_numberings)
+            self.shared_numberings.append(_new_numbering(code, prev))
+            self.shared_numbering_ids[key] = numb_id
+        return self.shared_numberings[numb_id], numb_id
 
     def forget_numberings(self):
         # XXX ideally clear only the affected numberings
@@ -922,6 +1000,7 @@ class AbstractResumeDataReader(object):
     def _init(self, cpu, storage):
         self.cpu = cpu
         self.cur_numb = storage.rd_numb
+        self.cur_pos = 0
         self.count = storage.rd_count
         self.consts = storage.rd_consts
 
@@ -1004,22 +1083,30 @@ class AbstractResumeDataReader(object):
     def _prepare_next_section(self, info):
         # Use info.enumerate_vars(), normally dispatching to
         # rpython.jit.codewriter.jitcode.  Some tests give a different 'info'.
+        # The callbacks are invoked with 'index' going 0, 1, 2..., so
+        # we can decode the numbers one after the other.
+        self.cur_pos = 0
         info.enumerate_vars(self._callback_i,
                             self._callback_r,
                             self._callback_f,
                             self.unique_id)    # <-- annotation hack
         self.cur_numb = self.cur_numb.prev
 
+    def _next_tagged(self):
+        tagged, self.cur_pos = read_numbering(self.cur_numb.code,
+                                              self.cur_pos)
+        return tagged
+
     def _callback_i(self, index, register_index):
-        value = self.decode_int(self.cur_numb.nums[index])
+        value = self.decode_int(self._next_tagged())
         self.write_an_int(register_index, value)
 
     def _callback_r(self, index, register_index):
-        value = self.decode_ref(self.cur_numb.nums[index])
+        value = self.decode_ref(self._next_tagged())
         self.write_a_ref(register_index, value)
 
     def _callback_f(self, index, register_index):
-        value = self.decode_float(self.cur_numb.nums[index])
+        value = self.decode_float(self._next_tagged())
         self.write_a_float(register_index, value)
 
 # ---------- when resuming for pyjitpl.py, make boxes ----------
@@ -1060,36 +1147,36 @@ class ResumeDataBoxReader(AbstractResumeDataReader):
         self.boxes_f = boxes_f
         self._prepare_next_section(info)
 
-    def consume_virtualizable_boxes(self, vinfo, numb):
+    def consume_virtualizable_boxes(self, vinfo, nums):
         # we have to ignore the initial part of 'nums' (containing vrefs),
         # find the virtualizable from nums[-1], and use it to know how many
         # boxes of which type we have to return.  This does not write
         # anything into the virtualizable.
-        index = len(numb.nums) - 1
-        virtualizablebox = self.decode_ref(numb.nums[index])
+        index = len(nums) - 1
+        virtualizablebox = self.decode_ref(nums[index])
         virtualizable = vinfo.unwrap_virtualizable_box(virtualizablebox)
-        return vinfo.load_list_of_boxes(virtualizable, self, numb)
+        return vinfo.load_list_of_boxes(virtualizable, self, nums)
 
-    def consume_virtualref_boxes(self, numb, end):
+    def consume_virtualref_boxes(self, nums, end):
         # Returns a list of boxes, assumed to be all BoxPtrs.
         # We leave up to the caller to call vrefinfo.continue_tracing().
         assert (end & 1) == 0
-        return [self.decode_ref(numb.nums[i]) for i in range(end)]
+        return [self.decode_ref(nums[i]) for i in range(end)]
 
     def consume_vref_and_vable_boxes(self, vinfo, ginfo):
-        numb = self.cur_numb
-        self.cur_numb = numb.prev
+        nums = unpack_numbering(self.cur_numb)
+        self.cur_numb = self.cur_numb.prev
         if vinfo is not None:
-            virtualizable_boxes = self.consume_virtualizable_boxes(vinfo, numb)
-            end = len(numb.nums) - len(virtualizable_boxes)
+            virtualizable_boxes = self.consume_virtualizable_boxes(vinfo, nums)
+            end = len(nums) - len(virtualizable_boxes)
         elif ginfo is not None:
-            index = len(numb.nums) - 1
-            virtualizable_boxes = [self.decode_ref(numb.nums[index])]
-            end = len(numb.nums) - 1
+            index = len(nums) - 1
+            virtualizable_boxes = [self.decode_ref(nums[index])]
+            end = len(nums) - 1
         else:
             virtualizable_boxes = None
-            end = len(numb.nums)
-        virtualref_boxes = self.consume_virtualref_boxes(numb, end)
+            end = len(nums)
+        virtualref_boxes = self.consume_virtualref_boxes(nums, end)
         return virtualizable_boxes, virtualref_boxes
 
     def allocate_with_vtable(self, descr=None):
@@ -1369,7 +1456,7 @@ class ResumeDataDirectReader(AbstractResumeDataReader):
         info = blackholeinterp.get_current_position_info()
         self._prepare_next_section(info)
 
-    def consume_virtualref_info(self, vrefinfo, numb, end):
+    def consume_virtualref_info(self, vrefinfo, nums, end):
         # we have to decode a list of references containing pairs
         # [..., virtual, vref, ...]  stopping at 'end'
         if vrefinfo is None:
@@ -1377,22 +1464,22 @@ class ResumeDataDirectReader(AbstractResumeDataReader):
             return
         assert (end & 1) == 0
         for i in range(0, end, 2):
-            virtual = self.decode_ref(numb.nums[i])
-            vref = self.decode_ref(numb.nums[i + 1])
+            virtual = self.decode_ref(nums[i])
+            vref = self.decode_ref(nums[i + 1])
             # For each pair, we store the virtual inside the vref.
             vrefinfo.continue_tracing(vref, virtual)
 
-    def consume_vable_info(self, vinfo, numb):
+    def consume_vable_info(self, vinfo, nums):
         # we have to ignore the initial part of 'nums' (containing vrefs),
         # find the virtualizable from nums[-1], load all other values
         # from the CPU stack, and copy them into the virtualizable
         if vinfo is None:
-            return len(numb.nums)
-        index = len(numb.nums) - 1
-        virtualizable = self.decode_ref(numb.nums[index])
+            return len(nums)
+        index = len(nums) - 1
+        virtualizable = self.decode_ref(nums[index])
         # just reset the token, we'll force it later
         vinfo.reset_token_gcref(virtualizable)
-        return vinfo.write_from_resume_data_partial(virtualizable, self, numb)
+        return vinfo.write_from_resume_data_partial(virtualizable, self, nums)
 
     def load_value_of_type(self, TYPE, tagged):
         from rpython.jit.metainterp.warmstate import specialize_value
@@ -1412,10 +1499,11 @@ class ResumeDataDirectReader(AbstractResumeDataReader):
         numb = self.cur_numb
         self.cur_numb = numb.prev
         if self.resume_after_guard_not_forced != 2:
-            end_vref = self.consume_vable_info(vinfo, numb)
+            nums = unpack_numbering(numb)
+            end_vref = self.consume_vable_info(vinfo, nums)
             if ginfo is not None:
                 end_vref -= 1
-            self.consume_virtualref_info(vrefinfo, numb, end_vref)
+            self.consume_virtualref_info(vrefinfo, nums, end_vref)
 
     def allocate_with_vtable(self, descr=None):
         from rpython.jit.metainterp.executor import exec_new_with_vtable
@@ -23,6 +23,7 @@ def _get_jitcodes(testself, CPUClass, func, values,
 
     class FakeJitCell(object):
         __product_token = None
+        flags = 0
         def get_procedure_token(self):
             return self.__product_token
         def set_procedure_token(self, token):
@@ -38,6 +38,9 @@ class FakeState(object):
     enable_opts = ALL_OPTS_DICT.copy()
     enable_opts.pop('unroll')
 
+    def use_baseline_tier(self, greenkey):
+        return False
+
     def attach_unoptimized_bridge_from_interp(*args):
         pass
 
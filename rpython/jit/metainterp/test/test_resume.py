@@ -10,7 +10,8 @@ from rpython.jit.metainterp.resume import ResumeDataVirtualAdder,\
      VArrayInfoNotClear, VStrPlainInfo, VStrConcatInfo, VStrSliceInfo,\
      VUniPlainInfo, VUniConcatInfo, VUniSliceInfo, Snapshot, FrameInfo,\
      capture_resumedata, ResumeDataLoopMemo, UNASSIGNEDVIRTUAL, INT,\
-     annlowlevel, PENDINGFIELDSP
+     annlowlevel, PENDINGFIELDSP, create_numbering, unpack_numbering,\
+     append_numbering, read_numbering
 from rpython.jit.metainterp.optimizeopt import info
 from rpython.jit.metainterp.history import ConstInt, Const, AbstractDescr
 from rpython.jit.metainterp.history import ConstPtr, ConstFloat
@@ -67,8 +68,8 @@ def dump_storage(storage, liveboxes):
             frameinfo = frameinfo.prev
         numb = storage.rd_numb
         while numb:
-            debug_print('\tnumb', str([untag(numb.nums[i])
-                                       for i in range(len(numb.nums))]),
+            debug_print('\tnumb', str([untag(tagged)
+                                       for tagged in unpack_numbering(numb)]),
                         'at', compute_unique_id(numb))
             numb = numb.prev
         for const in storage.rd_consts:
@@ -275,11 +276,7 @@ def _next_section(reader, *expected):
 
 
 def Numbering(prev, nums):
-    numb = lltype.malloc(NUMBERING, len(nums))
-    numb.prev = prev or lltype.nullptr(NUMBERING)
-    for i in range(len(nums)):
-        numb.nums[i] = nums[i]
-    return numb
+    return create_numbering(nums, prev or lltype.nullptr(NUMBERING))
 
 def test_simple_read():
     #b1, b2, b3 = [BoxInt(), InputArgRef(), BoxInt()]
@@ -548,12 +545,25 @@ def test_Numbering_create():
     l = [rffi.r_short(1), rffi.r_short(2)]
     numb = Numbering(None, l)
     assert not numb.prev
-    assert list(numb.nums) == l
+    assert unpack_numbering(numb) == l
 
     l1 = [rffi.r_short(3)]
     numb1 = Numbering(numb, l1)
     assert numb1.prev == numb
-    assert list(numb1.nums) == l1
+    assert unpack_numbering(numb1) == l1
+
+def test_Numbering_compressed():
+    l = [tag(0, TAGBOX), tag(15, TAGBOX), tag(-1, TAGINT), NULLREF,
+         tag(16, TAGBOX), UNASSIGNED, tag(4095, TAGVIRTUAL),
+         tag(-4096, TAGCONST)]
+    numb = Numbering(None, l)
+    assert unpack_numbering(numb) == l
+    # small numbers take one byte, and none takes more than three
+    assert len(numb.code) == 4 * 1 + 2 + 3 * 3
+    for tagged in l:
+        code = []
+        append_numbering(code, tagged)
+        assert read_numbering(code, 0) == (tagged, len(code))
 
 def test_capture_resumedata():
     b1, b2, b3 = [InputArgInt(), InputArgRef(), InputArgInt()]
@@ -920,11 +930,11 @@ def test_ResumeDataLoopMemo_number():
 
     assert liveboxes == {b1: tag(0, TAGBOX), b2: tag(1, TAGBOX),
                          b3: tag(2, TAGBOX)}
-    assert list(numb.nums) == [tag(3, TAGINT), tag(2, TAGBOX), tag(0, TAGBOX),
-                               tag(1, TAGINT)]
-    assert list(numb.prev.nums) == [tag(0, TAGBOX), tag(1, TAGINT),
-                                    tag(1, TAGBOX),
-                                    tag(0, TAGBOX), tag(2, TAGINT)]
+    assert unpack_numbering(numb) == [tag(3, TAGINT), tag(2, TAGBOX),
+                                      tag(0, TAGBOX), tag(1, TAGINT)]
+    assert unpack_numbering(numb.prev) == [tag(0, TAGBOX), tag(1, TAGINT),
+                                           tag(1, TAGBOX),
+                                           tag(0, TAGBOX), tag(2, TAGINT)]
     assert not numb.prev.prev
 
     numb2, liveboxes2, v = memo.number(FakeOptimizer(), snap2)
@@ -933,8 +943,8 @@ def test_ResumeDataLoopMemo_number():
     assert liveboxes2 == {b1: tag(0, TAGBOX), b2: tag(1, TAGBOX),
                          b3: tag(2, TAGBOX)}
     assert liveboxes2 is not liveboxes
-    assert list(numb2.nums) == [tag(3, TAGINT), tag(2, TAGBOX), tag(0, TAGBOX),
-                                tag(3, TAGINT)]
+    assert unpack_numbering(numb2) == [tag(3, TAGINT), tag(2, TAGBOX),
+                                       tag(0, TAGBOX), tag(3, TAGINT)]
     assert numb2.prev == numb.prev
 
     env3 = [c3, b3, b1, c3]
@@ -953,8 +963,8 @@ def test_ResumeDataLoopMemo_number():
     assert v == 0
     
     assert liveboxes3 == {b1: tag(0, TAGBOX), b2: tag(1, TAGBOX)}
-    assert list(numb3.nums) == [tag(3, TAGINT), tag(4, TAGINT), tag(0, TAGBOX),
-                                tag(3, TAGINT)]
+    assert unpack_numbering(numb3) == [tag(3, TAGINT), tag(4, TAGINT),
+                                       tag(0, TAGBOX), tag(3, TAGINT)]
     assert numb3.prev == numb.prev
 
     # virtual
@@ -967,8 +977,8 @@ def test_ResumeDataLoopMemo_number():
     
     assert liveboxes4 == {b1: tag(0, TAGBOX), b2: tag(1, TAGBOX),
                           b4: tag(0, TAGVIRTUAL)}
-    assert list(numb4.nums) == [tag(3, TAGINT), tag(0, TAGVIRTUAL),
-                                tag(0, TAGBOX), tag(3, TAGINT)]
+    assert unpack_numbering(numb4) == [tag(3, TAGINT), tag(0, TAGVIRTUAL),
+                                       tag(0, TAGBOX), tag(3, TAGINT)]
     assert numb4.prev == numb.prev
 
     env5 = [b1, b4, b5]
@@ -981,10 +991,33 @@ def test_ResumeDataLoopMemo_number():
     
     assert liveboxes5 == {b1: tag(0, TAGBOX), b2: tag(1, TAGBOX),
                           b4: tag(0, TAGVIRTUAL), b5: tag(1, TAGVIRTUAL)}
-    assert list(numb5.nums) == [tag(0, TAGBOX), tag(0, TAGVIRTUAL),
-                                                tag(1, TAGVIRTUAL)]
+    assert unpack_numbering(numb5) == [tag(0, TAGBOX), tag(0, TAGVIRTUAL),
+                                       tag(1, TAGVIRTUAL)]
     assert numb5.prev == numb4
 
+def test_ResumeDataLoopMemo_number_shared():
+    b1, b2 = [InputArgInt(), InputArgInt()]
+    c1 = ConstInt(1)
+    memo = ResumeDataLoopMemo(FakeMetaInterpStaticData())
+    # two unrelated snapshots with the same content
+    snap = Snapshot(Snapshot(None, [b1, c1]), [b2, b1])
+    snap1 = Snapshot(Snapshot(None, [b1, c1]), [b2, b1])
+    numb, _, _ = memo.number(FakeOptimizer(), snap)
+    numb1, _, _ = memo.number(FakeOptimizer(), snap1)
+    assert numb1 == numb
+    # only the parent frame is the same
+    snap2 = Snapshot(Snapshot(None, [b1, c1]), [b1])
+    numb2, _, _ = memo.number(FakeOptimizer(), snap2)
+    assert numb2 != numb
+    assert numb2.prev == numb.prev
+    assert unpack_numbering(numb2) == [tag(0, TAGBOX)]
+    # the same content with a different parent is not shared
+    snap3 = Snapshot(Snapshot(None, [b1, ConstInt(2)]), [b2, b1])
+    numb3, _, _ = memo.number(FakeOptimizer(), snap3)
+    assert numb3 != numb
+    assert unpack_numbering(numb3) == unpack_numbering(numb)
+    assert len(memo.shared_numberings) == 5
+
 def test_ResumeDataLoopMemo_number_boxes():
     memo = ResumeDataLoopMemo(FakeMetaInterpStaticData())
     b1, b2 = [InputArgInt(), InputArgInt()]
@@ -1121,7 +1154,8 @@ class ResumeDataFakeReader(ResumeDataBoxReader):
         class MyInfo:
             @staticmethod
             def enumerate_vars(callback_i, callback_r, callback_f, _):
-                for index, tagged in enumerate(self.cur_numb.nums):
+                for index, tagged in enumerate(
+                        unpack_numbering(self.cur_numb)):
                     _, tag = untag(tagged)
                     if tag == TAGVIRTUAL:
                         kind = REF
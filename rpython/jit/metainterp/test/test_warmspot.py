@@ -109,6 +109,89 @@ class TestLLWarmspot(LLJitMixin):
         assert res == 0
         self.check_resops(new_with_vtable=0)
 
+    def test_hot_greenkeys(self):
+        from rpython.rlib.jit import we_are_jitted
+        from rpython.tool.udir import udir
+        path = udir.join('test_hot_greenkeys')
+        if path.check():
+            path.remove()
+        myjitdriver = JitDriver(greens=['k', 's'], reds=['n', 'i', 'j'])
+        def make_f(step):
+            def f(n, threshold, k):
+                set_param(myjitdriver, 'threshold', threshold)
+                if k < 0:
+                    s = 'a\n b'
+                else:
+                    s = 'c'
+                i = j = 0
+                while i < n:
+                    myjitdriver.can_enter_jit(s=s, k=k, n=n, i=i, j=j)
+                    myjitdriver.jit_merge_point(s=s, k=k, n=n, i=i, j=j)
+                    if we_are_jitted():
+                        j += 1
+                    i += step
+                return j
+            return f
+        f = make_f(1)
+        res = self.meta_interp(f, [30, 1000, -5], hot_greenkeys=str(path))
+        assert res == 0
+        res1 = self.meta_interp(f, [30, 10, -5], hot_greenkeys=str(path))
+        assert res1 > 0
+        lines = path.read().splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith('RPython JIT hot greenkeys ')
+        assert lines[1] == 'jitdriver i-5 s610a2062'
+        # the next runs start tracing the loop the first time they reach it
+        res2 = self.meta_interp(f, [30, 1000, -5], hot_greenkeys=str(path))
+        assert res2 > res1
+        self.check_trace_count(1)
+        assert path.read().splitlines() == lines
+        # the greenkeys are dropped if the jitcodes change
+        res = self.meta_interp(make_f(2), [30, 1000, -5],
+                               hot_greenkeys=str(path))
+        assert res == 0
+        newlines = path.read().splitlines()
+        assert len(newlines) == 1
+        assert newlines[0] != lines[0]
+
+    def test_baseline_tier(self):
+        myjitdriver = JitDriver(greens=[], reds=['n', 'i', 'total'])
+        def g(n):
+            i = total = 0
+            while i < n:
+                myjitdriver.can_enter_jit(n=n, i=i, total=total)
+                myjitdriver.jit_merge_point(n=n, i=i, total=total)
+                total += i
+                i += 1
+            return total
+        def f(n, m):
+            set_param(myjitdriver, 'trace_eagerness', 1000)
+            total = 0
+            while m > 0:
+                total += g(n)
+                m -= 1
+            return total
+        def count_labels():
+            return [len([op for op in loop.operations
+                         if op.getopname() == 'label'])
+                    for loop in get_stats().get_all_loops()]
+        expected = f(10, 10)
+        # the first version of the loop is not unrolled, and it is
+        # compiled again with all optimizations after 'threshold' entries
+        res = self.meta_interp(f, [10, 10], baseline_threshold=3,
+                               tier_up_ratio=0)
+        assert res == expected
+        self.check_trace_count(2)
+        self.check_jitcell_token_count(2)
+        assert count_labels() == [1, 2]
+        # it stays at the baseline tier if it runs too shortly compared
+        # to the time it took to compile it
+        res = self.meta_interp(f, [10, 10], baseline_threshold=3,
+                               tier_up_ratio=10**9)
+        assert res == expected
+        self.check_trace_count(1)
+        assert count_labels() == [1]
+
     def test_unwanted_loops(self):
         mydriver = JitDriver(reds = ['n', 'total', 'm'], greens = [])
 
@@ -1,8 +1,9 @@
 from rpython.rtyper.test.test_llinterp import interpret
 from rpython.rtyper.lltypesystem import lltype, llmemory, rstr, rffi
-from rpython.rtyper.annlowlevel import llhelper
+from rpython.rtyper.annlowlevel import llhelper, llstr, hlstr
 from rpython.jit.metainterp.warmstate import wrap, unwrap, specialize_value
 from rpython.jit.metainterp.warmstate import equal_whatever, hash_whatever
+from rpython.jit.metainterp.warmstate import encode_green, decode_green
 from rpython.jit.metainterp.warmstate import WarmEnterState
 from rpython.jit.metainterp.resoperation import InputArgInt, InputArgRef,\
      InputArgFloat
@@ -78,6 +79,26 @@ def test_hash_equal_whatever_lltype():
     fn(42)
     interpret(fn, [42])
 
+def test_encode_decode_green():
+    STR = lltype.Ptr(rstr.STR)
+    def fn(n):
+        s1 = decode_green(STR, encode_green(STR, llstr('a b\n\xff')))
+        assert hlstr(s1) == 'a b\n\xff'
+        assert encode_green(STR, llstr('a b')) == 's612062'
+        assert not decode_green(STR, encode_green(STR, lltype.nullptr(rstr.STR)))
+        assert decode_green(lltype.Signed, encode_green(lltype.Signed, n)) == n
+        c = decode_green(lltype.Char, encode_green(lltype.Char, chr(n & 255)))
+        assert c == chr(n & 255)
+        for text in ['i12', 's6', 'sxy', '']:
+            try:
+                decode_green(STR, text)
+            except ValueError:
+                pass
+            else:
+                assert False
+    fn(-42)
+    interpret(fn, [-42])
+
 
 def test_make_unwrap_greenkey():
     class FakeJitDriverSD:
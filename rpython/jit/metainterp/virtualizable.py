@@ -116,7 +116,7 @@ class VirtualizableInfo(object):
                     i = i + 1
             assert len(boxes) == i + 1
 
-        def write_from_resume_data_partial(virtualizable, reader, numb):
+        def write_from_resume_data_partial(virtualizable, reader, nums):
             virtualizable = cast_gcref_to_vtype(virtualizable)
             # Load values from the reader (see resume.py) described by
             # the list of numbers 'nums', and write them in their proper
@@ -124,42 +124,42 @@ class VirtualizableInfo(object):
             # the list and returns the index in 'nums' of the start of
             # the virtualizable data found, allowing the caller to do
             # further processing with the start of the list.
-            i = len(numb.nums) - 1
+            i = len(nums) - 1
             assert i >= 0
             for ARRAYITEMTYPE, fieldname in unroll_array_fields_rev:
                 lst = getattr(virtualizable, fieldname)
                 for j in range(getlength(lst) - 1, -1, -1):
                     i -= 1
                     assert i >= 0
-                    x = reader.load_value_of_type(ARRAYITEMTYPE, numb.nums[i])
+                    x = reader.load_value_of_type(ARRAYITEMTYPE, nums[i])
                     setarrayitem(lst, j, x)
             for FIELDTYPE, fieldname in unroll_static_fields_rev:
                 i -= 1
                 assert i >= 0
-                x = reader.load_value_of_type(FIELDTYPE, numb.nums[i])
+                x = reader.load_value_of_type(FIELDTYPE, nums[i])
                 setattr(virtualizable, fieldname, x)
             return i
 
-        def load_list_of_boxes(virtualizable, reader, numb):
+        def load_list_of_boxes(virtualizable, reader, nums):
             virtualizable = cast_gcref_to_vtype(virtualizable)
             # Uses 'virtualizable' only to know the length of the arrays;
             # does not write anything into it.  The returned list is in
             # the format expected of virtualizable_boxes, so it ends in
             # the virtualizable itself.
-            i = len(numb.nums) - 1
+            i = len(nums) - 1
             assert i >= 0
-            boxes = [reader.decode_box_of_type(self.VTYPEPTR, numb.nums[i])]
+            boxes = [reader.decode_box_of_type(self.VTYPEPTR, nums[i])]
             for ARRAYITEMTYPE, fieldname in unroll_array_fields_rev:
                 lst = getattr(virtualizable, fieldname)
                 for j in range(getlength(lst) - 1, -1, -1):
                     i -= 1
                     assert i >= 0
-                    box = reader.decode_box_of_type(ARRAYITEMTYPE, numb.nums[i])
+                    box = reader.decode_box_of_type(ARRAYITEMTYPE, nums[i])
                     boxes.append(box)
             for FIELDTYPE, fieldname in unroll_static_fields_rev:
                 i -= 1
                 assert i >= 0
-                box = reader.decode_box_of_type(FIELDTYPE, numb.nums[i])
+                box = reader.decode_box_of_type(FIELDTYPE, nums[i])
                 boxes.append(box)
             boxes.reverse()
             return boxes
@@ -13,6 +13,7 @@ from rpython.flowspace.model import checkgraph, Link, copygraph
 from rpython.rlib.objectmodel import we_are_translated
 from rpython.rlib.unroll import unrolling_iterable
 from rpython.rlib.debug import fatalerror
+from rpython.rlib.jit import PARAMETERS, STRING_PARAMETERS
 from rpython.rlib.rstackovf import StackOverflow
 from rpython.translator.backendopt import removenoops
 from rpython.translator.unsimplify import call_final_function
@@ -73,7 +74,10 @@ def jittify_and_run(interp, graph, args, repeat=1, graph_and_interp_only=False,
                     disable_unrolling=sys.maxint,
                     enable_opts=ALL_OPTS_NAMES, max_retrace_guards=15, 
                     max_unroll_recursion=7, vec=1, vec_all=0, vec_cost=0,
-                    vec_length=60, vec_ratio=2, vec_guard_ratio=3, **kwds):
+                    vec_length=60, vec_ratio=2, vec_guard_ratio=3,
+                    hot_greenkeys='', baseline_threshold=0,
+                    baseline_opts=PARAMETERS['baseline_opts'],
+                    tier_up_ratio=10, **kwds):
     from rpython.config.config import ConfigError
     translator = interp.typer.annotator.translator
     try:
@@ -103,6 +107,10 @@ def jittify_and_run(interp, graph, args, repeat=1, graph_and_interp_only=False,
         jd.warmstate.set_param_vec_length(vec_length)
         jd.warmstate.set_param_vec_ratio(vec_ratio)
         jd.warmstate.set_param_vec_guard_ratio(vec_guard_ratio)
+        jd.warmstate.set_param_hot_greenkeys(hot_greenkeys)
+        jd.warmstate.set_param_baseline_threshold(baseline_threshold)
+        jd.warmstate.set_param_baseline_opts(baseline_opts)
+        jd.warmstate.set_param_tier_up_ratio(tier_up_ratio)
     warmrunnerdesc.finish()
     if graph_and_interp_only:
         return interp, graph
@@ -251,6 +259,7 @@ class WarmRunnerDesc(object):
         self.rewrite_access_helpers()
         self.create_jit_entry_points()
         self.codewriter.make_jitcodes(verbose=verbose)
+        self.jitcodes_hash = self.codewriter.compute_jitcodes_hash()
         self.rewrite_can_enter_jits()
         self.rewrite_set_param_and_get_stats()
         self.rewrite_force_virtual(vrefinfo)
@@ -1071,7 +1080,7 @@ class WarmRunnerDesc(object):
             key = jd, funcname
             if key not in closures:
                 closures[key] = make_closure(jd, 'set_param_' + funcname,
-                                             funcname == 'enable_opts')
+                                             funcname in STRING_PARAMETERS)
             op.opname = 'direct_call'
             op.args[:3] = [closures[key]]
 
@@ -1,3 +1,4 @@
+import os
 import sys
 import weakref
 
@@ -9,9 +10,10 @@ from rpython.rlib.jit import PARAMETERS
 from rpython.rlib.nonconst import NonConstant
 from rpython.rlib.objectmodel import specialize, we_are_translated, r_dict
 from rpython.rlib.rarithmetic import intmask, r_uint
+from rpython.rlib.rtimer import read_timestamp
 from rpython.rlib.unroll import unrolling_iterable
-from rpython.rtyper.annlowlevel import (hlstr, cast_base_ptr_to_instance,
-    cast_object_to_ptr)
+from rpython.rtyper.annlowlevel import (hlstr, llstr,
+    cast_base_ptr_to_instance, cast_object_to_ptr)
 from rpython.rtyper.lltypesystem import lltype, llmemory, rstr, rffi
 
 # ____________________________________________________________
@@ -125,11 +127,86 @@ def hash_whatever(TYPE, x):
     else:
         return rffi.cast(lltype.Signed, x)
 
+def can_encode_green(TYPE):
+    "NOT_RPYTHON"
+    if isinstance(TYPE, lltype.Ptr):
+        return TYPE.TO is rstr.STR
+    return TYPE in (lltype.Signed, lltype.Unsigned, lltype.Bool,
+                    lltype.Char, lltype.UniChar)
+
+HEXDIGITS = '0123456789abcdef'
+
+@specialize.arg(0)
+def encode_green(TYPE, x):
+    """Turn a green value into a string without spaces or newlines,
+    which is the same in the next runs of the program.  Only supports
+    strings and the integer-like primitives: see can_encode_green()."""
+    if isinstance(TYPE, lltype.Ptr):
+        if not x:
+            return 'n'
+        s = hlstr(x)
+        result = ['s']
+        for c in s:
+            result.append(HEXDIGITS[ord(c) >> 4])
+            result.append(HEXDIGITS[ord(c) & 15])
+        return ''.join(result)
+    else:
+        return 'i%d' % lltype.cast_primitive(lltype.Signed, x)
+
+@specialize.arg(0)
+def decode_green(TYPE, text):
+    """The reverse of encode_green().  Raises ValueError if 'text' is
+    invalid."""
+    if isinstance(TYPE, lltype.Ptr):
+        if text == 'n':
+            return lltype.nullptr(TYPE.TO)
+        if not text.startswith('s') or len(text) % 2 != 1:
+            raise ValueError
+        result = []
+        i = 1
+        while i < len(text):
+            high = HEXDIGITS.find(text[i])
+            low = HEXDIGITS.find(text[i + 1])
+            if high < 0 or low < 0:
+                raise ValueError
+            result.append(chr((high << 4) | low))
+            i += 2
+        return llstr(''.join(result))
+    else:
+        if not text.startswith('i'):
+            raise ValueError
+        return lltype.cast_primitive(TYPE, int(text[1:]))
+
+def read_file(path):
+    fd = os.open(path, os.O_RDONLY, 0)
+    try:
+        chunks = []
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        os.close(fd)
+    return ''.join(chunks)
+
+def write_file(path, data, flags):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0644)
+    try:
+        while data:
+            count = os.write(fd, data)
+            data = data[count:]
+    finally:
+        os.close(fd)
+
 
 JC_TRACING         = 0x01
 JC_DONT_TRACE_HERE = 0x02
 JC_TEMPORARY       = 0x04
 JC_TRACING_OCCURRED= 0x08
+JC_HOT_HINT        = 0x10
+JC_BASELINE        = 0x20
+JC_TIERING_UP      = 0x40
 
 class BaseJitCell(object):
     """Subclasses of BaseJitCell are used in tandem with the single
@@ -176,10 +253,29 @@ class BaseJitCell(object):
         this particular function.  (We only set this flag when aborting
         due to a trace too long, so we use the same flag as a hint to
         also mean "please trace from here as soon as possible".)
+
+        JC_HOT_HINT: a loop was compiled from this greenkey in an earlier
+        run of the program (see the 'hot_greenkeys' parameter).  Start
+        tracing the first time we reach it, without waiting for the
+        JitCounter.  Only the warm-up counting is skipped: the loop is
+        still traced and compiled from scratch.
+
+        JC_BASELINE: the procedure_token is a first version of the loop,
+        compiled with only the 'baseline_opts'.  Every time we enter it
+        from the interpreter we tick the JitCounter by 'tier_increment',
+        and we measure the time spent running it in 'tier_run_time'.
+
+        JC_TIERING_UP: we are now tracing the loop again, to replace the
+        JC_BASELINE version with one compiled with all optimizations.
+        Always set together with JC_TRACING.
     """
     flags = 0     # JC_xxx flags
     wref_procedure_token = None
     next = None
+    # for JC_BASELINE cells; the times are in units of read_timestamp()
+    tier_increment = 0.0
+    tier_compile_time = 0.0
+    tier_run_time = 0.0
 
     def get_procedure_token(self):
         if self.wref_procedure_token is not None:
@@ -205,7 +301,7 @@ class BaseJitCell(object):
     def should_remove_jitcell(self):
         if self.get_procedure_token() is not None:
             return False    # don't remove JitCells with a procedure_token
-        if self.flags & JC_TRACING:
+        if self.flags & (JC_TRACING | JC_HOT_HINT):
             return False    # don't remove JitCells that are being traced
         if self.flags & JC_DONT_TRACE_HERE:
             # if we have this flag, and we *had* a procedure_token but
@@ -223,6 +319,10 @@ class WarmEnterState(object):
         "NOT_RPYTHON"
         self.warmrunnerdesc = warmrunnerdesc
         self.jitdriver_sd = jitdriver_sd
+        self.hot_greenkeys_path = ''
+        self.hot_greenkeys_lines = {}
+        self.threshold = 0
+        self.baseline_threshold = 0
         if warmrunnerdesc is not None:       # for tests
             self.cpu = warmrunnerdesc.cpu
         try:
@@ -240,7 +340,8 @@ class WarmEnterState(object):
         return self.warmrunnerdesc.jitcounter.compute_threshold(threshold)
 
     def set_param_threshold(self, threshold):
-        self.increment_threshold = self._compute_threshold(threshold)
+        self.threshold = threshold
+        self._update_increment_threshold()
 
     def set_param_function_threshold(self, threshold):
         self.increment_function_threshold = self._compute_threshold(threshold)
@@ -260,7 +361,7 @@ class WarmEnterState(object):
     def set_param_disable_unrolling(self, value):
         self.disable_unrolling_threshold = value
 
-    def set_param_enable_opts(self, value):
+    def _parse_opts(self, value):
         from rpython.jit.metainterp.optimizeopt import ALL_OPTS_DICT, ALL_OPTS_NAMES
 
         d = {}
@@ -273,7 +374,10 @@ class WarmEnterState(object):
                 if name not in ALL_OPTS_DICT:
                     raise ValueError('Unknown optimization ' + name)
                 d[name] = None
-        self.enable_opts = d
+        return d
+
+    def set_param_enable_opts(self, value):
+        self.enable_opts = self._parse_opts(value)
 
     def set_param_loop_longevity(self, value):
         # note: it's a global parameter, not a per-jitdriver one
@@ -319,6 +423,52 @@ class WarmEnterState(object):
     def set_param_vec_guard_ratio(self, value):
         self.vec_guard_ratio = value / 10.0
 
+    def set_param_hot_greenkeys(self, value):
+        if value is None:
+            value = ''
+        self.hot_greenkeys_path = value
+        if value:
+            self.load_hot_greenkeys()
+
+    def set_param_baseline_threshold(self, threshold):
+        self.baseline_threshold = threshold
+        self._update_increment_threshold()
+
+    def set_param_baseline_opts(self, value):
+        self.baseline_opts = self._parse_opts(value)
+
+    def set_param_tier_up_ratio(self, value):
+        self.tier_up_ratio = float(value)
+
+    def _update_increment_threshold(self):
+        # with 'baseline_threshold', a loop is first compiled after that
+        # many iterations, and 'threshold' is then used to count the
+        # entries into the baseline version
+        self.increment_tier_up = self._compute_threshold(self.threshold)
+        if self.baseline_threshold > 0:
+            self.increment_threshold = self._compute_threshold(
+                self.baseline_threshold)
+        else:
+            self.increment_threshold = self.increment_tier_up
+
+    def use_baseline_tier(self, greenkey):
+        """Return True if a new loop at 'greenkey' should be compiled
+        with only the 'baseline_opts'."""
+        if self.baseline_threshold <= 0:
+            return False
+        cell = self.JitCell.get_jit_cell_at_key(greenkey)
+        return cell is None or not (cell.flags & JC_TIERING_UP)
+
+    def should_tier_up(self, cell):
+        """Called when the JitCounter of a JC_BASELINE cell reached 1.0.
+        Return True if the loop ran long enough, compared to the time it
+        took to compile it, to be worth compiling with all optimizations.
+        If not, the cell will wait twice as long before asking again."""
+        if cell.tier_run_time >= self.tier_up_ratio * cell.tier_compile_time:
+            return True
+        cell.tier_increment *= 0.5
+        return False
+
     def disable_noninlinable_function(self, greenkey):
         cell = self.JitCell.ensure_jit_cell_at_key(greenkey)
         cell.flags |= JC_DONT_TRACE_HERE
@@ -331,6 +481,14 @@ class WarmEnterState(object):
         cell = self.JitCell.ensure_jit_cell_at_key(greenkey)
         old_token = cell.get_procedure_token()
         cell.set_procedure_token(procedure_token)
+        if procedure_token.baseline:
+            cell.flags |= JC_BASELINE
+            cell.tier_increment = self.increment_tier_up
+            cell.tier_run_time = 0.0
+        else:
+            cell.flags &= ~JC_BASELINE
+        if self.hot_greenkeys_path:
+            self.record_hot_greenkey(greenkey)
         if old_token is not None:
             self.cpu.redirect_call_assembler(old_token, procedure_token)
             # procedure_token is also kept alive by any loop that used
@@ -353,6 +511,7 @@ class WarmEnterState(object):
         num_green_args = jitdriver_sd.num_green_args
         JitCell = self.make_jitcell_subclass()
         self.make_jitdriver_callbacks()
+        self.make_hot_greenkeys_functions()
         confirm_enter_jit = self.confirm_enter_jit
         range_red_args = unrolling_iterable(
             range(num_green_args, num_green_args + jitdriver_sd.num_red_args))
@@ -405,11 +564,18 @@ class WarmEnterState(object):
             if cell is None:
                 cell = JitCell(*greenargs)
                 jitcounter.install_new_cell(hash, cell)
+            if cell.flags & (JC_BASELINE | JC_HOT_HINT):
+                # a loop that was already hot: skip the baseline tier
+                cell.flags |= JC_TIERING_UP
+            cell.flags &= ~JC_HOT_HINT
             cell.flags |= JC_TRACING | JC_TRACING_OCCURRED
+            start = read_timestamp()
             try:
                 metainterp.compile_and_run_once(jitdriver_sd, *args)
             finally:
-                cell.flags &= ~JC_TRACING
+                if not (cell.flags & JC_TIERING_UP):
+                    cell.tier_compile_time = float(read_timestamp() - start)
+                cell.flags &= ~(JC_TRACING | JC_TIERING_UP)
 
         def maybe_compile_and_run(increment_threshold, *args):
             """Entry point to the JIT.  Called at the point with the
@@ -441,12 +607,17 @@ class WarmEnterState(object):
                     # this function. don't trace a second time.
                     return
                 # attached by compile_tmp_callback().  count normally
-                if jitcounter.tick(hash, increment_threshold):
+                if (cell.flags & JC_HOT_HINT or
+                        jitcounter.tick(hash, increment_threshold)):
                     bound_reached(hash, cell, *args)
                 return
             # machine code was already compiled for these greenargs
             procedure_token = cell.get_procedure_token()
             if procedure_token is None:
+                if cell.flags & JC_HOT_HINT:
+                    # this loop was hot in an earlier run
+                    bound_reached(hash, cell, *args)
+                    return
                 if cell.flags & JC_DONT_TRACE_HERE:
                     if not cell.has_seen_a_procedure_token():
                         # A JC_DONT_TRACE_HERE, i.e. a non-inlinable function.
@@ -463,6 +634,12 @@ class WarmEnterState(object):
                 # has been freed
                 jitcounter.cleanup_chain(hash)
                 return
+            if cell.flags & JC_BASELINE:
+                # count the entries into the baseline version of the loop
+                if (jitcounter.tick(hash, cell.tier_increment) and
+                        self.should_tier_up(cell)):
+                    bound_reached(hash, cell, *args)
+                    return
             if not confirm_enter_jit(*args):
                 return
             # extract and unspecialize the red arguments to pass to
@@ -471,7 +648,14 @@ class WarmEnterState(object):
             for i in range_red_args:
                 execute_args += (unspecialize_value(args[i]), )
             # run it!  this executes until interrupted by an exception
-            execute_assembler(procedure_token, *execute_args)
+            if cell.flags & JC_BASELINE:
+                start = read_timestamp()
+                try:
+                    execute_assembler(procedure_token, *execute_args)
+                finally:
+                    cell.tier_run_time += float(read_timestamp() - start)
+            else:
+                execute_assembler(procedure_token, *execute_args)
             assert 0, "should not reach this point"
 
         maybe_compile_and_run._dont_inline_ = True
@@ -602,6 +786,106 @@ class WarmEnterState(object):
 
     # ----------
 
+    def make_hot_greenkeys_functions(self):
+        "NOT_RPYTHON"
+        if hasattr(self, 'load_hot_greenkeys'):
+            return
+        #
+        warmrunnerdesc = self.warmrunnerdesc
+        jd = self.jitdriver_sd
+        unwrap_greenkey = self.make_unwrap_greenkey()
+        JitCell = self.make_jitcell_subclass()
+        green_args_spec = unrolling_iterable(jd._green_args_spec)
+        num_green_args = len(jd._green_args_spec)
+        # only greenkeys made of strings and integers are the same in
+        # the next runs; e.g. the identity hash of an instance is not
+        supported = True
+        for TYPE in jd._green_args_spec:
+            if not can_encode_green(TYPE):
+                supported = False
+        if jd.jitdriver:
+            drivername = jd.jitdriver.name
+        else:
+            drivername = '<unknown jitdriver>'
+        #
+        # The file starts with a header line containing the hash of the
+        # jitcodes, followed by one line per greenkey: the name of the
+        # jitdriver and the encoded green arguments, separated by spaces.
+        def get_header():
+            return 'RPython JIT hot greenkeys %d' % (
+                warmrunnerdesc.jitcodes_hash,)
+
+        def encode_greenkey(greenkey):
+            greenargs = unwrap_greenkey(greenkey)
+            parts = [drivername]
+            i = 0
+            for TYPE in green_args_spec:
+                parts.append(encode_green(TYPE, greenargs[i]))
+                i = i + 1
+            return ' '.join(parts)
+
+        def decode_greenargs(parts):
+            greenargs = ()
+            i = 1
+            for TYPE in green_args_spec:
+                greenargs += (decode_green(TYPE, parts[i]),)
+                i = i + 1
+            return greenargs
+
+        def load_hot_greenkeys():
+            if not supported:
+                return
+            path = self.hot_greenkeys_path
+            try:
+                lines = read_file(path).split('\n')
+            except OSError:
+                lines = []
+            if not lines or lines[0] != get_header():
+                # no file yet, or it was written by another version of
+                # the program: start a new one
+                try:
+                    write_file(path, get_header() + '\n', os.O_TRUNC)
+                except OSError:
+                    pass
+                return
+            count = 0
+            for line in lines[1:]:
+                parts = line.split(' ')
+                if len(parts) != num_green_args + 1:
+                    continue
+                if parts[0] != drivername:
+                    continue
+                if line in self.hot_greenkeys_lines:
+                    continue
+                try:
+                    greenargs = decode_greenargs(parts)
+                except ValueError:
+                    continue
+                self.hot_greenkeys_lines[line] = None
+                cell = JitCell._ensure_jit_cell_at_key(*greenargs)
+                if not cell.has_seen_a_procedure_token():
+                    cell.flags |= JC_HOT_HINT
+                    count += 1
+            debug_start("jit-hot-greenkeys")
+            debug_print("loaded", count, "hot loops for", drivername)
+            debug_stop("jit-hot-greenkeys")
+        self.load_hot_greenkeys = load_hot_greenkeys
+
+        def record_hot_greenkey(greenkey):
+            if not supported:
+                return
+            line = encode_greenkey(greenkey)
+            if line in self.hot_greenkeys_lines:
+                return
+            self.hot_greenkeys_lines[line] = None
+            try:
+                write_file(self.hot_greenkeys_path, line + '\n', os.O_APPEND)
+            except OSError:
+                pass
+        self.record_hot_greenkey = record_hot_greenkey
+
+    # ----------
+
     def make_jitdriver_callbacks(self):
         if hasattr(self, 'get_location_str'):
             return
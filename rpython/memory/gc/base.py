@@ -187,6 +187,17 @@ class GCBase(object):
     def set_max_heap_size(self, size):
         raise NotImplementedError
 
+    def get_gc_stat(self, event, index):
+        """See rgc.get_gc_stat().  -1 means that this GC doesn't keep
+        statistics."""
+        return -1
+
+    def switch_thread_nursery(self, old_tid, new_tid):
+        """Called when the GIL goes from thread 'old_tid' (0 if it is
+        dying) to thread 'new_tid'.  Only used by GCs with per-thread
+        allocation chunks."""
+        pass
+
     def trace(self, obj, callback, arg):
         """Enumerate the locations inside the given obj that can contain
         GC pointers.  For each such location, callback(pointer, arg) is
@@ -0,0 +1,39 @@
+"""
+Cumulative statistics about the GC events, readable by the program with
+rgc.get_gc_stat() without enabling PYPYLOG.
+"""
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rlib import rgc
+
+
+class GCStats(object):
+    _alloc_flavor_ = "raw"
+
+    def __init__(self):
+        # For each event, GCSTAT_SIZE consecutive entries: see rgc.
+        self.table = lltype.malloc(
+            rffi.CArray(lltype.Signed),
+            rgc.GCSTAT_NUM_EVENTS * rgc.GCSTAT_SIZE,
+            flavor='raw', zero=True, immortal=True)
+
+    def record(self, event, value):
+        if value < 0:
+            value = 0
+        base = event * rgc.GCSTAT_SIZE
+        self.table[base + rgc.GCSTAT_COUNT] += 1
+        self.table[base + rgc.GCSTAT_TOTAL] += value
+        if value > self.table[base + rgc.GCSTAT_MAX]:
+            self.table[base + rgc.GCSTAT_MAX] = value
+        #
+        # the bucket is the number of bits in 'value'
+        i = 0
+        while value > 0 and i < rgc.GCSTAT_NUM_BUCKETS - 1:
+            value >>= 1
+            i += 1
+        self.table[base + rgc.GCSTAT_HISTOGRAM + i] += 1
+
+    def get(self, event, index):
+        if not (0 <= event < rgc.GCSTAT_NUM_EVENTS and
+                0 <= index < rgc.GCSTAT_SIZE):
+            return -1
+        return self.table[event * rgc.GCSTAT_SIZE + index]
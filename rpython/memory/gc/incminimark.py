@@ -52,6 +52,49 @@ Environment variables can be used to fine-tune the following parameters:
                          in time.  Defaults to a conservative value depending
                          on nursery size and maximum object size inside the
                          nursery.  Useful for debugging by setting it to 0.
+
+ PYPY_GC_NURSERY_MAX     Let the nursery grow up to this size when a lot of
+                         it survives minor collections, and shrink back
+                         towards PYPY_GC_NURSERY when the survival rate
+                         drops.  Defaults to 0, meaning a fixed-size
+                         nursery.
+
+ PYPY_GC_COMPACT         When the old objects fill less than this fraction
+                         of the arenas, move the live objects out of the
+                         arenas that are filled less than this fraction,
+                         and return these arenas to the OS.  A value
+                         between 0.0 and 1.0.  Defaults to 0, which
+                         disables the compaction.
+
+ PYPY_GC_MAX_PAUSE       Target for the duration of one incremental step of
+                         the major collection, in the units of the PYPYLOG
+                         timestamps.  These depend on the platform: TSC
+                         ticks on x86 and x86-64 (the nominal frequency of
+                         the CPU, e.g. 2000 per microsecond at 2GHz),
+                         QueryPerformanceCounter() units on Windows, and
+                         nanoseconds of thread CPU time elsewhere.  The
+                         amount of marking and sweeping done per step is
+                         adapted to meet it, but marking never does less
+                         than what keeps it ahead of the promoted objects.
+                         Defaults to 0, which disables the pacing.
+
+ PYPY_GC_LOS_MIN         Objects of at least this many bytes that are not
+                         allocated in the nursery get their own pages from
+                         the OS, which are given back as soon as the object
+                         dies.  Smaller objects are allocated with
+                         malloc().  Defaults to 0, which disables it and
+                         allocates all of them with malloc().
+
+ PYPY_GC_THREAD_CHUNK    Give each thread its own chunk of this many bytes
+                         of the nursery to allocate from, switched when the
+                         GIL goes to another thread.  Defaults to 0, which
+                         makes all threads share the same allocation area.
+
+ PYPY_GC_ALLOC_SAMPLE    Take a sample of the allocations every time this
+                         many bytes have been allocated in the nursery.
+                         The type and size of the sampled object are sent
+                         with a stack trace to vmprof, if it is enabled.
+                         Defaults to 0, which disables the sampling.
 """
 # XXX Should find a way to bound the major collection threshold by the
 # XXX total addressable size.  Maybe by keeping some minimarkpage arenas
@@ -62,7 +105,7 @@ Environment variables can be used to fine-tune the following parameters:
 # XXX old_objects_pointing_to_young (IRC 2014-10-22, fijal and gregor_w)
 import sys
 import os
-from rpython.rtyper.lltypesystem import lltype, llmemory, llarena, llgroup
+from rpython.rtyper.lltypesystem import lltype, llmemory, llarena, llgroup, rffi
 from rpython.rtyper.lltypesystem.lloperation import llop
 from rpython.rtyper.lltypesystem.llmemory import raw_malloc_usage
 from rpython.memory.gc.base import GCBase, MovingGCBase
@@ -72,6 +115,9 @@ from rpython.rlib.rarithmetic import ovfcheck, LONG_BIT, intmask, r_uint
 from rpython.rlib.rarithmetic import LONG_BIT_SHIFT
 from rpython.rlib.debug import ll_assert, debug_print, debug_start, debug_stop
 from rpython.rlib.objectmodel import specialize
+from rpython.rlib.rtimer import read_timestamp
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib import rgc
 from rpython.memory.gc.minimarkpage import out_of_memory
 
 #
@@ -155,7 +201,12 @@ GCFLAG_PINNED        = first_gcflag << 9
 # 'old_objects_pointing_to_pinned' and doesn't have to be added again.
 GCFLAG_PINNED_OBJECT_PARENT_KNOWN = GCFLAG_PINNED
 
-_GCFLAG_FIRST_UNUSED = first_gcflag << 10    # the first unused bit
+# The following flag is set on old objects that must never move: their
+# address was exposed by can_move(), id() or identityhash().  Without it,
+# compact_arenas() may move them.
+GCFLAG_NO_EVACUATE   = first_gcflag << 10
+
+_GCFLAG_FIRST_UNUSED = first_gcflag << 11    # the first unused bit
 
 
 # States for the incremental GC
@@ -177,6 +228,35 @@ STATE_FINALIZING = 3
 
 GC_STATES = ['SCANNING', 'MARKING', 'SWEEPING', 'FINALIZING']
 
+# Pacing with 'max_pause' scales the amount of work done per step by
+# 'gc_step_scale', which stays within these bounds.  The controller aims
+# a bit below the target, to absorb the variations between steps.
+GC_STEP_SCALE_MIN = 0.0625
+GC_STEP_SCALE_MAX = 4.0
+PACING_HEADROOM = 0.75
+
+# Number of buckets of the pause histogram: bucket 'i' counts the steps
+# that took less than 2**i ticks, and the last one all the longer steps.
+PAUSE_HISTOGRAM_SIZE = 48
+
+# With 'max_nursery_size', the nursery doubles in size when the average
+# fraction of it that survives minor collections is above the first
+# value, and halves when it is below the second value.
+NURSERY_GROW_SURVIVAL = 0.2
+NURSERY_SHRINK_SURVIVAL = 0.05
+
+# Number of threads whose allocation chunk is remembered while another
+# thread runs.  The chunks of more threads are simply left unused.
+THREAD_CHUNK_SLOTS = 64
+
+
+# The allocation samples are passed to this C function, which forwards
+# them to rvmprof while it is enabled (see translator/c/src/mem.c).
+report_alloc_sample = rffi.llexternal('pypy_report_alloc_sample',
+                                      [lltype.Signed, lltype.Signed],
+                                      lltype.Void,
+                                      sandboxsafe=True, _nowrapper=True)
+
 
 FORWARDSTUB = lltype.GcStruct('forwarding_stub',
                               ('forw', llmemory.Address))
@@ -266,6 +346,36 @@ class IncrementalMiniMarkGC(MovingGCBase):
         # minimal allocated size of the nursery is 2x the following
         # number (by default, at least 132KB on 32-bit and 264KB on 64-bit).
         "large_object": (16384+512)*WORD,
+
+        # Target duration of an incremental major collection step, in
+        # ticks of read_timestamp(), whose unit depends on the platform:
+        # see PYPY_GC_MAX_PAUSE above.  0 means no pacing.
+        "max_pause": 0,
+
+        # Upper bound for the nursery when it is resized according to the
+        # survival rate of minor collections.  0 means a fixed nursery.
+        "max_nursery_size": 0,
+
+        # Fill ratio of the arenas below which compact_arenas() moves
+        # objects out of them.  0.0 disables it.
+        "compact_fill": 0.0,
+
+        # Number of bytes allocated in the nursery between two allocation
+        # samples.  0 disables the sampling.
+        "alloc_sample_interval": 0,
+
+        # Size of the per-thread allocation chunks carved out of the
+        # nursery.  0 means that all threads share the nursery.
+        "thread_chunk_size": 0,
+
+        # Objects of at least 'los_min_size' bytes that are allocated
+        # outside the nursery go to the large object space instead of
+        # malloc().  It keeps up to 'los_cache_size' bytes of free
+        # ranges mapped, without their physical memory.  0 disables it;
+        # it is off by default until it is shown to pay off on benchmarks,
+        # and can be enabled with PYPY_GC_LOS_MIN.
+        "los_min_size": 0,
+        "los_cache_size": 64*1024*1024,
         }
 
     def __init__(self, config,
@@ -279,12 +389,28 @@ class IncrementalMiniMarkGC(MovingGCBase):
                  growth_rate_max=2.5,   # for tests
                  card_page_indices=0,
                  large_object=8*WORD,
+                 max_pause=0,
+                 max_nursery_size=0,
+                 compact_fill=0.0,
+                 alloc_sample_interval=0,
+                 thread_chunk_size=0,
+                 los_min_size=0,
+                 los_cache_size=0,
                  ArenaCollectionClass=None,
                  **kwds):
         MovingGCBase.__init__(self, config, **kwds)
         assert small_request_threshold % WORD == 0
         self.read_from_env = read_from_env
         self.nursery_size = nursery_size
+        #
+        # The bounds within which the nursery is resized, set by
+        # allocate_nursery().  See _resize_nursery().
+        self.max_nursery_size = max_nursery_size
+        self.nursery_size_min = nursery_size
+        self.nursery_size_max = nursery_size
+        self.nursery_survival_rate = 0.0
+        self.compact_fill = compact_fill
+        self.live_arena_memory = 0    # computed by compact_arenas_if_fragmented()
         
         self.small_request_threshold = small_request_threshold
         self.major_collection_threshold = major_collection_threshold
@@ -295,6 +421,56 @@ class IncrementalMiniMarkGC(MovingGCBase):
         self.max_heap_size_already_raised = False
         self.max_delta = float(r_uint(-1))
         self.max_number_of_pinned_objects = 0      # computed later
+        # set if the corresponding value was given explicitly by an env
+        # var; otherwise it follows the nursery size, see _resize_nursery()
+        self.explicit_min_heap_size = False
+        self.explicit_gc_increment_step = False
+        self.explicit_max_pinned = False
+        #
+        # Pacing of the major collection steps, see _record_gc_step()
+        self.max_pause = float(max_pause)
+        self.gc_step_scale = 1.0
+        self.pause_histogram = lltype.malloc(
+            rffi.CArray(lltype.Signed), PAUSE_HISTOGRAM_SIZE,
+            flavor='raw', zero=True, immortal=True)
+        self.longest_pause = 0.0
+        self.num_pauses_over_target = 0
+        #
+        # Cumulative statistics for rgc.get_gc_stat()
+        from rpython.memory.gc.gcstats import GCStats
+        self.stats = GCStats()
+        self.num_cards_scanned = 0
+        #
+        # Allocation sampling: while it is enabled, 'nursery_top' is
+        # lowered to the point where the next sample should be taken, and
+        # the real value is kept in 'sampled_nursery_top'.  The number of
+        # bytes left before that point is 'alloc_sample_countdown', counted
+        # from 'alloc_sample_start'; it carries over from one allocation
+        # area to the next, and over minor collections.
+        self.alloc_sample_interval = alloc_sample_interval
+        self.alloc_sample_countdown = alloc_sample_interval
+        self.alloc_sample_start = llmemory.NULL
+        self.sampled_nursery_top = llmemory.NULL
+        self.num_allocation_samples = 0
+        self.allocation_samples = []     # only when untranslated, for tests
+        #
+        # Per-thread allocation chunks: while they are in use, the current
+        # thread allocates between nursery_free and nursery_top, which is
+        # at most 'thread_chunk_size' bytes; new chunks are carved at
+        # 'chunk_frontier', up to 'chunk_limit'.  The chunks of the other
+        # threads are remembered in the 'thread_chunk_*' arrays.
+        self.thread_chunk_size = thread_chunk_size
+        self.chunk_frontier = llmemory.NULL
+        self.chunk_limit = llmemory.NULL
+        self.active_thread = 0
+        self.num_thread_chunks = 0
+        self.thread_chunk_tids = lltype.malloc(
+            rffi.CArray(lltype.Signed), THREAD_CHUNK_SLOTS,
+            flavor='raw', zero=True, immortal=True)
+        self.thread_chunk_free = lltype.malloc(
+            NURSARRAY, THREAD_CHUNK_SLOTS, flavor='raw', immortal=True)
+        self.thread_chunk_top = lltype.malloc(
+            NURSARRAY, THREAD_CHUNK_SLOTS, flavor='raw', immortal=True)
         #
         self.card_page_indices = card_page_indices
         if self.card_page_indices > 0:
@@ -320,6 +496,12 @@ class IncrementalMiniMarkGC(MovingGCBase):
         self.ac = ArenaCollectionClass(arena_size, page_size,
                                        small_request_threshold)
         #
+        # The LargeObjectSpace() handles the external objects of at least
+        # 'los_min_size' bytes.
+        from rpython.memory.gc import largeobjspace
+        self.los_min_size = los_min_size
+        self.los = largeobjspace.LargeObjectSpace(los_cache_size)
+        #
         # Used by minor collection: a list of (mostly non-young) objects that
         # (may) contain a pointer to a young object.  Populated by
         # the write barrier: when we clear GCFLAG_TRACK_YOUNG_PTRS, we
@@ -439,6 +621,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             min_heap_size = env.read_uint_from_env('PYPY_GC_MIN')
             if min_heap_size > 0:
                 self.min_heap_size = float(min_heap_size)
+                self.explicit_min_heap_size = True
             else:
                 # defaults to 8 times the nursery
                 self.min_heap_size = newsize * 8
@@ -456,6 +639,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             gc_increment_step = env.read_uint_from_env('PYPY_GC_INCREMENT_STEP')
             if gc_increment_step > 0:
                 self.gc_increment_step = gc_increment_step
+                self.explicit_gc_increment_step = True
             else:
                 self.gc_increment_step = newsize * 4
             #
@@ -464,6 +648,30 @@ class IncrementalMiniMarkGC(MovingGCBase):
                 self.gc_nursery_debug = True
             else:
                 self.gc_nursery_debug = False
+            #
+            max_pause = env.read_uint_from_env('PYPY_GC_MAX_PAUSE')
+            if max_pause > 0:
+                self.max_pause = float(max_pause)
+            #
+            max_nursery_size = env.read_uint_from_env('PYPY_GC_NURSERY_MAX')
+            if max_nursery_size > 0:
+                self.max_nursery_size = intmask(max_nursery_size)
+            #
+            compact_fill = env.read_float_from_env('PYPY_GC_COMPACT')
+            if 0.0 < compact_fill < 1.0:
+                self.compact_fill = compact_fill
+            #
+            alloc_sample = env.read_uint_from_env('PYPY_GC_ALLOC_SAMPLE')
+            if alloc_sample > 0:
+                self.alloc_sample_interval = intmask(alloc_sample)
+            #
+            if os.environ.get('PYPY_GC_LOS_MIN'):
+                los_min_size = env.read_uint_from_env('PYPY_GC_LOS_MIN')
+                self.los_min_size = intmask(los_min_size)    # 0 disables
+            #
+            thread_chunk = env.read_uint_from_env('PYPY_GC_THREAD_CHUNK')
+            if thread_chunk > 0:
+                self.thread_chunk_size = intmask(thread_chunk) & ~(WORD-1)
             self.minor_collection()    # to empty the nursery
             llarena.arena_free(self.nursery)
             self.nursery_size = newsize
@@ -478,6 +686,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             #
             if env_max_number_of_pinned_objects >= 0: # 0 allows to disable pinning completely
                 self.max_number_of_pinned_objects = env_max_number_of_pinned_objects
+                self.explicit_max_pinned = True
         else:
             # Estimate this number conservatively
             bigobj = self.nonlarge_max + 1
@@ -485,7 +694,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
 
     def _nursery_memory_size(self):
         extra = self.nonlarge_max + 1
-        return self.nursery_size + extra
+        return self.nursery_size_max + extra
 
     def _alloc_nursery(self):
         # the start of the nursery: we actually allocate a bit more for
@@ -500,6 +709,13 @@ class IncrementalMiniMarkGC(MovingGCBase):
     def allocate_nursery(self):
         debug_start("gc-set-nursery-size")
         debug_print("nursery size:", self.nursery_size)
+        # the memory for the largest size that the nursery can be
+        # resized to is reserved here; see _resize_nursery().
+        self.nursery_size_min = self.nursery_size
+        self.nursery_size_max = max(self.nursery_size, self.max_nursery_size)
+        self.nursery_survival_rate = 0.0
+        if self.nursery_size_max > self.nursery_size:
+            debug_print("nursery max size:", self.nursery_size_max)
         self.nursery = self._alloc_nursery()
         # the current position in the nursery:
         self.nursery_free = self.nursery
@@ -516,6 +732,9 @@ class IncrementalMiniMarkGC(MovingGCBase):
         self.next_major_collection_threshold = self.min_heap_size
         self.set_major_threshold_from(0.0)
         ll_assert(self.extra_threshold == 0, "extra_threshold set too early")
+        if self.alloc_sample_interval > 0:
+            self.alloc_sample_countdown = self.alloc_sample_interval
+            self.lower_nursery_top_for_sampling()
         debug_stop("gc-set-nursery-size")
 
 
@@ -620,7 +839,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             result = self.nursery_free
             self.nursery_free = new_free = result + totalsize
             if new_free > self.nursery_top:
-                result = self.collect_and_reserve(totalsize)
+                result = self.collect_and_reserve(typeid, totalsize)
             #
             # Build the object.
             llarena.arena_reserve(result, totalsize)
@@ -679,7 +898,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             result = self.nursery_free
             self.nursery_free = new_free = result + totalsize
             if new_free > self.nursery_top:
-                result = self.collect_and_reserve(totalsize)
+                result = self.collect_and_reserve(typeid, totalsize)
             #
             # Build the object.
             llarena.arena_reserve(result, totalsize)
@@ -708,13 +927,35 @@ class IncrementalMiniMarkGC(MovingGCBase):
             self.minor_and_major_collection()
 
 
-    def collect_and_reserve(self, totalsize):
+    def collect_and_reserve(self, typeid, totalsize):
         """To call when nursery_free overflows nursery_top.
         First check if pinned objects are in front of nursery_top. If so,
         jump over the pinned object and try again to reserve totalsize.
         Otherwise do a minor collection, and possibly a major collection, and
         finally reserve totalsize bytes.
         """
+        self.count_sampled_bytes(self.nursery_free - totalsize)
+        if self.sampled_nursery_top:
+            self.restore_nursery_top()
+            if self.nursery_free <= self.nursery_top:
+                # nursery_top was only lowered to take an allocation sample
+                result = self.nursery_free - totalsize
+                self.sample_reserved_object(typeid, result, totalsize)
+                return result
+
+        if self.chunk_limit:
+            # the chunk of the current thread is full: take a new one
+            result = self.carve_thread_chunk(totalsize)
+            if result:
+                if self.alloc_sample_interval > 0:
+                    self.sample_reserved_object(typeid, result, totalsize)
+                return result
+            # no room left: go back to a single allocation area, which
+            # is the end of the nursery or the next pinned object
+            self.nursery_free = self.chunk_frontier
+            self.nursery_top = self.chunk_limit
+            self.chunk_frontier = llmemory.NULL
+            self.chunk_limit = llmemory.NULL
 
         minor_collection_count = 0
         while True:
@@ -787,6 +1028,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
                         # The nursery might not be empty now, because of
                         # execute_finalizers().  If it is almost full again,
                         # we need to fix it with another call to minor_collection().
+                        self.restore_nursery_top()
                         if self.nursery_free + totalsize > self.nursery_top:
                             self.minor_collection()
                     #
@@ -797,7 +1039,9 @@ class IncrementalMiniMarkGC(MovingGCBase):
             #
             # Tried to do something about nursery_free overflowing
             # nursery_top before this point. Try to reserve totalsize now.
-            # If this succeeds break out of loop.
+            # If this succeeds break out of loop.  (The minor collection
+            # may have lowered nursery_top for the sampling: undo that.)
+            self.restore_nursery_top()
             result = self.nursery_free
             if self.nursery_free + totalsize <= self.nursery_top:
                 self.nursery_free = result + totalsize
@@ -809,9 +1053,122 @@ class IncrementalMiniMarkGC(MovingGCBase):
             if self.nursery_top - self.nursery_free > self.debug_tiny_nursery:
                 self.nursery_free = self.nursery_top - self.debug_tiny_nursery
         #
+        if self.thread_chunk_size > 0:
+            self.chunk_limit = self.nursery_top
+            self.set_thread_chunk_top()
+        if self.alloc_sample_interval > 0:
+            self.sample_reserved_object(typeid, result, totalsize)
         return result
     collect_and_reserve._dont_inline_ = True
 
+    def carve_thread_chunk(self, totalsize):
+        """Reserve 'totalsize' bytes at the start of a new chunk for the
+        current thread.  Returns NULL if there is no room left for it
+        before 'chunk_limit'."""
+        result = self.chunk_frontier
+        if result + totalsize > self.chunk_limit:
+            return llmemory.NULL
+        self.nursery_free = result + totalsize
+        self.set_thread_chunk_top()
+        return result
+
+    def set_thread_chunk_top(self):
+        if self.chunk_limit - self.nursery_free > self.thread_chunk_size:
+            self.nursery_top = self.nursery_free + self.thread_chunk_size
+        else:
+            self.nursery_top = self.chunk_limit
+        self.chunk_frontier = self.nursery_top
+
+    def switch_thread_nursery(self, old_tid, new_tid):
+        """Remember the allocation chunk of 'old_tid', unless it is 0,
+        and continue in the chunk of 'new_tid', if it still has one.
+        Otherwise, its next allocation carves a new chunk.  No GC
+        operation here: it is called by the root walker in the middle
+        of switching threads."""
+        if self.thread_chunk_size <= 0:
+            return
+        self.count_sampled_bytes(self.nursery_free)
+        self.restore_nursery_top()
+        if not self.chunk_limit:
+            # the current thread owns all the rest of the allocation
+            # area: cut its chunk there, the others come after
+            self.chunk_limit = self.nursery_top
+            self.set_thread_chunk_top()
+        n = self.num_thread_chunks
+        if old_tid != 0 and n < THREAD_CHUNK_SLOTS:
+            self.thread_chunk_tids[n] = old_tid
+            self.thread_chunk_free[n] = self.nursery_free
+            self.thread_chunk_top[n] = self.nursery_top
+            self.num_thread_chunks = n + 1
+        self.active_thread = new_tid
+        i = 0
+        while i < self.num_thread_chunks:
+            if self.thread_chunk_tids[i] == new_tid:
+                self.nursery_free = self.thread_chunk_free[i]
+                self.nursery_top = self.thread_chunk_top[i]
+                n = self.num_thread_chunks - 1
+                self.thread_chunk_tids[i] = self.thread_chunk_tids[n]
+                self.thread_chunk_free[i] = self.thread_chunk_free[n]
+                self.thread_chunk_top[i] = self.thread_chunk_top[n]
+                self.num_thread_chunks = n
+                if self.alloc_sample_interval > 0:
+                    self.lower_nursery_top_for_sampling()
+                return
+            i += 1
+        self.nursery_free = self.chunk_frontier
+        self.nursery_top = self.chunk_frontier
+
+    def lower_nursery_top_for_sampling(self):
+        """Start counting the allocations from 'nursery_free'.  If the
+        next sampling point is before nursery_top, make the allocation
+        that crosses it go to collect_and_reserve().  The JIT reads
+        nursery_top too, so this also samples the allocations done by
+        machine code.  Otherwise the countdown continues in the next
+        allocation area."""
+        self.restore_nursery_top()
+        self.alloc_sample_start = self.nursery_free
+        countdown = self.alloc_sample_countdown
+        if countdown < 0:
+            countdown = 0
+        if self.nursery_top - self.nursery_free > countdown:
+            self.sampled_nursery_top = self.nursery_top
+            self.nursery_top = self.nursery_free + countdown
+
+    def count_sampled_bytes(self, free):
+        """Subtract from the countdown the bytes allocated between
+        'alloc_sample_start' and 'free', which is where the current
+        allocation area stops being used."""
+        if self.alloc_sample_start:
+            self.alloc_sample_countdown -= free - self.alloc_sample_start
+            self.alloc_sample_start = llmemory.NULL
+
+    def sample_reserved_object(self, typeid, result, totalsize):
+        """Count the object that collect_and_reserve() reserved at 'result'
+        and take a sample of it if it reaches the sampling point."""
+        self.count_sampled_bytes(result)
+        self.alloc_sample_countdown -= raw_malloc_usage(totalsize)
+        if self.alloc_sample_countdown <= 0:
+            self.record_allocation_sample(typeid, totalsize)
+            self.alloc_sample_countdown = self.alloc_sample_interval
+        self.lower_nursery_top_for_sampling()
+
+    def restore_nursery_top(self):
+        if self.sampled_nursery_top:
+            self.nursery_top = self.sampled_nursery_top
+            self.sampled_nursery_top = llmemory.NULL
+
+    def record_allocation_sample(self, typeid, totalsize):
+        if llop.is_group_member_nonzero(lltype.Bool, typeid):
+            typeindex = self.get_member_index(typeid)
+        else:
+            typeindex = -1    # the JIT's malloc_nursery doesn't know it
+        size = raw_malloc_usage(totalsize)
+        self.num_allocation_samples += 1
+        if we_are_translated():
+            report_alloc_sample(typeindex, size)
+        else:
+            self.allocation_samples.append((typeindex, size))
+
 
     def external_malloc(self, typeid, length, alloc_young):
         """Allocate a large object using the ArenaCollection or
@@ -922,7 +1279,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
             # is just the same as raw_malloc(), but allows the extra
             # flexibility of saying that we have extra words in the header.
             # The memory returned is not cleared.
-            arena = llarena.arena_malloc(allocsize, 0)
+            arena = self.external_malloc_memory(allocsize)
             if not arena:
                 raise MemoryError("cannot allocate large object")
             #
@@ -977,6 +1334,9 @@ class IncrementalMiniMarkGC(MovingGCBase):
         if self.next_major_collection_threshold < 0:
             # cannot trigger a full collection now, but we can ensure
             # that one will occur very soon
+            self.count_sampled_bytes(self.nursery_free)
+            self.restore_nursery_top()
+            self.chunk_frontier = self.chunk_limit
             self.nursery_free = self.nursery_top
 
     def can_optimize_clean_setarrayitems(self):
@@ -986,7 +1346,11 @@ class IncrementalMiniMarkGC(MovingGCBase):
 
     def can_move(self, obj):
         """Overrides the parent can_move()."""
-        return self.is_in_nursery(obj)
+        if self.is_in_nursery(obj):
+            return True
+        # the caller may now rely on the address of 'obj'
+        self.header(obj).tid |= GCFLAG_NO_EVACUATE
+        return False
 
     def pin(self, obj):
         if self.pinned_objects_in_nursery >= self.max_number_of_pinned_objects:
@@ -1100,6 +1464,8 @@ class IncrementalMiniMarkGC(MovingGCBase):
 
         if self.nursery <= addr < self.nursery_top:
             return True      # addr is in the nursery
+        if self.chunk_limit and self.nursery <= addr < self.chunk_frontier:
+            return True      # addr is in the chunk of another thread
         #
         # Else, it may be in the set 'young_rawmalloced_objects'
         return (bool(self.young_rawmalloced_objects) and
@@ -1139,6 +1505,9 @@ class IncrementalMiniMarkGC(MovingGCBase):
         """
         return self.ac.total_memory_used + self.rawmalloced_total_size
 
+    def get_gc_stat(self, event, index):
+        return self.stats.get(event, index)
+
     def threshold_reached(self, extra=0):
         return (self.next_major_collection_threshold -
                 float(self.get_total_memory_used())) < float(extra)
@@ -1563,6 +1932,10 @@ class IncrementalMiniMarkGC(MovingGCBase):
         that remain alive and move them out."""
         #
         debug_start("gc-minor")
+        start = read_timestamp()
+        #
+        # The allocation sampling goes on in the emptied nursery.
+        self.count_sampled_bytes(self.nursery_free)
         #
         # All nursery barriers are invalid from this point on.  They
         # are evaluated anew as part of the minor collection.
@@ -1576,6 +1949,16 @@ class IncrementalMiniMarkGC(MovingGCBase):
         # inside the nursery. We reset it here and increase it in
         # '_trace_drag_out()'.
         any_pinned_object_from_earlier = self.any_pinned_object_kept
+        if self.chunk_limit:
+            nursery_used = (llarena.getfakearenaaddress(self.chunk_frontier) -
+                            self.nursery)
+        elif self.nursery_free:
+            nursery_used = (llarena.getfakearenaaddress(self.nursery_free) -
+                            self.nursery)
+        else:
+            # called from collect_and_reserve(): the nursery is full
+            nursery_used = (llarena.getfakearenaaddress(self.nursery_top) -
+                            self.nursery)
         self.pinned_objects_in_nursery = 0
         self.any_pinned_object_kept = False
         #
@@ -1601,6 +1984,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
         # are copied out or flagged.  They are also added to the list
         # 'old_objects_pointing_to_young'.
         self.nursery_surviving_size = 0
+        self.num_cards_scanned = 0
         self.collect_roots_in_nursery(any_pinned_object_from_earlier)
         #
         # visit all objects that are known for pointing to pinned
@@ -1707,6 +2091,12 @@ class IncrementalMiniMarkGC(MovingGCBase):
         else:
             llarena.arena_reset(prev, self.nursery + self.nursery_size - prev, 0)
         #
+        # the nursery is now empty, unless it contains pinned objects:
+        # this is the point where its size can change.
+        if (self.nursery_size_max > self.nursery_size_min and
+                self.pinned_objects_in_nursery == 0):
+            self._resize_nursery(nursery_used)
+        #
         # always add the end of the nursery to the list
         nursery_barriers.append(self.nursery + self.nursery_size)
         #
@@ -1716,6 +2106,12 @@ class IncrementalMiniMarkGC(MovingGCBase):
         # XXX gc-minimark-pinning does a debug_rotate_nursery() here (groggi)
         self.nursery_free = self.nursery
         self.nursery_top = self.nursery_barriers.popleft()
+        self.sampled_nursery_top = llmemory.NULL
+        self.chunk_frontier = llmemory.NULL
+        self.chunk_limit = llmemory.NULL
+        self.num_thread_chunks = 0
+        if self.alloc_sample_interval > 0:
+            self.lower_nursery_top_for_sampling()
         #
         # clear GCFLAG_PINNED_OBJECT_PARENT_KNOWN from all parents in the list.
         self.old_objects_pointing_to_pinned.foreach(
@@ -1730,8 +2126,50 @@ class IncrementalMiniMarkGC(MovingGCBase):
         #
         self.root_walker.finished_minor_collection()
         #
+        stats = self.stats
+        stats.record(rgc.GCSTAT_MINOR_PAUSE, intmask(read_timestamp() - start))
+        stats.record(rgc.GCSTAT_PROMOTED, self.nursery_surviving_size)
+        stats.record(rgc.GCSTAT_CARD_SCANS, self.num_cards_scanned)
+        stats.record(rgc.GCSTAT_PINNED, self.pinned_objects_in_nursery)
         debug_stop("gc-minor")
 
+    def _resize_nursery(self, nursery_used):
+        # Grow the nursery when a large fraction of it survives minor
+        # collections: the objects get more time to die before we
+        # promote them.  Shrink it back when most objects die young, to
+        # keep the nursery in the cache.  The memory is already reserved
+        # up to 'nursery_size_max', so this only moves the end.
+        if nursery_used < self.nursery_size // 2:
+            return     # e.g. an explicit collect(), not representative
+        rate = float(self.nursery_surviving_size) / nursery_used
+        rate = (self.nursery_survival_rate + rate) * 0.5
+        self.nursery_survival_rate = rate
+        newsize = self.nursery_size
+        if rate > NURSERY_GROW_SURVIVAL:
+            if newsize > self.nursery_size_max // 2:
+                newsize = self.nursery_size_max
+            else:
+                newsize = newsize * 2
+        elif rate < NURSERY_SHRINK_SURVIVAL:
+            newsize = (newsize // 2) & ~(WORD-1)
+            if newsize < self.nursery_size_min:
+                newsize = self.nursery_size_min
+        if newsize != self.nursery_size:
+            debug_print("nursery resized to", newsize,
+                        "with survival rate", rate)
+            oldsize = self.nursery_size
+            self.nursery_size = newsize
+            #
+            # the values that setup() derived from the nursery size
+            # follow it, unless they were given explicitly
+            if not self.explicit_gc_increment_step:
+                self.gc_increment_step = newsize * 4
+            if not self.explicit_max_pinned:
+                bigobj = self.nonlarge_max + 1
+                self.max_number_of_pinned_objects = newsize / (bigobj * 2)
+            if not self.explicit_min_heap_size:
+                self.min_heap_size = self.min_heap_size / oldsize * newsize
+
     def _reset_flag_old_objects_pointing_to_pinned(self, obj, ignore):
         assert self.header(obj).tid & GCFLAG_PINNED_OBJECT_PARENT_KNOWN
         self.header(obj).tid &= ~GCFLAG_PINNED_OBJECT_PARENT_KNOWN
@@ -1815,6 +2253,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
                                           "premature end of object")
                             self.trace_and_drag_out_of_nursery_partial(
                                 obj, interval_start, interval_stop)
+                            self.num_cards_scanned += 1
                         #
                         interval_start = interval_stop
                         cardbyte >>= 1
@@ -1957,8 +2396,11 @@ class IncrementalMiniMarkGC(MovingGCBase):
             newhdr = newobj - size_gc_header
             #
             # Remove the flag GCFLAG_HAS_SHADOW, so that it doesn't get
-            # copied to the shadow itself.
+            # copied to the shadow itself.  The id() or identityhash() of
+            # the object is the address of the shadow, which must not be
+            # moved any more: add GCFLAG_NO_EVACUATE to the copy.
             self.header(obj).tid &= ~GCFLAG_HAS_SHADOW
+            self.header(obj).tid |= GCFLAG_NO_EVACUATE
             #
             totalsize = size_gc_header + self.get_size(obj)
         #
@@ -2037,7 +2479,7 @@ class IncrementalMiniMarkGC(MovingGCBase):
         ll_assert(raw_malloc_usage(totalsize) & (WORD-1) == 0,
                   "misaligned totalsize in _malloc_out_of_nursery_nonsmall")
         #
-        arena = llarena.arena_malloc(raw_malloc_usage(totalsize), False)
+        arena = self.external_malloc_memory(raw_malloc_usage(totalsize))
         if not arena:
             out_of_memory("out of memory: couldn't allocate a few KB more")
         llarena.arena_reserve(arena, totalsize)
@@ -2101,6 +2543,8 @@ class IncrementalMiniMarkGC(MovingGCBase):
     # Note - minor collections seem fast enough so that one
     # is done before every major collection step
     def major_collection_step(self, reserving_size=0):
+        start = read_timestamp()
+        state = self.gc_state
         debug_start("gc-collect-step")
         debug_print("starting gc state: ", GC_STATES[self.gc_state])
         # Debugging checks
@@ -2155,11 +2599,14 @@ class IncrementalMiniMarkGC(MovingGCBase):
                         self.objects_to_trace.length(),
                         "plus",
                         self.more_objects_to_trace.length())
-            estimate = self.gc_increment_step
-            estimate_from_nursery = self.nursery_surviving_size * 2
+            # The pacing can scale down the step, but never below twice
+            # the size of the objects that the last minor collection
+            # promoted: with less, the marking could fall behind and
+            # the major collection would never finish.
+            estimate = self.paced_step_size(intmask(self.gc_increment_step))
+            estimate_from_nursery = intmask(self.nursery_surviving_size * 2)
             if estimate_from_nursery > estimate:
                 estimate = estimate_from_nursery
-            estimate = intmask(estimate)
             remaining = self.visit_all_objects_step(estimate)
             #
             if remaining >= estimate // 2:
@@ -2200,6 +2647,10 @@ class IncrementalMiniMarkGC(MovingGCBase):
                 # Light finalizers
                 if self.old_objects_with_light_finalizers.non_empty():
                     self.deal_with_old_objects_with_finalizers()
+                #
+                # Rarely, move objects out of sparsely used arenas
+                if self.compact_fill > 0.0:
+                    self.compact_arenas_if_fragmented()
                 # objects_to_trace processed fully, can move on to sweeping
                 self.ac.mass_free_prepare()
                 self.start_free_rawmalloc_objects()
@@ -2222,18 +2673,23 @@ class IncrementalMiniMarkGC(MovingGCBase):
             if self.raw_malloc_might_sweep.non_empty():
                 # Walk all rawmalloced objects and free the ones that don't
                 # have the GCFLAG_VISITED flag.  Visit at most 'limit' objects.
-                # This limit is conservatively high enough to guarantee that
-                # a total object size of at least '3 * nursery_size' bytes
-                # is processed.
+                # Without pacing, this limit is conservatively high enough to
+                # guarantee that a total object size of at least
+                # '3 * nursery_size' bytes is processed.  The pacing may
+                # scale it down: sweeping only walks the objects that
+                # existed when the marking finished, so it still finishes.
                 limit = 3 * self.nursery_size // self.small_request_threshold
+                limit = self.paced_step_size(limit)
                 self.free_unvisited_rawmalloc_objects_step(limit)
                 done = False    # the 2nd half below must still be done
             else:
                 # Ask the ArenaCollection to visit a fraction of the objects.
                 # Free the ones that have not been visited above, and reset
                 # GCFLAG_VISITED on the others.  Visit at most '3 *
-                # nursery_size' bytes.
+                # nursery_size' bytes, or a fraction of it with pacing
+                # (see above).
                 limit = 3 * self.nursery_size // self.ac.page_size
+                limit = self.paced_step_size(limit)
                 done = self.ac.mass_free_incremental(self._free_if_unvisited,
                                                      limit)
             # XXX tweak the limits above
@@ -2291,6 +2747,71 @@ class IncrementalMiniMarkGC(MovingGCBase):
 
         debug_print("stopping, now in gc state: ", GC_STATES[self.gc_state])
         debug_stop("gc-collect-step")
+        self._record_gc_step(state, read_timestamp() - start)
+
+    def paced_step_size(self, amount):
+        """Scale the amount of work of a major collection step according
+        to the pacing."""
+        if self.max_pause > 0.0:
+            amount = int(amount * self.gc_step_scale)
+            if amount < 1:
+                amount = 1
+        return amount
+
+    def _record_gc_step(self, state, elapsed):
+        self.stats.record(rgc.GCSTAT_MAJOR_STEP, intmask(elapsed))
+        duration = float(elapsed)
+        if duration < 0.0:
+            duration = 0.0
+        i = 0
+        limit = 1.0
+        while limit <= duration and i < PAUSE_HISTOGRAM_SIZE - 1:
+            limit *= 2.0
+            i += 1
+        self.pause_histogram[i] += 1
+        if duration > self.longest_pause:
+            self.longest_pause = duration
+        #
+        if self.max_pause > 0.0:
+            if duration > self.max_pause:
+                self.num_pauses_over_target += 1
+            # Only the marking and sweeping steps have a variable amount
+            # of work.  Scale it proportionally to how far the step was
+            # from the target, growing by at most 2x at a time.
+            if state == STATE_MARKING or state == STATE_SWEEPING:
+                scale = self.gc_step_scale * 2.0
+                if duration > 0.0:
+                    target = self.gc_step_scale * (
+                        self.max_pause * PACING_HEADROOM / duration)
+                    if target < scale:
+                        scale = target
+                if scale < GC_STEP_SCALE_MIN:
+                    scale = GC_STEP_SCALE_MIN
+                if scale > GC_STEP_SCALE_MAX:
+                    scale = GC_STEP_SCALE_MAX
+                self.gc_step_scale = scale
+        #
+        if state == STATE_SWEEPING and self.gc_state != STATE_SWEEPING:
+            self._report_pauses()
+
+    def _report_pauses(self):
+        # Called at the end of every major collection.
+        debug_start("gc-pause-histogram")
+        i = 0
+        while i < PAUSE_HISTOGRAM_SIZE:
+            if self.pause_histogram[i] > 0:
+                debug_print("steps under 2 **", i, "ticks:",
+                            self.pause_histogram[i])
+                self.pause_histogram[i] = 0
+            i += 1
+        debug_print("longest step:", self.longest_pause, "ticks")
+        if self.max_pause > 0.0:
+            debug_print("target:", self.max_pause, "ticks, exceeded",
+                        self.num_pauses_over_target, "times, step scale",
+                        self.gc_step_scale)
+        self.longest_pause = 0.0
+        self.num_pauses_over_target = 0
+        debug_stop("gc-pause-histogram")
 
     def _sweep_old_objects_pointing_to_pinned(self, obj, new_list):
         if self.header(obj).tid & GCFLAG_VISITED:
@@ -2307,6 +2828,136 @@ class IncrementalMiniMarkGC(MovingGCBase):
     def _reset_gcflag_visited(self, obj, ignored):
         self.header(obj).tid &= ~GCFLAG_VISITED
 
+    # ----------
+    # Compaction
+
+    def compact_arenas_if_fragmented(self):
+        # Called at the end of marking, when the live objects are exactly
+        # the ones with GCFLAG_VISITED.  Only worth it if the arenas are
+        # used at less than 'compact_fill' overall.  This is measured on
+        # the visited objects while adding up the evacuation costs:
+        # 'ac.total_memory_used' still counts the dead objects until
+        # they are swept.
+        if self.nursery_objects_shadows.length() > 0:
+            return    # pinned objects have shadows, which must not move
+        self.live_arena_memory = 0
+        self.ac.add_up_evacuation_costs(self._evacuation_cost)
+        capacity = float(self.ac.num_arenas) * self.ac.arena_size
+        if float(self.live_arena_memory) < capacity * self.compact_fill:
+            self.compact_arenas()
+
+    def compact_arenas(self):
+        """Move the live objects out of the arenas that they fill at less
+        than 'compact_fill', fix all references to them, and free these
+        arenas.  Objects that cannot move keep their arena alive.  Must
+        be called after ac.add_up_evacuation_costs()."""
+        debug_start("gc-compact")
+        num_arenas = self.ac.select_arenas_to_evacuate(self.compact_fill)
+        debug_print("evacuating", num_arenas, "of", self.ac.num_arenas,
+                    "arenas")
+        if num_arenas > 0:
+            self.num_evacuated_objects = 0
+            self.ac.evacuate_arenas(self._evacuate_block)
+            debug_print("moved", self.num_evacuated_objects, "objects")
+            #
+            # Fix the references to the moved objects: from the roots,
+            # from the live objects, and from the GC's own lists.
+            self.prebuilt_root_objects.foreach(self._update_refs_in_obj,
+                                               None)
+            self.root_walker.walk_roots(
+                IncrementalMiniMarkGC._update_ref_stk,  # stack roots
+                IncrementalMiniMarkGC._update_ref_stk,  # static in prebuilt
+                None)
+            self.ac.walk_all_blocks(self._update_refs_in_block, None)
+            self.old_rawmalloced_objects.foreach(
+                self._update_refs_if_visited, None)
+            self.old_objects_with_weakrefs.foreach(
+                self._update_weakref_target, None)
+            if self.old_objects_pointing_to_pinned.non_empty():
+                new_old_objects_pointing_to_pinned = self.AddressStack()
+                self.old_objects_pointing_to_pinned.foreach(
+                    self._copy_forwarded, new_old_objects_pointing_to_pinned)
+                self.old_objects_pointing_to_pinned.delete()
+                self.old_objects_pointing_to_pinned = \
+                        new_old_objects_pointing_to_pinned
+            #
+            self.ac.free_evacuated_arenas()
+        debug_stop("gc-compact")
+
+    def _evacuation_cost(self, hdr, ignored):
+        size_gc_header = self.gcheaderbuilder.size_gc_header
+        obj = hdr + size_gc_header
+        tid = self.header(obj).tid
+        if tid & GCFLAG_VISITED == 0:
+            return 0      # dead, freed together with its arena
+        totalsize = raw_malloc_usage(size_gc_header + self.get_size(obj))
+        self.live_arena_memory += totalsize
+        typeid = self.get_type_id(obj)
+        if (tid & (GCFLAG_NO_EVACUATE | GCFLAG_HAS_SHADOW) or
+                totalsize < raw_malloc_usage(size_gc_header +
+                                     llmemory.sizeof(FORWARDSTUB)) or
+                self.getfinalizer(typeid) or
+                self.getlightfinalizer(typeid) or
+                self.weakpointer_offset(typeid) >= 0):
+            # this object cannot move, and so neither can its arena
+            return self.ac.arena_size
+        return totalsize
+
+    def _evacuate_block(self, hdr, ignored):
+        size_gc_header = self.gcheaderbuilder.size_gc_header
+        obj = hdr + size_gc_header
+        if self.header(obj).tid & GCFLAG_VISITED == 0:
+            return 0
+        totalsize = size_gc_header + self.get_size(obj)
+        newhdr = self.ac.malloc(totalsize)
+        llmemory.raw_memcopy(hdr, newhdr, totalsize)
+        #
+        # Leave a forwarding stub, like for the nursery objects.
+        obj = llarena.getfakearenaaddress(obj)
+        llarena.arena_reset(obj - size_gc_header, totalsize, 0)
+        llarena.arena_reserve(obj - size_gc_header,
+                              size_gc_header + llmemory.sizeof(FORWARDSTUB))
+        self.header(obj).tid = -42
+        llmemory.cast_adr_to_ptr(obj, FORWARDSTUBPTR).forw = (
+            newhdr + size_gc_header)
+        self.num_evacuated_objects += 1
+        return 0
+
+    def _forwarded(self, obj):
+        # Like is_forwarded(), for old objects.  No live object has
+        # GCFLAG_FINALIZATION_ORDERING after deal_with_objects_with_
+        # finalizers(), so only the forwarding stubs have it.
+        if (self.is_valid_gc_object(obj) and
+                self.header(obj).tid & GCFLAG_FINALIZATION_ORDERING):
+            ll_assert(self.header(obj).tid == -42, "bogus forwarded header")
+            return self.get_forwarding_address(obj)
+        return obj
+
+    def _update_ref(self, root, ignored):
+        root.address[0] = self._forwarded(root.address[0])
+
+    def _update_ref_stk(self, root):
+        self._update_ref(root, None)
+
+    def _update_refs_in_obj(self, obj, ignored):
+        self.trace(obj, self._update_ref, None)
+
+    def _update_refs_in_block(self, hdr, ignored):
+        obj = hdr + self.gcheaderbuilder.size_gc_header
+        self._update_refs_if_visited(obj, None)
+        return 0
+
+    def _update_refs_if_visited(self, obj, ignored):
+        if self.header(obj).tid & GCFLAG_VISITED:
+            self.trace(obj, self._update_ref, None)
+
+    def _update_weakref_target(self, obj, ignored):
+        offset = self.weakpointer_offset(self.get_type_id(obj))
+        self._update_ref(obj + offset, None)
+
+    def _copy_forwarded(self, obj, new_stack):
+        new_stack.append(self._forwarded(obj))
+
     def free_rawmalloced_object_if_unvisited(self, obj, check_flag):
         if self.header(obj).tid & check_flag:
             self.header(obj).tid &= ~check_flag   # survives
@@ -2314,7 +2965,9 @@ class IncrementalMiniMarkGC(MovingGCBase):
         else:
             size_gc_header = self.gcheaderbuilder.size_gc_header
             totalsize = size_gc_header + self.get_size(obj)
-            allocsize = raw_malloc_usage(totalsize)
+            # the same size as computed by external_malloc()
+            allocsize = raw_malloc_usage(
+                llarena.round_up_for_allocation(totalsize))
             arena = llarena.getfakearenaaddress(obj - size_gc_header)
             #
             # Must also include the card marker area, if any
@@ -2331,9 +2984,23 @@ class IncrementalMiniMarkGC(MovingGCBase):
                 arena -= extra_words * WORD
                 allocsize += extra_words * WORD
             #
-            llarena.arena_free(arena)
+            self.external_free_memory(arena, allocsize)
             self.rawmalloced_total_size -= r_uint(allocsize)
 
+    def external_malloc_memory(self, allocsize):
+        # The memory of the objects that are not in the nursery or in
+        # the ArenaCollection: the large ones come from the large
+        # object space, the others from raw malloc().
+        if 0 < self.los_min_size <= allocsize:
+            return self.los.malloc(allocsize)
+        return llarena.arena_malloc(allocsize, 0)
+
+    def external_free_memory(self, arena, allocsize):
+        if 0 < self.los_min_size <= allocsize:
+            self.los.free(arena, allocsize)
+        else:
+            llarena.arena_free(arena)
+
     def start_free_rawmalloc_objects(self):
         ll_assert(not self.raw_malloc_might_sweep.non_empty(),
                   "raw_malloc_might_sweep must be empty")
@@ -2501,8 +3168,10 @@ class IncrementalMiniMarkGC(MovingGCBase):
         if self.is_valid_gc_object(obj):
             if self.is_in_nursery(obj):
                 obj = self._find_shadow(obj)
-            elif is_hash:
-                if self.header(obj).tid & GCFLAG_HAS_SHADOW:
+            else:
+                # the result depends on the address of 'obj' from now on
+                self.header(obj).tid |= GCFLAG_NO_EVACUATE
+                if is_hash and self.header(obj).tid & GCFLAG_HAS_SHADOW:
                     #
                     # For identityhash(), we need a special case for some
                     # prebuilt objects: their hash must be the same before
@@ -5,9 +5,16 @@ from rpython.rtyper.lltypesystem import lltype, llmemory, rffi, llgroup
 from rpython.rlib.objectmodel import free_non_gc_object
 from rpython.rtyper.module.ll_os import UNDERSCORE_ON_WIN32
 from rpython.rlib import rposix, rgc, jit
+from rpython.rlib.rarithmetic import r_uint, intmask, LONG_BIT
+from rpython.rtyper.tool.rffi_platform import CompilationError
 
 from rpython.memory.support import AddressDict, get_address_stack
 
+try:
+    from rpython.rlib import rzlib
+except CompilationError:
+    rzlib = None
+
 
 # ---------- implementation of rpython.rlib.rgc.get_rpy_roots() ----------
 
@@ -136,6 +143,9 @@ class HeapDumper(object):
             self.buf_count = 0
     flush._dont_inline_ = True
 
+    def finish(self):
+        self.flush()
+
     def write(self, value):
         x = self.buf_count
         self.writebuffer[x] = value
@@ -226,15 +236,170 @@ def _hd_add_root(obj, heap_dumper):
 def _hd_unadd_root(obj, heap_dumper):
     heap_dumper.unadd(obj)
 
-def dump_rpy_heap(gc, fd):
-    heapdumper = HeapDumper(gc, fd)
+# ----------
+# A compact, streaming variant of the format above.  The file starts with
+# COMPACT_MAGIC, one byte of flags (COMPACT_ZLIB: the rest of the file
+# is a zlib stream) and one byte giving the size of a word.  Then come
+# the same objects in the same order, but every number is written as an
+# unsigned LEB128 varint, and addresses and type indexes are delta-encoded
+# ("zz" is the zigzag encoding, so that small negative deltas are small
+# too):
+#
+#     object:  zz(addr - previous addr) + 1
+#              zz(type index - previous type index)
+#              size
+#              zz(ref - addr) + 1      for each reference
+#              0
+#     marker:  0                       after the objects found from roots
+#
+# See rpython/tool/gcanalyze.py for a reader.
+
+COMPACT_MAGIC = 'RPYHEAP\x01'
+COMPACT_ZLIB = 1
+
+def zigzag(value):
+    return (r_uint(value) << 1) ^ r_uint(value >> (LONG_BIT - 1))
+
+def delta(value, previous):
+    return zigzag(intmask(r_uint(value) - r_uint(previous)))
+
+class CompactHeapDumper(HeapDumper):
+    # reuses the word buffer of HeapDumper as a buffer of bytes
+    BUFBYTES = HeapDumper.BUFSIZE * (LONG_BIT // 8)
+    ZBUFSIZE = 65536   # bytes
+
+    def __init__(self, gc, fd, compress):
+        HeapDumper.__init__(self, gc, fd)
+        self.bytebuffer = rffi.cast(rffi.CCHARP, self.writebuffer)
+        self.prev_addr = 0
+        self.prev_typeindex = 0
+        self.compress = compress and rzlib is not None
+        for c in COMPACT_MAGIC:
+            self.write_byte(c)
+        if self.compress:
+            self.write_byte(chr(COMPACT_ZLIB))
+        else:
+            self.write_byte(chr(0))
+        self.write_byte(chr(LONG_BIT // 8))
+        self.write_out(self.bytebuffer, self.buf_count)
+        self.buf_count = 0
+        if self.compress:
+            self._init_zlib()
+
+    def _init_zlib(self):
+        self.zbuffer = lltype.malloc(rffi.CCHARP.TO, self.ZBUFSIZE,
+                                     flavor='raw')
+        self.zstream = lltype.malloc(rzlib.z_stream, flavor='raw', zero=True)
+        err = rzlib._deflateInit2(self.zstream, rzlib.Z_BEST_SPEED,
+                                  rzlib.Z_DEFLATED, rzlib.MAX_WBITS,
+                                  rzlib.DEF_MEM_LEVEL,
+                                  rzlib.Z_DEFAULT_STRATEGY)
+        if err != rzlib.Z_OK:
+            raise OSError(0, "deflateInit failed")
+
+    def delete(self):
+        if self.compress:
+            rzlib._deflateEnd(self.zstream)
+            lltype.free(self.zstream, flavor='raw')
+            lltype.free(self.zbuffer, flavor='raw')
+        HeapDumper.delete(self)
+
+    @jit.dont_look_inside
+    def write_out(self, buffer, count):
+        if count > 0:
+            written = raw_os_write(self.fd,
+                                   rffi.cast(llmemory.Address, buffer),
+                                   rffi.cast(rffi.SIZE_T, count))
+            if rffi.cast(lltype.Signed, written) != count:
+                raise OSError(rffi.cast(lltype.Signed, rposix._get_errno()),
+                              "raw_os_write failed")
+
+    def deflate(self, count, flush):
+        stream = self.zstream
+        stream.c_next_in = rffi.cast(rzlib.Bytefp, self.bytebuffer)
+        rffi.setintfield(stream, 'c_avail_in', count)
+        while True:
+            stream.c_next_out = rffi.cast(rzlib.Bytefp, self.zbuffer)
+            rffi.setintfield(stream, 'c_avail_out', self.ZBUFSIZE)
+            err = rzlib._deflate(stream, flush)
+            if err != rzlib.Z_OK and err != rzlib.Z_STREAM_END:
+                raise OSError(0, "deflate failed")
+            avail_out = rffi.getintfield(stream, 'c_avail_out')
+            self.write_out(self.zbuffer, self.ZBUFSIZE - avail_out)
+            if flush == rzlib.Z_FINISH:
+                if err == rzlib.Z_STREAM_END:
+                    break
+            elif avail_out > 0:
+                break
+
+    @jit.dont_look_inside
+    def flush(self):
+        if self.compress:
+            self.deflate(self.buf_count, rzlib.Z_NO_FLUSH)
+        else:
+            self.write_out(self.bytebuffer, self.buf_count)
+        self.buf_count = 0
+    flush._dont_inline_ = True
+
+    def finish(self):
+        self.flush()
+        if self.compress:
+            self.deflate(0, rzlib.Z_FINISH)
+
+    def write_byte(self, c):
+        self.bytebuffer[self.buf_count] = c
+        self.buf_count += 1
+    write_byte._always_inline_ = True
+
+    def write_varint(self, value):
+        if self.buf_count > self.BUFBYTES - 10:
+            self.flush()
+        while value >= 0x80:
+            self.write_byte(chr(intmask(value & 0x7f) | 0x80))
+            value >>= 7
+        self.write_byte(chr(intmask(value)))
+
+    # ----------
+
+    def write_marker(self):
+        self.write_varint(r_uint(0))
+
+    def writeobj(self, obj):
+        gc = self.gc
+        typeid = gc.get_type_id(obj)
+        addr = llmemory.cast_adr_to_int(obj)
+        typeindex = gc.get_member_index(typeid)
+        size = llmemory.raw_malloc_usage(gc.get_size_incl_hash(obj))
+        self.write_varint(delta(addr, self.prev_addr) + 1)
+        self.write_varint(delta(typeindex, self.prev_typeindex))
+        self.write_varint(r_uint(size))
+        self.prev_addr = addr
+        self.prev_typeindex = typeindex
+        gc.trace(obj, self._write_compact_ref, None)
+        self.write_varint(r_uint(0))
+
+    def _write_compact_ref(self, pointer, _):
+        obj = pointer.address[0]
+        ref = llmemory.cast_adr_to_int(obj)
+        self.write_varint(delta(ref, self.prev_addr) + 1)
+        self.add(obj)
+
+
+def _dump_heap(heapdumper):
     heapdumper.add_roots()
     heapdumper.walk(heapdumper.pending)
-    heapdumper.flush()
+    heapdumper.finish()
     if heapdumper.gcflag != 0:
         heapdumper.clear_gcflag_again()
         heapdumper.unwalk(heapdumper.pending)
     heapdumper.delete()
+
+def dump_rpy_heap(gc, fd):
+    _dump_heap(HeapDumper(gc, fd))
+    return True
+
+def dump_rpy_heap_compact(gc, fd, compress):
+    _dump_heap(CompactHeapDumper(gc, fd, compress))
     return True
 
 def get_typeids_z(gc):
@@ -0,0 +1,86 @@
+from rpython.rtyper.lltypesystem import lltype, llmemory, llarena, rffi
+from rpython.rlib.debug import ll_assert
+from rpython.rlib.rmmap import PAGESIZE
+
+NULL = llmemory.NULL
+
+# The large objects are not allocated with malloc(), which would spread
+# them over the C heap and rarely give their memory back to the OS after
+# a peak.  Instead, each of them gets its own range of whole pages,
+# obtained with mmap().  When such an object dies, its pages are given
+# back to the OS with madvise(MADV_DONTNEED), but the range stays mapped
+# and is remembered in a free list of ranges of the same number of
+# pages, so that the next object of a similar size does not need a new
+# mmap().  Only the first word of the range is kept, for the chained
+# list.  Objects of more than MAX_CACHED_PAGES pages, and the ranges
+# that don't fit any more in 'cache_size', are directly munmap()ed.
+
+# madvise() only works on whole pages of the OS
+PAGE_SIZE = PAGESIZE
+MAX_CACHED_PAGES = 256
+
+
+class LargeObjectSpace(object):
+    _alloc_flavor_ = "raw"
+
+    def __init__(self, cache_size, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self.cache_size = cache_size
+        #
+        # 'free_ranges[n]' is the chained list of free ranges of n pages.
+        self.free_ranges = lltype.malloc(
+            rffi.CArray(llmemory.Address), MAX_CACHED_PAGES + 1,
+            flavor='raw', zero=True, immortal=True)
+        #
+        # The number of bytes in the free ranges, and in the ranges that
+        # contain an object.
+        self.cached_memory = 0
+        self.total_memory_used = 0
+
+    def _pages_for(self, nbytes):
+        return (nbytes + self.page_size - 1) // self.page_size
+
+    def malloc(self, nbytes):
+        """Allocate a new range of at least 'nbytes' bytes.  Returns
+        NULL if out of memory.  The memory is not cleared."""
+        npages = self._pages_for(nbytes)
+        size = npages * self.page_size
+        result = NULL
+        if npages <= MAX_CACHED_PAGES:
+            result = self.free_ranges[npages]
+            if result:
+                self.free_ranges[npages] = result.address[0]
+                llarena.arena_reset(result,
+                                    llmemory.sizeof(llmemory.Address),
+                                    0)
+                self.cached_memory -= size
+        if not result:
+            result = llarena.arena_mmap(size)
+            if not result:
+                return NULL
+        self.total_memory_used += size
+        return result
+
+    def free(self, arena, nbytes):
+        """Free the range returned by malloc(nbytes)."""
+        npages = self._pages_for(nbytes)
+        size = npages * self.page_size
+        ll_assert(self.total_memory_used >= size,
+                  "LargeObjectSpace.free(): more memory freed than used")
+        self.total_memory_used -= size
+        if (npages > MAX_CACHED_PAGES or
+                self.cached_memory + size > self.cache_size):
+            llarena.arena_munmap(arena, size)
+            return
+        #
+        # Keep the range, but give all its memory back to the OS, apart
+        # from the first page which contains the chained list.
+        llarena.arena_reset(arena, size, 0)
+        if npages > 1:
+            llarena.arena_release(arena + self.page_size,
+                                  size - self.page_size)
+        llarena.arena_reserve(arena, llmemory.sizeof(llmemory.Address))
+        arena.address[0] = self.free_ranges[npages]
+        self.free_ranges[npages] = arena
+        self.cached_memory += size
+
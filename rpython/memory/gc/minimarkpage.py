@@ -27,6 +27,9 @@ ARENA = lltype.Struct('ArenaReference',
     ('freepages', llmemory.Address),
     # -- A linked list of arenas.  See below.
     ('nextarena', ARENA_PTR),
+    # -- Used by add_up_evacuation_costs(): the total cost of moving
+    #    all live objects out of this arena, or -1 once selected.
+    ('evacuation_cost', lltype.Signed),
     )
 ARENA_PTR.TO.become(ARENA)
 ARENA_NULL = lltype.nullptr(ARENA)
@@ -137,6 +140,16 @@ class ArenaCollection(object):
         # part of current_arena might still contain uninitialized pages
         self.num_uninitialized_pages = 0
         #
+        # the number of arenas currently allocated
+        self.num_arenas = 0
+        #
+        # the incremental sweeping in progress, if >= 0
+        self.size_class_with_old_pages = -1
+        #
+        # the arenas selected by select_arenas_to_evacuate(), chained
+        # via 'nextarena'.  They are not in 'arenas_lists'.
+        self.evacuated_arenas = ARENA_NULL
+        #
         # the total memory used, counting every block in use, without
         # the additional bookkeeping stuff.
         self.total_memory_used = r_uint(0)
@@ -309,8 +322,10 @@ class ArenaCollection(object):
         arena.nfreepages = 0        # they are all uninitialized pages
         arena.totalpages = npages
         arena.freepages = firstpage
+        arena.evacuation_cost = 0
         self.num_uninitialized_pages = npages
         self.current_arena = arena
+        self.num_arenas += 1
         #
     allocate_new_arena._dont_inline_ = True
 
@@ -397,6 +412,7 @@ class ArenaCollection(object):
                     # The whole arena is empty.  Free it.
                     llarena.arena_free(arena.base)
                     lltype.free(arena, flavor='raw', track_allocation=False)
+                    self.num_arenas -= 1
                     #
                 else:
                     # Insert 'arena' in the correct arenas_lists[n]
@@ -555,6 +571,191 @@ class ArenaCollection(object):
         return surviving
 
 
+    def walk_allocated_blocks(self, page, block_size, callback, arg):
+        """Call 'callback(block, arg)' on every allocated block of the
+        page, and return the sum of the results."""
+        freeblock = page.freeblock
+        skip_free_blocks = page.nfree
+        obj = llarena.getfakearenaaddress(llmemory.cast_ptr_to_adr(page))
+        obj += self.hdrsize
+        total = 0
+        while True:
+            if obj == freeblock:
+                if skip_free_blocks == 0:
+                    break      # the first uninitialized block, or the end
+                skip_free_blocks -= 1
+                freeblock = obj.address[0]
+            else:
+                total += callback(obj, arg)
+            obj += block_size
+        return total
+    walk_allocated_blocks._annspecialcase_ = 'specialize:arg(3)'
+
+
+    def walk_all_blocks(self, callback, arg):
+        """Call 'callback(block, arg)' on every allocated block."""
+        size_class = self.small_request_threshold >> WORD_POWER_2
+        while size_class >= 1:
+            block_size = size_class * WORD
+            page = self.page_for_size[size_class]
+            while page != PAGE_NULL:
+                self.walk_allocated_blocks(page, block_size, callback, arg)
+                page = page.nextpage
+            page = self.full_page_for_size[size_class]
+            while page != PAGE_NULL:
+                self.walk_allocated_blocks(page, block_size, callback, arg)
+                page = page.nextpage
+            size_class -= 1
+    walk_all_blocks._annspecialcase_ = 'specialize:arg(1)'
+
+
+    # ----------
+    # Compaction: arenas whose live objects fill only a small fraction
+    # of them are emptied by moving their objects into other arenas,
+    # after which they can be returned to the OS.  The caller moves the
+    # objects and fixes the references to them; the ArenaCollection
+    # only picks the arenas and keeps malloc() away from them.
+
+    def add_up_evacuation_costs(self, cost_func):
+        """Compute for every arena the cost of moving all its live
+        blocks.  'cost_func(block, None)' returns the cost of moving one
+        block: its size if it is live and can move, 0 if it is dead, and
+        at least 'arena_size' if it cannot move.  Must not be called
+        during an incremental mass_free().
+        """
+        ll_assert(self.size_class_with_old_pages < 0,
+                  "add_up_evacuation_costs() called while sweeping")
+        #
+        # The current arena still has uninitialized pages: never pick it.
+        if self.current_arena != ARENA_NULL:
+            self.current_arena.evacuation_cost = self.arena_size
+        i = 0
+        while i < self.max_pages_per_arena:
+            arena = self.arenas_lists[i]
+            while arena != ARENA_NULL:
+                arena.evacuation_cost = 0
+                arena = arena.nextarena
+            i += 1
+        #
+        # Walk all pages and add up the cost of moving their blocks.
+        size_class = self.small_request_threshold >> WORD_POWER_2
+        while size_class >= 1:
+            self._add_evacuation_cost(self.page_for_size[size_class],
+                                      size_class * WORD, cost_func)
+            self._add_evacuation_cost(self.full_page_for_size[size_class],
+                                      size_class * WORD, cost_func)
+            size_class -= 1
+    add_up_evacuation_costs._annspecialcase_ = 'specialize:arg(1)'
+
+
+    def select_arenas_to_evacuate(self, max_fill):
+        """Select the arenas where moving all live objects costs less
+        than 'max_fill' times the arena size, according to the last call
+        to add_up_evacuation_costs().  Returns the number of arenas
+        selected.
+        """
+        ll_assert(self.evacuated_arenas == ARENA_NULL,
+                  "select_arenas_to_evacuate() called twice")
+        #
+        # Pick the arenas and remove them from 'arenas_lists'.
+        limit = int(max_fill * self.arena_size)
+        count = 0
+        i = 0
+        while i < self.max_pages_per_arena:
+            arena = self.arenas_lists[i]
+            self.arenas_lists[i] = ARENA_NULL
+            while arena != ARENA_NULL:
+                nextarena = arena.nextarena
+                if arena.evacuation_cost < limit and (
+                        arena.nfreepages < arena.totalpages):
+                    arena.evacuation_cost = -1
+                    arena.nextarena = self.evacuated_arenas
+                    self.evacuated_arenas = arena
+                    count += 1
+                else:
+                    arena.nextarena = self.arenas_lists[i]
+                    self.arenas_lists[i] = arena
+                arena = nextarena
+            i += 1
+        #
+        # Move their pages to 'old_page_for_size', out of reach of malloc().
+        if count > 0:
+            size_class = self.small_request_threshold >> WORD_POWER_2
+            while size_class >= 1:
+                self.page_for_size[size_class] = self._unlink_evacuated_pages(
+                    self.page_for_size[size_class], size_class)
+                self.full_page_for_size[size_class] = (
+                    self._unlink_evacuated_pages(
+                        self.full_page_for_size[size_class], size_class))
+                size_class -= 1
+        return count
+
+
+    def _add_evacuation_cost(self, page, block_size, cost_func):
+        # every block is passed to 'cost_func', even in the arenas that
+        # cannot be evacuated any more; their cost stays 'arena_size'
+        while page != PAGE_NULL:
+            arena = page.arena
+            cost = arena.evacuation_cost + self.walk_allocated_blocks(
+                page, block_size, cost_func, None)
+            if cost > self.arena_size:
+                cost = self.arena_size
+            arena.evacuation_cost = cost
+            page = page.nextpage
+    _add_evacuation_cost._annspecialcase_ = 'specialize:arg(3)'
+
+
+    def _unlink_evacuated_pages(self, page, size_class):
+        # Returns the list of pages without the ones from the evacuated
+        # arenas, which are prepended to 'old_page_for_size[size_class]'.
+        # The order of the remaining pages is kept.
+        result = PAGE_NULL
+        last = PAGE_NULL
+        while page != PAGE_NULL:
+            nextpage = page.nextpage
+            if page.arena.evacuation_cost < 0:
+                page.nextpage = self.old_page_for_size[size_class]
+                self.old_page_for_size[size_class] = page
+            else:
+                page.nextpage = PAGE_NULL
+                if last == PAGE_NULL:
+                    result = page
+                else:
+                    last.nextpage = page
+                last = page
+            page = nextpage
+        return result
+
+
+    def evacuate_arenas(self, move_func):
+        """Call 'move_func(block, None)' on every allocated block of the
+        selected arenas.  It may call malloc(), which will not return
+        memory from these arenas."""
+        size_class = self.small_request_threshold >> WORD_POWER_2
+        while size_class >= 1:
+            block_size = size_class * WORD
+            page = self.old_page_for_size[size_class]
+            self.old_page_for_size[size_class] = PAGE_NULL
+            while page != PAGE_NULL:
+                self.walk_allocated_blocks(page, block_size, move_func, None)
+                page = page.nextpage
+            size_class -= 1
+    evacuate_arenas._annspecialcase_ = 'specialize:arg(1)'
+
+
+    def free_evacuated_arenas(self):
+        """Return the evacuated arenas to the OS.  Call this only after
+        all references to the old locations of the objects are gone."""
+        arena = self.evacuated_arenas
+        self.evacuated_arenas = ARENA_NULL
+        while arena != ARENA_NULL:
+            nextarena = arena.nextarena
+            llarena.arena_free(arena.base)
+            lltype.free(arena, flavor='raw', track_allocation=False)
+            self.num_arenas -= 1
+            arena = nextarena
+
+
     def _nuninitialized(self, page, size_class):
         # Helper for debugging: count the number of uninitialized blocks
         freeblock = page.freeblock
@@ -8,6 +8,7 @@ see as the list of roots (stack and prebuilt objects).
 
 import py
 from rpython.rtyper.lltypesystem import lltype, llmemory
+from rpython.rtyper.lltypesystem.llmemory import raw_malloc_usage
 from rpython.memory.gctypelayout import TypeLayoutBuilder
 from rpython.rlib.rarithmetic import LONG_BIT, is_valid_int
 from rpython.memory.gc import minimark, incminimark
@@ -668,6 +669,304 @@ class TestIncrementalMiniMarkGCSimple(TestMiniMarkGCSimple):
         self.gc.debug_gc_step_until(incminimark.STATE_SCANNING)
         assert self.stackroots[1].x == 13
 
+    def test_gc_stats(self):
+        from rpython.rlib import rgc
+        size = llmemory.raw_malloc_usage(
+            self.gc.gcheaderbuilder.size_gc_header + llmemory.sizeof(S))
+        def stat(event, index):
+            return self.gc.get_gc_stat(event, index)
+        for i in range(2):
+            self.stackroots.append(self.malloc(S))
+        self.gc.minor_collection()
+        assert stat(rgc.GCSTAT_MINOR_PAUSE, rgc.GCSTAT_COUNT) == 1
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_COUNT) == 1
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_TOTAL) == 2 * size
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_MAX) == 2 * size
+        bucket = len(bin(2 * size)) - 2
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_HISTOGRAM + bucket) == 1
+        assert stat(rgc.GCSTAT_PINNED, rgc.GCSTAT_HISTOGRAM + 0) == 1
+        #
+        self.gc.minor_collection()
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_COUNT) == 2
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_TOTAL) == 2 * size
+        assert stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_HISTOGRAM + 0) == 1
+        assert stat(rgc.GCSTAT_MAJOR_STEP, rgc.GCSTAT_COUNT) == 0
+        self.gc.debug_gc_step_until(incminimark.STATE_MARKING)
+        assert stat(rgc.GCSTAT_MAJOR_STEP, rgc.GCSTAT_COUNT) == 1
+        # out of range
+        assert stat(rgc.GCSTAT_NUM_EVENTS, 0) == -1
+        assert stat(0, rgc.GCSTAT_SIZE) == -1
+
+class TestIncrementalMiniMarkGCPacing(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'ArenaCollectionClass':
+                     TestIncrementalMiniMarkGCSimple.SimpleArenaCollection,
+                 'max_pause': 10**12}
+
+    def test_pacing_grows_the_steps(self):
+        self.gc.debug_gc_step_until(incminimark.STATE_MARKING)
+        self.gc.debug_gc_step_until(incminimark.STATE_SCANNING)
+        assert self.gc.gc_step_scale == incminimark.GC_STEP_SCALE_MAX
+        assert self.gc.paced_step_size(1000) == 4000
+
+    def test_pacing_shrinks_the_steps(self):
+        self.gc.max_pause = 1.0
+        arr = self.malloc(VAR, 100)
+        self.stackroots.append(arr)
+        for i in range(100):
+            obj = self.malloc(S)
+            obj.x = i
+            self.writearray(self.stackroots[0], i, obj)
+        self.gc.debug_gc_step_until(incminimark.STATE_MARKING)
+        self.gc.debug_gc_step_until(incminimark.STATE_SCANNING)
+        # every step takes more than one tick
+        assert self.gc.gc_step_scale == incminimark.GC_STEP_SCALE_MIN
+        assert self.gc.paced_step_size(1000) == 62
+        assert self.gc.paced_step_size(10) == 1
+        arr = self.stackroots[0]
+        for i in range(100):
+            assert arr[i].x == i
+
+    def test_pacing_keeps_marking_ahead_of_promotion(self):
+        self.gc.max_pause = 1.0
+        self.gc.gc_step_scale = incminimark.GC_STEP_SCALE_MIN
+        self.gc.gc_increment_step = 1000
+        self.gc.debug_gc_step_until(incminimark.STATE_MARKING)
+        seen = []
+        orig_visit_all_objects_step = self.gc.visit_all_objects_step
+        def visit_all_objects_step(size):
+            seen.append(size)
+            return orig_visit_all_objects_step(size)
+        self.gc.visit_all_objects_step = visit_all_objects_step
+        self.gc.nursery_surviving_size = 800
+        self.gc.major_collection_step()
+        # not the 62 from the pacing alone
+        assert seen == [1600]
+
+    def test_pause_histogram(self):
+        self.gc.max_pause = 1.0
+        histogram = self.gc.pause_histogram
+        self.gc._record_gc_step(incminimark.STATE_SCANNING, 0)
+        self.gc._record_gc_step(incminimark.STATE_SCANNING, 5)
+        self.gc._record_gc_step(incminimark.STATE_SCANNING, 7)
+        assert histogram[0] == 1
+        assert histogram[3] == 2
+        assert self.gc.longest_pause == 7.0
+        assert self.gc.num_pauses_over_target == 2
+        # the scanning steps don't change the pacing
+        assert self.gc.gc_step_scale == 1.0
+        self.gc._report_pauses()
+        assert histogram[3] == 0
+        assert self.gc.num_pauses_over_target == 0
+
+class TestIncrementalMiniMarkGCNurseryResizing(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'max_nursery_size': 128*WORD}
+
+    def test_nursery_grows_and_shrinks(self):
+        assert self.gc.nursery_size == 32*WORD
+        assert self.gc.nursery_size_max == 128*WORD
+        min_heap_size = self.gc.min_heap_size
+        max_pinned = self.gc.max_number_of_pinned_objects
+        # everything survives: the nursery grows up to the maximum
+        arr = self.malloc(VAR, 200)
+        self.stackroots.append(arr)
+        for i in range(200):
+            obj = self.malloc(S)
+            obj.x = i
+            self.writearray(self.stackroots[0], i, obj)
+        assert self.gc.nursery_size == 128*WORD
+        assert self.gc.gc_increment_step == 4 * 128*WORD
+        assert self.gc.min_heap_size == 4 * min_heap_size
+        assert self.gc.max_number_of_pinned_objects == 4 * max_pinned
+        # nothing survives: it shrinks back to the initial size
+        for i in range(2000):
+            self.malloc(S)
+        assert self.gc.nursery_size == 32*WORD
+        assert self.gc.gc_increment_step == 4 * 32*WORD
+        assert self.gc.min_heap_size == min_heap_size
+        assert self.gc.max_number_of_pinned_objects == max_pinned
+        arr = self.stackroots[0]
+        for i in range(200):
+            assert arr[i].x == i
+
+class TestIncrementalMiniMarkGCCompaction(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'compact_fill': 0.5}
+
+    def test_compaction_frees_arenas(self):
+        arr = self.malloc(VAR, 300)
+        self.stackroots.append(arr)
+        for i in range(300):
+            obj = self.malloc(S)
+            obj.x = i
+            self.writearray(self.stackroots[0], i, obj)
+        for i in range(10, 300, 10):
+            self.stackroots[0][i].prev = self.stackroots[0][i - 10]
+        self.gc.collect()
+        num_arenas = self.gc.ac.num_arenas
+        #
+        # Keep every 10th object alive.  The address of the first one is
+        # exposed with can_move(), so it must stay where it is.
+        arr = self.stackroots[0]
+        for i in range(300):
+            if i % 10 != 0:
+                arr[i] = lltype.nullptr(S)
+        addr0 = llmemory.cast_ptr_to_adr(arr[0])
+        assert not self.gc.can_move(addr0)
+        self.gc.collect()
+        self.gc.collect()
+        assert self.gc.ac.num_arenas < num_arenas // 2
+        arr = self.stackroots[0]
+        assert llmemory.cast_ptr_to_adr(arr[0]) == addr0
+        assert self.gc.num_evacuated_objects > 0
+        for i in range(0, 300, 10):
+            assert arr[i].x == i
+            if i > 0:
+                assert arr[i].prev.x == i - 10
+
+    def test_compaction_ignores_dead_objects(self):
+        # the arenas are mostly filled with objects that die before the
+        # next major collection, which must see that they are dead
+        arr = self.malloc(VAR, 300)
+        self.stackroots.append(arr)
+        for i in range(300):
+            self.writearray(self.stackroots[0], i, self.malloc(S))
+        self.gc.collect()
+        num_arenas = self.gc.ac.num_arenas
+        arr = self.stackroots[0]
+        for i in range(300):
+            if i % 10 != 0:
+                arr[i] = lltype.nullptr(S)
+        self.gc.num_evacuated_objects = 0
+        self.gc.collect()
+        assert self.gc.num_evacuated_objects > 0
+        assert self.gc.ac.num_arenas < num_arenas
+
+    def test_compaction_keeps_id(self):
+        arr = self.malloc(VAR, 100)
+        self.stackroots.append(arr)
+        for i in range(100):
+            self.writearray(self.stackroots[0], i, self.malloc(S))
+        self.gc.collect()
+        arr = self.stackroots[0]
+        for i in range(100):
+            if i % 10 != 0:
+                arr[i] = lltype.nullptr(S)
+        ids = [self.gc.id(arr[i]) for i in range(0, 100, 10)]
+        self.gc.collect()
+        self.gc.collect()
+        arr = self.stackroots[0]
+        assert [self.gc.id(arr[i]) for i in range(0, 100, 10)] == ids
+
+class TestIncrementalMiniMarkGCAllocSampling(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'alloc_sample_interval': 10*WORD}
+
+    def test_allocation_samples(self):
+        typeindex = self.gc.get_member_index(self.get_type_id(S))
+        for i in range(20):
+            obj = self.malloc(S)
+            obj.x = i
+            self.stackroots.append(obj)
+        num_samples = self.gc.num_allocation_samples
+        assert num_samples >= 3
+        assert self.gc.allocation_samples[0][0] == typeindex
+        self.malloc(VAR, 5)
+        for i in range(20):
+            assert self.stackroots[i].x == i
+        # the sampling and the minor collections keep nursery_top sane
+        assert self.gc.nursery_free <= self.gc.nursery_top
+        if self.gc.sampled_nursery_top:
+            assert self.gc.nursery_top < self.gc.sampled_nursery_top
+
+    def test_interval_larger_than_the_nursery(self):
+        gc = self.gc
+        interval = gc.nursery_size * 5 // 2
+        gc.alloc_sample_interval = interval
+        gc.alloc_sample_countdown = interval
+        gc.lower_nursery_top_for_sampling()
+        totalsize = raw_malloc_usage(gc.gcheaderbuilder.size_gc_header +
+                                     llmemory.sizeof(S))
+        # the countdown goes on across the minor collections, both the
+        # ones done when the nursery is full and the explicit ones
+        n = 10 * interval // totalsize
+        for i in range(n):
+            self.malloc(S)
+            if i % 7 == 0:
+                gc.collect(0)
+        expected = n * totalsize // interval
+        assert expected - 1 <= gc.num_allocation_samples <= expected
+
+    def test_sampling_disabled(self):
+        self.gc.alloc_sample_interval = 0
+        self.gc.restore_nursery_top()
+        for i in range(20):
+            self.malloc(S)
+        assert self.gc.num_allocation_samples == 0
+
+class TestIncrementalMiniMarkGCThreadChunks(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'thread_chunk_size': 8*WORD}
+
+    def test_threads_allocate_in_their_own_chunk(self):
+        gc = self.gc
+        totalsize = gc.gcheaderbuilder.size_gc_header + llmemory.sizeof(S)
+        ends = {}
+        for i in range(30):
+            tid = 1 + i % 3
+            gc.switch_thread_nursery(gc.active_thread, tid)
+            obj = self.malloc(S)
+            obj.x = i
+            self.stackroots.append(obj)
+            if 3 <= i < 6:
+                # the second object of every thread goes right after
+                # its first one, even though the threads are interleaved
+                assert gc.nursery_free == ends[tid] + totalsize
+            ends[tid] = gc.nursery_free
+            assert gc.nursery_free <= gc.nursery_top
+        for i in range(30):
+            assert self.stackroots[i].x == i
+
+    def test_chunks_survive_collection(self):
+        gc = self.gc
+        for i in range(200):
+            gc.switch_thread_nursery(gc.active_thread, 1 + i % 5)
+            obj = self.malloc(S)
+            obj.x = i
+            self.stackroots.append(obj)
+        assert gc.num_thread_chunks <= 5
+        self.gc.collect()
+        for i in range(200):
+            assert self.stackroots[i].x == i
+        assert gc.num_thread_chunks == 0
+        assert not gc.chunk_limit
+
+class TestIncrementalMiniMarkGCLargeObjSpace(DirectGCTest):
+    from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
+    GC_PARAMS = {'los_min_size': 64*WORD, 'los_cache_size': 64*4096}
+
+    def test_large_objects_go_to_the_los(self):
+        p = self.malloc(VAR, 100)
+        self.stackroots.append(p)
+        q = self.malloc(VAR, 100)
+        assert self.gc.los.total_memory_used == 2 * 4096
+        s = self.malloc(S)
+        s.x = 42
+        self.writearray(p, 5, s)
+        s = q = None
+        self.gc.collect()
+        p = self.stackroots[0]
+        assert p[5].x == 42
+        assert self.gc.los.total_memory_used == 4096
+        assert self.gc.los.cached_memory == 4096
+        # the free range is reused for the next large object
+        self.malloc(VAR, 120)
+        assert self.gc.los.cached_memory == 0
+        # smaller objects still use malloc()
+        self.malloc(VAR, 20)
+        assert self.gc.los.total_memory_used == 2 * 4096
+
 class TestIncrementalMiniMarkGCFull(DirectGCTest):
     from rpython.memory.gc.incminimark import IncrementalMiniMarkGC as GCClass
     def test_malloc_fixedsize_no_cleanup(self):
@@ -37,6 +37,34 @@ class InspectorTest(BaseDirectGCTest):
                     adr_q, 1, ASize(), -1]
         assert expected == seen
 
+    def test_dump_rpy_heap_compact(self):
+        from rpython.tool.gcanalyze import read_heap_dump
+        p = self.malloc(S)
+        q = self.malloc(S)
+        self.write(p, 'next', q)
+        self.stackroots.append(p)
+        adr_p = llmemory.cast_adr_to_int(llmemory.cast_ptr_to_adr(p))
+        adr_q = llmemory.cast_adr_to_int(llmemory.cast_ptr_to_adr(q))
+        size = llmemory.raw_malloc_usage(self.gc.get_size_incl_hash(
+            llmemory.cast_ptr_to_adr(p)))
+        for compress in [False, True]:
+            filename = str(udir.join('test_dump_rpy_heap_compact'))
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            try:
+                inspector.dump_rpy_heap_compact(self.gc, fd, compress)
+            finally:
+                os.close(fd)
+            f = open(filename, 'rb')
+            try:
+                assert f.read(8) == inspector.COMPACT_MAGIC
+                f.seek(0)
+                records = list(read_heap_dump(f))
+            finally:
+                f.close()
+            assert records == [(adr_p, 1, size, [adr_q]),
+                               None,
+                               (adr_q, 1, size, [])]
+
 
 class TestHybridGC(InspectorTest):
     from rpython.memory.gc.hybrid import HybridGC as GCClass
@@ -0,0 +1,59 @@
+from rpython.memory.gc.largeobjspace import LargeObjectSpace
+from rpython.memory.gc.largeobjspace import MAX_CACHED_PAGES
+from rpython.rtyper.lltypesystem import lltype, llmemory, llarena
+
+NULL = llmemory.NULL
+SIZE = llmemory.sizeof(lltype.Signed)
+
+
+def test_malloc_rounds_up_to_pages():
+    los = LargeObjectSpace(4096, page_size=64)
+    a = los.malloc(65)
+    assert a.arena.nbytes == 128
+    assert los.total_memory_used == 128
+    b = los.malloc(64)
+    assert b.arena.nbytes == 64
+    assert los.total_memory_used == 192
+
+def test_free_ranges_are_reused():
+    los = LargeObjectSpace(4096, page_size=64)
+    a = los.malloc(150)
+    llarena.arena_reserve(a, SIZE)
+    los.free(a, 150)
+    assert los.total_memory_used == 0
+    assert los.cached_memory == 192
+    assert los.free_ranges[3] == a
+    # a different number of pages does not take it
+    b = los.malloc(100)
+    assert b.arena is not a.arena
+    # the same number of pages does
+    c = los.malloc(129)
+    assert c == a
+    assert los.cached_memory == 0
+    assert not los.free_ranges[3]
+    llarena.arena_reserve(c, SIZE)     # can be used again
+
+def test_free_releases_memory():
+    los = LargeObjectSpace(4096, page_size=64)
+    a = los.malloc(256)
+    llarena.arena_reserve(a + 128, SIZE)
+    (a + 128).signed[0] = 42
+    los.free(a, 256)
+    a2 = los.malloc(256)
+    assert a2 == a
+    llarena.arena_reserve(a2 + 128, SIZE)
+    assert (a2 + 128).signed[0] == 0
+
+def test_cache_size_limit():
+    los = LargeObjectSpace(256, page_size=64)
+    a = los.malloc(192)
+    b = los.malloc(192)
+    los.free(a, 192)
+    assert los.cached_memory == 192
+    los.free(b, 192)       # doesn't fit in the cache
+    assert los.cached_memory == 192
+    assert b.arena.freed
+    big = los.malloc(64 * (MAX_CACHED_PAGES + 1))
+    los.free(big, 64 * (MAX_CACHED_PAGES + 1))
+    assert big.arena.freed
+    assert los.total_memory_used == 0
@@ -332,6 +332,10 @@ class BaseFrameworkGCTransformer(GCTransformer):
         self.can_move_ptr = getfn(GCClass.can_move.im_func,
                                   [s_gc, SomeAddress()],
                                   annmodel.SomeBool())
+        self.get_gc_stat_ptr = getfn(GCClass.get_gc_stat.im_func,
+                                     [s_gc, annmodel.SomeInteger(),
+                                      annmodel.SomeInteger()],
+                                     annmodel.SomeInteger())
 
         if hasattr(GCClass, 'shrink_array'):
             self.shrink_array_ptr = getfn(
@@ -472,6 +476,11 @@ class BaseFrameworkGCTransformer(GCTransformer):
                                        [s_gc, annmodel.SomeInteger()],
                                        annmodel.s_Bool,
                                        minimal_transform=False)
+        self.dump_rpy_heap_compact_ptr = getfn(
+            inspector.dump_rpy_heap_compact,
+            [s_gc, annmodel.SomeInteger(), annmodel.s_Bool],
+            annmodel.s_Bool,
+            minimal_transform=False)
         self.get_typeids_z_ptr = getfn(inspector.get_typeids_z,
                                        [s_gc],
                                        SomePtr(lltype.Ptr(rgc.ARRAY_OF_CHAR)),
@@ -817,6 +826,12 @@ class BaseFrameworkGCTransformer(GCTransformer):
         hop.genop("direct_call", [self.can_move_ptr, self.c_const_gc, v_addr],
                   resultvar=op.result)
 
+    def gct_gc_get_stat(self, hop):
+        op = hop.spaceop
+        hop.genop("direct_call",
+                  [self.get_gc_stat_ptr, self.c_const_gc] + op.args,
+                  resultvar=op.result)
+
     def gct_shrink_array(self, hop):
         if self.shrink_array_ptr is None:
             return GCTransformer.gct_shrink_array(self, hop)
@@ -1218,6 +1233,15 @@ class BaseFrameworkGCTransformer(GCTransformer):
                   resultvar=hop.spaceop.result)
         self.pop_roots(hop, livevars)
 
+    def gct_gc_dump_rpy_heap_compact(self, hop):
+        livevars = self.push_roots(hop)
+        [v_fd, v_compress] = hop.spaceop.args
+        hop.genop("direct_call",
+                  [self.dump_rpy_heap_compact_ptr, self.c_const_gc,
+                   v_fd, v_compress],
+                  resultvar=hop.spaceop.result)
+        self.pop_roots(hop, livevars)
+
     def gct_gc_typeids_z(self, hop):
         livevars = self.push_roots(hop)
         hop.genop("direct_call",
@@ -151,6 +151,7 @@ class ShadowStackRootWalker(BaseRootWalker):
                 return   # ignore calls to thread_die() in the main thread
                          # (which can occur after a fork()).
             # we need to switch somewhere else, so go to main_tid
+            gcdata.gc.switch_thread_nursery(0, gcdata.main_tid)
             gcdata.active_tid = gcdata.main_tid
             thread_stacks = gcdata.thread_stacks
             new_ref = thread_stacks[gcdata.active_tid]
@@ -187,6 +188,7 @@ class ShadowStackRootWalker(BaseRootWalker):
                 shadow_stack_pool.start_fresh_new_state()
             # done
             #
+            gcdata.gc.switch_thread_nursery(gcdata.active_tid, new_tid)
             gcdata.active_tid = new_tid
         switch_shadow_stacks._dont_inline_ = True
 
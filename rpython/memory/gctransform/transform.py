@@ -607,3 +607,6 @@ class GCTransformer(BaseGCTransformer):
 
     def gct_shrink_array(self, hop):
         return hop.cast_result(rmodel.inputconst(lltype.Bool, False))
+
+    def gct_gc_get_stat(self, hop):
+        return hop.cast_result(rmodel.inputconst(lltype.Signed, -1))
@@ -132,6 +132,9 @@ class GCManagedHeap(object):
     def can_move(self, addr):
         return self.gc.can_move(addr)
 
+    def get_gc_stat(self, event, index):
+        return self.gc.get_gc_stat(event, index)
+
     def pin(self, addr):
         return self.gc.pin(addr)
 
@@ -91,3 +91,18 @@ class TestIncrementalMiniMarkGC(test_minimark_gc.TestMiniMarkGC):
             return ref() is b
         res = self.interpret(f, [])
         assert res == True
+
+    def test_get_gc_stat(self):
+        class A(object):
+            pass
+        def f():
+            lst = []
+            for i in range(100):
+                lst.append(A())
+            llop.gc__collect(lltype.Void)
+            count = rgc.get_gc_stat(rgc.GCSTAT_MINOR_PAUSE, rgc.GCSTAT_COUNT)
+            promoted = rgc.get_gc_stat(rgc.GCSTAT_PROMOTED, rgc.GCSTAT_TOTAL)
+            steps = rgc.get_gc_stat(rgc.GCSTAT_MAJOR_STEP, rgc.GCSTAT_COUNT)
+            return (count > 0) + 2 * (promoted > 0) + 4 * (steps > 0)
+        res = self.interpret(f, [])
+        assert res == 7
@@ -0,0 +1,4 @@
+from rpython.memory.test import test_incminimark_gc
+
+class TestIncrementalMiniMarkGCCompaction(test_incminimark_gc.TestIncrementalMiniMarkGC):
+    GC_PARAMS = {'compact_fill': 0.5}
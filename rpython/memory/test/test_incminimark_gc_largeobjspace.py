@@ -0,0 +1,4 @@
+from rpython.memory.test import test_incminimark_gc
+
+class TestIncrementalMiniMarkGCLargeObjSpace(test_incminimark_gc.TestIncrementalMiniMarkGC):
+    GC_PARAMS = {'los_min_size': 64, 'los_cache_size': 8*4096}
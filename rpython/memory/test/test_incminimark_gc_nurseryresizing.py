@@ -0,0 +1,4 @@
+from rpython.memory.test import test_incminimark_gc
+
+class TestIncrementalMiniMarkGCNurseryResizing(test_incminimark_gc.TestIncrementalMiniMarkGC):
+    GC_PARAMS = {'max_nursery_size': 16384}
@@ -1317,6 +1317,21 @@ class TestIncrementalMiniMarkGC(TestMiniMarkGC):
         res = run([])
         assert res
 
+    def define_get_gc_stat(cls):
+        S = lltype.GcStruct('S', ('x', lltype.Signed))
+        def f():
+            for i in range(100):
+                lltype.malloc(S)
+            llop.gc__collect(lltype.Void)
+            return rgc.get_gc_stat(rgc.GCSTAT_MINOR_PAUSE, rgc.GCSTAT_COUNT)
+        return f
+
+    def test_get_gc_stat(self):
+        run = self.runner("get_gc_stat")
+        res = run([])
+        assert res > 0
+
+
 # ________________________________________________________________
 # tagged pointers
 
@@ -561,6 +561,21 @@ PARAMETER_DOCS = {
                  'divided by the total number of trace instructions.',
     'vec_guard_ratio': 'an integer (0-10 transfored into a float by X / 10.0) divided by the'
                        ' total number of trace instructions.',
+    'hot_greenkeys': 'a file in which to record the greenkeys of the loops '
+                     'that got compiled; in the next runs of the same '
+                     'program, these loops are traced the first time they '
+                     'are reached instead of after "threshold" iterations.  '
+                     'Only a hint: no trace or machine code is saved '
+                     '(default: none)',
+    'baseline_threshold': 'number of times a loop has to run for a first '
+                          'version to be compiled with only the baseline_opts;'
+                          ' it is compiled again with all optimizations when '
+                          'it keeps being entered (0 = off)',
+    'baseline_opts': 'INTERNAL USE ONLY: optimizations to enable for the '
+                     'first version of a loop if baseline_threshold is set',
+    'tier_up_ratio': 'how many times longer than its compilation the first '
+                     'version of a loop must run before it is compiled again '
+                     'with all optimizations',
 }
 
 PARAMETERS = {'threshold': 1039, # just above 1024, prime
@@ -582,8 +597,14 @@ PARAMETERS = {'threshold': 1039, # just above 1024, prime
               'vec_length': 60,
               'vec_ratio': 2,
               'vec_guard_ratio': 5,
+              'hot_greenkeys': '',
+              'baseline_threshold': 0,
+              'baseline_opts': 'intbounds:rewrite:virtualize:pure:heap',
+              'tier_up_ratio': 10,
               }
 unroll_parameters = unrolling_iterable(PARAMETERS.items())
+# the parameters whose value is a string instead of an integer
+STRING_PARAMETERS = ('enable_opts', 'hot_greenkeys', 'baseline_opts')
 
 # ____________________________________________________________
 
@@ -801,18 +822,15 @@ def set_user_param(driver, text):
             raise ValueError
         name = parts[0]
         value = parts[1]
-        if name == 'enable_opts':
-            set_param(driver, 'enable_opts', value)
+        for name1, _ in unroll_parameters:
+            if name1 == name:
+                if name1 in STRING_PARAMETERS:
+                    set_param(driver, name1, value)
+                else:
+                    set_param(driver, name1, int(value))
+                break
         else:
-            for name1, _ in unroll_parameters:
-                if name1 == name and name1 != 'enable_opts':
-                    try:
-                        set_param(driver, name1, int(value))
-                    except ValueError:
-                        raise
-                    break
-            else:
-                raise ValueError
+            raise ValueError
 set_user_param._annspecialcase_ = 'specialize:arg(0)'
 
 # ____________________________________________________________
@@ -969,7 +987,7 @@ class ExtSetParam(ExtRegistryEntry):
     def compute_result_annotation(self, s_driver, s_name, s_value):
         from rpython.annotator import model as annmodel
         assert s_name.is_constant()
-        if s_name.const == 'enable_opts':
+        if s_name.const in STRING_PARAMETERS:
             assert annmodel.SomeString(can_be_None=True).contains(s_value)
         else:
             assert (s_value == annmodel.s_None or
@@ -984,7 +1002,7 @@ class ExtSetParam(ExtRegistryEntry):
         hop.exception_cannot_occur()
         driver = hop.inputarg(lltype.Void, arg=0)
         name = hop.args_s[1].const
-        if name == 'enable_opts':
+        if name in STRING_PARAMETERS:
             repr = string_repr
         else:
             repr = lltype.Signed
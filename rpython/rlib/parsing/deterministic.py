@@ -73,7 +73,7 @@ class LexerError(Exception):
 class DFA(object):
     def __init__(self, num_states=0, transitions=None, final_states=None,
                  unmergeable_states=None, names=None):
-        self.num_states = 0
+        self.num_states = num_states
         if transitions is None:
             transitions = {}
         if final_states is None:
@@ -121,61 +121,76 @@ class DFA(object):
             all_chars.add(input)
         return all_chars
 
-    def optimize(self):
-        all_chars = self.get_all_chars()
-        # find mergeable
-        non_final = frozenset(set(range(self.num_states)) - self.final_states -
-                              self.unmergeable_states)
-        final = frozenset(self.final_states - self.unmergeable_states)
-        state_to_set = {}
-        equivalence_sets = set()
-        if non_final:
-            equivalence_sets.add(non_final)
-        if final:
-            equivalence_sets.add(final)
-        for state in range(self.num_states):
-            if state in final:
-                state_to_set[state] = final
-            elif state in self.unmergeable_states:
-                singleset = frozenset([state])
-                state_to_set[state] = singleset
-                equivalence_sets.add(singleset)
+    def find_equivalent_states(self):
+        """Partition the states into sets of equivalent states, using
+        Hopcroft's partition refinement algorithm.  Final and non-final
+        states are never equivalent, unmergeable states are only
+        equivalent to themselves.  Returns the list of sets and a list
+        mapping every state to its set."""
+        # Missing transitions go to an implicit dead state, which is in a
+        # block of its own.  Since that block is never split and need not
+        # be used as a splitter, the dead state can be left out entirely.
+        num_states = self.num_states
+        inverse = [None] * num_states
+        for (state, char), nextstate in self.transitions.iteritems():
+            if inverse[nextstate] is None:
+                inverse[nextstate] = {}
+            inverse[nextstate].setdefault(char, []).append(state)
+        non_final = []
+        final = []
+        blocks = []
+        for state in range(num_states):
+            if state in self.unmergeable_states:
+                blocks.append(set([state]))
+            elif state in self.final_states:
+                final.append(state)
             else:
-                state_to_set[state] = non_final
-        assert len(equivalence_sets) <= self.num_states
-        while len(equivalence_sets) < self.num_states:
-            new_equivalence_sets = set()
-            changed = False
-            for equivalent in equivalence_sets:
-                #print "checking", equivalent
-                for char in all_chars:
-                    targets = {}
-                    for state in equivalent:
-                        if (state, char) in self:
-                            nextstate = self[state, char]
-                            target = frozenset(state_to_set[nextstate])
-                        else:
-                            nextstate = None
-                            target = None
-                        targets.setdefault(target, set()).add(state)
-                    if len(targets) != 1:
-                        #print "\nsplitting %s with %r\ninto %s" % (equivalent, char, targets.values())
-                        for target, newequivalent in targets.iteritems():
-                            #print "   ", newequivalent
-                            newequivalent = frozenset(newequivalent)
-                            new_equivalence_sets.add(newequivalent)
-                            for state in newequivalent:
-                                state_to_set[state] = newequivalent
-                            #print "   ", new_equivalence_sets
-                        changed = True
-                        break
-                else:
-                    new_equivalence_sets.add(equivalent)
-            if not changed:
-                break
-            #print "end", equivalence_sets
-            #print new_equivalence_sets
-            equivalence_sets = new_equivalence_sets
+                non_final.append(state)
+        for states in [non_final, final]:
+            if states:
+                blocks.append(set(states))
+        block_of = [0] * num_states
+        for index, block in enumerate(blocks):
+            for state in block:
+                block_of[state] = index
+        # every block is a splitter to start with; after that only the
+        # smaller half of a split block needs to be used
+        pending = set(range(len(blocks)))
+        while pending:
+            char_to_sources = {}
+            for state in blocks[pending.pop()]:
+                if inverse[state] is not None:
+                    for char, sources in inverse[state].iteritems():
+                        char_to_sources.setdefault(char, []).extend(sources)
+            for sources in char_to_sources.itervalues():
+                touched = {}
+                for source in sources:
+                    touched.setdefault(block_of[source], []).append(source)
+                for index, inside in touched.iteritems():
+                    block = blocks[index]
+                    if len(inside) == len(block):
+                        continue
+                    newblock = set(inside)
+                    block.difference_update(newblock)
+                    newindex = len(blocks)
+                    blocks.append(newblock)
+                    for state in newblock:
+                        block_of[state] = newindex
+                    if index in pending or len(newblock) <= len(block):
+                        pending.add(newindex)
+                    else:
+                        pending.add(index)
+        equivalence_sets = [frozenset(block) for block in blocks]
+        state_to_set = [None] * num_states
+        for equivalent in equivalence_sets:
+            for state in equivalent:
+                state_to_set[state] = equivalent
+        return equivalence_sets, state_to_set
+
+    def optimize(self):
+        """Merge equivalent states.  Returns whether any states were
+        merged."""
+        equivalence_sets, state_to_set = self.find_equivalent_states()
         if len(equivalence_sets) == self.num_states:
             return False
         #print equivalence_sets
@@ -288,12 +303,105 @@ class DFA(object):
         exec py.code.Source(result).compile() in d
         return d['recognize']
 
-    def make_lexing_code(self):
-        code = self.generate_lexing_code()
-        exec py.code.Source(code).compile()
-        return recognize
+    def make_lexing_code(self, record_end=False, table=False):
+        if table:
+            code = self.generate_table_lexing_code(record_end)
+        else:
+            code = self.generate_lexing_code(record_end)
+        d = {}
+        exec py.code.Source(code).compile() in d
+        return d['recognize']
+
+    def get_char_classes(self):
+        """Partition all characters into equivalence classes: two
+        characters are in the same class if every state has the same
+        transition for both of them.  Returns a list mapping ord(char) to
+        its class number and the list of the characters in every class."""
+        char_to_transitions = {}
+        for (state, char), nextstate in self.transitions.iteritems():
+            char_to_transitions.setdefault(char, []).append(
+                (state, nextstate))
+        transitions_to_class = {}
+        classes = []
+        char_to_class = []
+        for i in range(256):
+            char = chr(i)
+            key = char_to_transitions.get(char, [])
+            key.sort()
+            key = tuple(key)
+            if key not in transitions_to_class:
+                transitions_to_class[key] = len(classes)
+                classes.append([])
+            charclass = transitions_to_class[key]
+            char_to_class.append(charclass)
+            classes[charclass].append(char)
+        return char_to_class, classes
+
+    def generate_table_lexing_code(self, record_end=False):
+        """Like generate_lexing_code, but the generated recognize function
+        is a small loop over a transition table with one row per state and
+        one column per character class (see get_char_classes)."""
+        from rpython.rlib.parsing.codebuilder import Codebuilder
+        char_to_class, classes = self.get_char_classes()
+        num_classes = len(classes)
+        table = [-1] * (self.num_states * num_classes)
+        has_transitions = [False] * self.num_states
+        for (state, char), nextstate in self.transitions.iteritems():
+            table[state * num_classes + char_to_class[ord(char)]] = nextstate
+            has_transitions[state] = True
+        final = [state in self.final_states
+                     for state in range(self.num_states)]
+        result = Codebuilder()
+        result.emit("#auto-generated code, don't edit")
+        for charclass, chars in enumerate(classes):
+            ranges = []
+            for a, num in compress_char_set(chars):
+                if num == 1:
+                    ranges.append(repr(a))
+                else:
+                    ranges.append("%r-%r" % (a, chr(ord(a) + num - 1)))
+            result.emit("# class %s: %s" % (charclass, " ".join(ranges)))
+        result.emit("char_classes = %r" % (
+            "".join([chr(c) for c in char_to_class]), ))
+        result.emit("num_classes = %s" % (num_classes, ))
+        result.emit("transitions = %r" % (table, ))
+        result.emit("final_states = %r" % (final, ))
+        if record_end:
+            result.emit("has_transitions = %r" % (has_transitions, ))
+        result.start_block("def recognize(runner, i):")
+        result.emit("assert i >= 0")
+        result.emit("input = runner.text")
+        result.emit("state = 0")
+        with result.block("while 1:"):
+            with result.block("if final_states[state]:"):
+                result.emit("runner.last_matched_index = i - 1")
+                result.emit("runner.last_matched_state = state")
+            with result.block("if i >= len(input):"):
+                result.emit("runner.state = state")
+                if record_end:
+                    with result.block("if has_transitions[state]:"):
+                        result.emit("runner.reached_end = True")
+                with result.block("if final_states[state]:"):
+                    result.emit("return i")
+                result.emit("return ~i")
+            result.emit("charclass = ord(char_classes[ord(input[i])])")
+            result.emit("i += 1")
+            result.emit("nextstate = transitions[state * num_classes + "
+                        "charclass]")
+            with result.block("if nextstate < 0:"):
+                result.emit("break")
+            result.emit("state = nextstate")
+        result.emit("runner.state = state")
+        result.emit("return ~i")
+        result.end_block("def")
+        result.emit("from rpython.rlib.parsing.deterministic import DFA")
+        result.emit("automaton = %s" % self)
+        return result.get_code()
 
-    def generate_lexing_code(self):
+    def generate_lexing_code(self, record_end=False):
+        """Return the source of a recognize(runner, i) function.  If
+        'record_end' is true, the function sets runner.reached_end when it
+        runs out of input while the match could still be extended."""
         from rpython.rlib.parsing.codebuilder import Codebuilder
         result = Codebuilder()
         result.start_block("def recognize(runner, i):")
@@ -319,6 +427,8 @@ class DFA(object):
                     result.emit("i += 1")
                 with result.block("except IndexError:"):
                     result.emit("runner.state = %s" % (state, ))
+                    if record_end:
+                        result.emit("runner.reached_end = True")
                     if state in self.final_states:
                         result.emit("return i")
                     else:
@@ -72,7 +72,17 @@ def check_for_missing_names(names, regexs, rules):
                 if symbol not in known_names:
                     raise ValueError("symbol '%s' not known" % (symbol, ))
 
-def make_parse_function(regexs, rules, eof=False):
+def make_parse_function(regexs, rules, eof=False, compact=False, ToAST=None,
+                        cache=False, predictive=False):
+    """Return a function that lexes and parses a string.  With
+    compact=True the tokens are kept in a lexer.TokenStream instead of a
+    list of Token objects.  If the ToAST class made by parse_ebnf is
+    given, its transformation is done while parsing and the function
+    returns what ToAST().transform() would return for the parse tree.
+    With cache=True the lexer automaton is kept on disk, see
+    lexer.make_cached_automaton.  With predictive=True the parser uses
+    one token of lookahead to skip the expansions that cannot match and
+    memoizes fewer nonterminals, see PackratParser."""
     from rpython.rlib.parsing.lexer import Lexer
     names, regexs = zip(*regexs)
     if "IGNORE" in names:
@@ -80,11 +90,20 @@ def make_parse_function(regexs, rules, eof=False):
     else:
         ignore = []
     check_for_missing_names(names, regexs, rules)
-    lexer = Lexer(list(regexs), list(names), ignore=ignore)
-    parser = PackratParser(rules, rules[0].nonterminal)
+    lexer = Lexer(list(regexs), list(names), ignore=ignore, cache=cache)
+    parser = PackratParser(rules, rules[0].nonterminal,
+                           predictive=predictive)
+    if ToAST is not None:
+        transformer = ToAST()
+    else:
+        transformer = None
     def parse(s):
-        tokens = lexer.tokenize(s, eof=eof)
-        s = parser.parse(tokens)
+        if compact:
+            s = parser.parse_stream(lexer.tokenize_compact(s, eof=eof),
+                                    transformer)
+        else:
+            tokens = lexer.tokenize(s, eof=eof)
+            s = parser.parse(tokens, transformer=transformer)
         if not we_are_translated():
             try:
                 if py.test.config.option.view:
@@ -297,6 +316,13 @@ class TransformerMaker(Codebuilder):
         self.start_block("class ToAST(object):")
         for i in range(len(self.rules)):
             self.create_visit_method(i)
+        for i in range(len(self.rules)):
+            self.create_fused_method(i)
+        self.start_block("def fuse(self, number, expansionindex, children):")
+        self.emit("#auto-generated code, don't edit")
+        self.emit("return self.fused_table[number](")
+        self.emit("    self, expansionindex, children)")
+        self.end_block("fuse")
         self.start_block("def transform(self, tree):")
         self.emit("#auto-generated code, don't edit")
         self.emit("assert isinstance(tree, Nonterminal)")
@@ -329,6 +355,8 @@ class TransformerMaker(Codebuilder):
         assert ToAST.__name__ == "ToAST"
         ToAST.source = code
         ToAST.changes = self.changes
+        ToAST.fused_table = [ToAST.__dict__["fused_%s" % (rule.nonterminal, )]
+                                 for rule in self.rules]
         return ToAST
 
     def dispatch(self, symbol, expr):
@@ -358,6 +386,41 @@ class TransformerMaker(Codebuilder):
                 self.create_returning_code(expansion, subchange)
         self.end_block(rule.nonterminal)
 
+    def create_fused_method(self, index):
+        # like the visit_ method, but called by the parser when it makes
+        # the node for an expansion, with children that are already
+        # transformed
+        rule = self.rules[index]
+        change = self.changes[index]
+        self.start_block("def fused_%s(self, expansionindex, children):" % (
+            rule.nonterminal, ))
+        self.emit("#auto-generated code, don't edit")
+        if len(change) == 0:
+            self.emit("return Nonterminal(%r, children)" % (
+                rule.nonterminal, ))
+            self.end_block(rule.nonterminal)
+            return
+        for i, subchange in enumerate(change):
+            last = i == len(change) - 1
+            if not last:
+                self.start_block("if expansionindex == %s:" % (i, ))
+            if "<" in subchange:
+                self.emit("return children[%s]" % (subchange.index("<"), ))
+            else:
+                self.emit("result = []")
+                for j, c in enumerate(subchange):
+                    if c == " ":
+                        self.emit("result.append(children[%s])" % (j, ))
+                    elif c == ">":
+                        self.emit("expr = children[%s]" % (j, ))
+                        self.emit("assert isinstance(expr, Nonterminal)")
+                        self.emit("result.extend(expr.children)")
+                self.emit("return Nonterminal(%r, result)" % (
+                    rule.nonterminal, ))
+            if not last:
+                self.end_block("if expansionindex")
+        self.end_block(rule.nonterminal)
+
     def create_returning_code(self, expansion, subchange):
         assert len(expansion) == len(subchange)
         self.emit("children = []")
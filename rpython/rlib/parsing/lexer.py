@@ -1,4 +1,6 @@
 import py
+import json
+from hashlib import md5
 from rpython.rlib.parsing import deterministic, regex
 
 class Token(object):
@@ -42,20 +44,156 @@ class SourcePos(object):
     def __repr__(self):
         return "SourcePos(%r, %r, %r)" % (self.i, self.lineno, self.columnno)
 
+# bump this when the automata built by make_automaton() or their format
+# in the cache change
+AUTOMATON_CACHE_VERSION = 2
+
+def make_automaton(token_regexs, names):
+    rex = regex.LexingOrExpression(token_regexs, names)
+    automaton = rex.make_automaton()
+    automaton = automaton.make_deterministic(names)
+    automaton.optimize() # XXX not sure whether this is a good idea
+    return automaton
+
+def dump_automaton(automaton):
+    """Serialize a DFA to a JSON string, see load_automaton."""
+    transitions = []
+    for (state, char), nextstate in sorted(automaton.transitions.items()):
+        transitions.append([state, ord(char), nextstate])
+    return json.dumps({
+        'num_states': automaton.num_states,
+        'transitions': transitions,
+        'final_states': sorted(automaton.final_states),
+        'unmergeable_states': sorted(automaton.unmergeable_states),
+        'names': automaton.names})
+
+def load_automaton(data):
+    """Make a DFA from the output of dump_automaton.  Raises ValueError
+    if 'data' is not in that format."""
+    try:
+        d = json.loads(data)
+        transitions = {}
+        for state, char, nextstate in d['transitions']:
+            transitions[state, chr(char)] = nextstate
+        return deterministic.DFA(
+            d['num_states'], transitions, set(d['final_states']),
+            set(d['unmergeable_states']),
+            [name.encode('utf-8') for name in d['names']])
+    except (KeyError, TypeError):
+        raise ValueError("invalid automaton data")
+
+def make_cached_automaton(token_regexs, names):
+    """Like make_automaton, but stores the minimized automaton in the
+    cache directory, keyed by the regexs and their names, and reuses it
+    the next time."""
+    from rpython.config.translationoption import CACHE_DIR
+    from rpython.tool.gcc_cache import try_atomic_write
+    # every regex class has a __repr__ that shows its whole structure
+    key = repr((AUTOMATON_CACHE_VERSION, token_regexs, names))
+    cache_dir = py.path.local(CACHE_DIR).ensure(dir=1)
+    cache_dir = cache_dir.join('lexer_automaton_cache').ensure(dir=1)
+    path = cache_dir.join(md5(key).hexdigest())
+    try:
+        return load_automaton(path.read())
+    except (py.error.Error, ValueError):
+        pass
+    automaton = make_automaton(token_regexs, names)
+    try_atomic_write(path, dump_automaton(automaton))
+    return automaton
+
+class TokenStream(object):
+    """A compact list of tokens: for every token only its type and the
+    start and end index in the source are stored, in flat integer lists.
+    The type is the automaton state the token was matched with, or -1 for
+    EOF.  Line and column numbers are computed when asked for, from an
+    index of the line starts that is built the first time it's needed."""
+
+    def __init__(self, text, names):
+        self.text = text
+        self.names = names
+        self.types = []
+        self.starts = []
+        self.ends = []
+        self.line_starts = None
+
+    def append(self, type, start, end):
+        self.types.append(type)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def get_length(self):
+        return len(self.types)
+
+    def get_name(self, index):
+        type = self.types[index]
+        if type == -1:
+            return "EOF"
+        return self.names[type]
+
+    def get_source(self, index):
+        if self.types[index] == -1:
+            return "EOF"
+        start = self.starts[index]
+        end = self.ends[index]
+        assert start >= 0
+        assert end >= 0
+        return self.text[start:end]
+
+    def get_position(self, i):
+        """Return line and column of the index i in the source."""
+        if self.line_starts is None:
+            line_starts = [0]
+            text = self.text
+            for j in range(len(text)):
+                if text[j] == "\n":
+                    line_starts.append(j + 1)
+            self.line_starts = line_starts
+        line_starts = self.line_starts
+        low = 0
+        high = len(line_starts)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if line_starts[middle] <= i:
+                low = middle
+            else:
+                high = middle
+        return low, i - line_starts[low]
+
+    def get_source_pos(self, index):
+        start = self.starts[index]
+        lineno, columnno = self.get_position(start)
+        return SourcePos(start, lineno, columnno)
+
+    def get_token(self, index):
+        """Make a Token object for the index-th token."""
+        return Token(self.get_name(index), self.get_source(index),
+                     self.get_source_pos(index))
+
 class Lexer(object):
-    def __init__(self, token_regexs, names, ignore=None):
+    """Tokenize text with the given regexs.  With table=True the matcher
+    is a loop over a transition table indexed by character classes instead
+    of a chain of character comparisons per state, which keeps the
+    generated code small for big grammars.  With cache=True the
+    automaton is kept on disk, see make_cached_automaton."""
+
+    table = False
+
+    def __init__(self, token_regexs, names, ignore=None, table=False,
+                 cache=False):
         self.token_regexs = token_regexs
         self.names = names
+        self.table = table
         self.rex = regex.LexingOrExpression(token_regexs, names)
-        automaton = self.rex.make_automaton()
-        self.automaton = automaton.make_deterministic(names)
-        self.automaton.optimize() # XXX not sure whether this is a good idea
+        if cache:
+            self.automaton = make_cached_automaton(token_regexs, names)
+        else:
+            self.automaton = make_automaton(token_regexs, names)
         if ignore is None:
             ignore = []
         for ign in ignore:
             assert ign in names
         self.ignore = dict.fromkeys(ignore)
-        self.matcher = self.automaton.make_lexing_code()
+        self.matcher = self.automaton.make_lexing_code(table=table)
 
     def get_runner(self, text, eof=False, token_class=None):
         return LexingDFARunner(self.matcher, self.automaton, text,
@@ -73,14 +211,24 @@ class Lexer(object):
                 break
         return result
 
+    def tokenize_compact(self, text, eof=False):
+        """Return a TokenStream of the tokens in text."""
+        r = CompactLexingDFARunner(self.matcher, self.automaton, text,
+                                   self.ignore, eof)
+        return r.tokenize()
+
     def get_dummy_repr(self):
+        if self.table:
+            matcher = self.automaton.generate_table_lexing_code()
+        else:
+            matcher = py.code.Source(self.matcher)
         return '%s\nlexer = DummyLexer(recognize, %r, %r)' % (
-                py.code.Source(self.matcher),
+                matcher,
                 self.automaton,
                 self.ignore)
 
     def __getstate__(self):
-        return (self.token_regexs, self.names, self.ignore)
+        return (self.token_regexs, self.names, self.ignore, self.table)
 
     def __setstate__(self, args):
         self.__init__(*args)
@@ -210,3 +358,46 @@ class LexingDFARunner(AbstractLexingDFARunner):
 
         return self.token_class(self.automaton.names[self.last_matched_state],
                                 text, source_pos)
+
+class CompactLexingDFARunner(AbstractLexingDFARunner):
+    """Runner that fills a TokenStream instead of making Token objects."""
+
+    def __init__(self, matcher, automaton, text, ignore, eof=False):
+        AbstractLexingDFARunner.__init__(self, matcher, automaton, text, eof)
+        self.ignore = ignore
+        self.stream = TokenStream(text, automaton.names)
+
+    def ignore_token(self, state):
+        return self.automaton.names[state] in self.ignore
+
+    def tokenize(self):
+        stream = self.stream
+        text = self.text
+        while 1:
+            self.state = 0
+            start = self.last_matched_index + 1
+            assert start >= 0
+            if start >= len(text):
+                break
+            i = self.inner_loop(start)
+            if i < 0:
+                i = ~i
+                stop = self.last_matched_index + 1
+                if start == stop:
+                    self.raise_error(start, i)
+            elif self.last_matched_index == i - 1:
+                stop = i
+            else:
+                self.raise_error(start, i)
+            if not self.ignore_token(self.last_matched_state):
+                stream.append(self.last_matched_state, start, stop)
+        if self.eof:
+            stream.append(-1, len(text), len(text))
+        return stream
+
+    def raise_error(self, start, i):
+        # like the other runners, report the line and column of the
+        # beginning of the failing token
+        lineno, columnno = self.stream.get_position(start)
+        source_pos = SourcePos(i - 1, lineno, columnno)
+        raise deterministic.LexerError(self.text, self.state, source_pos)
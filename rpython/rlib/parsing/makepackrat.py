@@ -283,6 +283,7 @@ class ErrorInformation(object):
 
 class Status(object):
     # status codes:
+    UNKNOWN = -1 # only used by array memo tables, see ParserBuilder
     NORMAL = 0
     ERROR = 1
     INPROGRESS = 2
@@ -301,11 +302,33 @@ class Status(object):
         self.result = None
 
 class ParserBuilder(RPythonVisitor, Codebuilder):
-    def __init__(self):
+    """Generate the Python source of a packrat parser.
+
+    With memo_arrays=True the generated rule methods return their result
+    directly instead of a Status object (the error goes to
+    self._last_error), and the memo table of a rule without arguments is
+    a set of parallel lists indexed by input position, allocated on the
+    first call of the rule.  Rules that call no other rule are not
+    memoized at all in that mode: they cannot recurse, and matching them
+    again is cheap.  This is a syntactic approximation; a rule that
+    calls others without ever recursing is still memoized.
+
+    With farthest_failure=True no ErrorInformation is built while
+    parsing.  A failing terminal only records its position and sets its
+    bit in a bitset of expected terminals if the position is the
+    farthest one seen so far, and backtracking raises a prebuilt
+    exception.  The error is only built from that record when a
+    BacktrackException escapes one of the public rule methods.
+    """
+    def __init__(self, memo_arrays=False, farthest_failure=False):
         Codebuilder.__init__(self)
         self.initcode = []
         self.names = {}
         self.matchers = {}
+        self.memo_arrays = memo_arrays
+        self.farthest_failure = farthest_failure
+        self.terminals = []
+        self.terminal_ids = {}
 
     def make_parser(self):
         m = {'Status': Status,
@@ -314,7 +337,36 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         exec py.code.Source(self.get_code()).compile() in m
         return m['Parser']
 
+    def emit_backtrack(self, error="None"):
+        if self.farthest_failure:
+            self.emit("raise self._prebuilt_backtrack")
+        else:
+            self.emit("raise BacktrackException(%s)" % (error, ))
+
+    def add_terminal(self, expected):
+        if expected not in self.terminal_ids:
+            self.terminal_ids[expected] = len(self.terminals)
+            self.terminals.append(expected)
+
+    def emit_record_failure(self, pos, expected):
+        self.add_terminal(expected)
+        self.emit("self._record_failure(%s, %r)" % (pos, expected))
+
+    def emit_return_status(self):
+        if self.memo_arrays:
+            self.emit("self._last_error = _status.error")
+            self.emit("return _status.result")
+        else:
+            self.emit("return _status")
+
     def memoize_header(self, name, args):
+        if self.memo_arrays:
+            if not self.have_call:
+                self.nomemo_header()
+                return
+            if not args:
+                self.array_memoize_header(name)
+                return
         dictname = "_dict_%s" % (name, )
         self.emit_initcode("self.%s = {}" % (dictname, ))
         if args:
@@ -329,9 +381,9 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
             self.emit("_statusstatus = _status.status")
             with self.block("if _statusstatus == _status.NORMAL:"):
                 self.emit("self._pos = _status.pos")
-                self.emit("return _status")
+                self.emit_return_status()
             with self.block("elif _statusstatus == _status.ERROR:"):
-                self.emit("raise BacktrackException(_status.error)")
+                self.emit_backtrack("_status.error")
             if self.have_call:
                 with self.block(
                     "elif (_statusstatus == _status.INPROGRESS or\n"
@@ -339,9 +391,9 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                     self.emit("_status.status = _status.LEFTRECURSION")
                     with self.block("if _status.result is not None:"):
                         self.emit("self._pos = _status.pos")
-                        self.emit("return _status")
+                        self.emit_return_status()
                     with self.block("else:"):
-                        self.emit("raise BacktrackException(None)")
+                        self.emit_backtrack()
                 with self.block(
                     "elif _statusstatus == _status.SOMESOLUTIONS:"):
                     self.emit("_status.status = _status.INPROGRESS")
@@ -351,7 +403,13 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         self.emit("_error = None")
 
     def memoize_footer(self, name, args):
-        dictname = "_dict_%s" % (name, )
+        if self.memo_arrays:
+            if not self.have_call:
+                self.nomemo_footer()
+                return
+            if not args:
+                self.array_memoize_footer(name)
+                return
         if self.have_call:
             with self.block(
                 "if _status.status == _status.LEFTRECURSION:"):
@@ -359,7 +417,7 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                     with self.block("if _status.pos >= self._pos:"):
                         self.emit("_status.status = _status.NORMAL")
                         self.emit("self._pos = _status.pos")
-                        self.emit("return _status")
+                        self.emit_return_status()
                 self.emit("_status.pos = self._pos")
                 self.emit("_status.status = _status.SOMESOLUTIONS")
                 self.emit("_status.result = %s" % (self.resultname, ))
@@ -372,7 +430,7 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         self.emit("_status.pos = self._pos")
         self.emit("_status.result = %s" % (self.resultname, ))
         self.emit("_status.error = _error")
-        self.emit("return _status")
+        self.emit_return_status()
         self.end_block("try")
         with self.block("except BacktrackException, _exc:"):
             self.emit("_status.pos = -1")
@@ -380,7 +438,96 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
             self.combine_error('_exc.error')
             self.emit("_status.error = _error")
             self.emit("_status.status = _status.ERROR")
-            self.emit("raise BacktrackException(_error)")
+            self.emit_backtrack("_error")
+
+    def array_memoize_header(self, name):
+        status = "self._memo_status_%s" % (name, )
+        # the tables are only allocated if the rule is called at all
+        kinds = [("status", "Status.UNKNOWN"), ("pos", "0"),
+                 ("result", "None"), ("error", "None")]
+        for kind, default in kinds:
+            self.emit_initcode("self._memo_%s_%s = None" % (kind, name))
+        with self.block("if %s is None:" % (status, )):
+            self.emit("_size = len(self._inputstream) + 1")
+            for kind, default in kinds:
+                self.emit("self._memo_%s_%s = [%s] * _size" % (
+                    kind, name, default))
+        self.emit("_key = self._pos")
+        self.emit("_statusstatus = %s[_key]" % (status, ))
+        with self.block("if _statusstatus == Status.UNKNOWN:"):
+            self.emit("%s[_key] = Status.INPROGRESS" % (status, ))
+        with self.block("elif _statusstatus == Status.NORMAL:"):
+            self.array_memo_return(name)
+        with self.block("elif _statusstatus == Status.ERROR:"):
+            self.emit_backtrack("self._memo_error_%s[_key]" % (name, ))
+        with self.block(
+            "elif (_statusstatus == Status.INPROGRESS or\n"
+            "      _statusstatus == Status.LEFTRECURSION):"):
+            self.emit("%s[_key] = Status.LEFTRECURSION" % (status, ))
+            with self.block(
+                "if self._memo_result_%s[_key] is not None:" % (name, )):
+                self.array_memo_return(name)
+            with self.block("else:"):
+                self.emit_backtrack()
+        with self.block("elif _statusstatus == Status.SOMESOLUTIONS:"):
+            self.emit("%s[_key] = Status.INPROGRESS" % (status, ))
+        self.emit("_startingpos = self._pos")
+        self.start_block("try:")
+        self.emit("_result = None")
+        self.emit("_error = None")
+
+    def array_memo_return(self, name):
+        self.emit("self._pos = self._memo_pos_%s[_key]" % (name, ))
+        self.emit("self._last_error = self._memo_error_%s[_key]" % (name, ))
+        self.emit("return self._memo_result_%s[_key]" % (name, ))
+
+    def array_memoize_footer(self, name):
+        status = "self._memo_status_%s" % (name, )
+        with self.block(
+            "if %s[_key] == Status.LEFTRECURSION:" % (status, )):
+            with self.block(
+                "if self._memo_result_%s[_key] is not None:" % (name, )):
+                with self.block(
+                    "if self._memo_pos_%s[_key] >= self._pos:" % (name, )):
+                    self.emit("%s[_key] = Status.NORMAL" % (status, ))
+                    self.array_memo_return(name)
+            self.emit("self._memo_pos_%s[_key] = self._pos" % (name, ))
+            self.emit("%s[_key] = Status.SOMESOLUTIONS" % (status, ))
+            self.emit("self._memo_result_%s[_key] = %s" % (
+                name, self.resultname))
+            self.emit("self._memo_error_%s[_key] = _error" % (name, ))
+            self.emit("self._pos = _startingpos")
+            self.emit("return self._%s()" % (name, ))
+        self.emit("%s[_key] = Status.NORMAL" % (status, ))
+        self.emit("self._memo_pos_%s[_key] = self._pos" % (name, ))
+        self.emit("self._memo_result_%s[_key] = %s" % (name, self.resultname))
+        self.emit("self._memo_error_%s[_key] = _error" % (name, ))
+        self.emit("self._last_error = _error")
+        self.emit("return %s" % (self.resultname, ))
+        self.end_block("try")
+        with self.block("except BacktrackException, _exc:"):
+            self.emit("self._memo_pos_%s[_key] = -1" % (name, ))
+            self.emit("self._memo_result_%s[_key] = None" % (name, ))
+            self.combine_error('_exc.error')
+            self.emit("self._memo_error_%s[_key] = _error" % (name, ))
+            self.emit("%s[_key] = Status.ERROR" % (status, ))
+            self.emit_backtrack("_error")
+
+    def nomemo_header(self):
+        # rules that call no other rule are cheap to match again, and
+        # can't be left-recursive
+        self.emit("_startingpos = self._pos")
+        self.start_block("try:")
+        self.emit("_result = None")
+        self.emit("_error = None")
+
+    def nomemo_footer(self):
+        self.emit("self._last_error = _error")
+        self.emit("return %s" % (self.resultname, ))
+        self.end_block("try")
+        with self.block("except BacktrackException, _exc:"):
+            self.combine_error('_exc.error')
+            self.emit_backtrack("_error")
 
     def choice_point(self, name=None):
         var = "_choice%s" % (self.namecount, )
@@ -400,6 +547,15 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 self.emit(line)
             self.emit("self._pos = 0")
             self.emit("self._inputstream = inputstream")
+            if self.farthest_failure:
+                self.emit("self._farthest_pos = -1")
+                self.emit("self._farthest_silent = 0")
+                self.emit("self._farthest_expected = [0] * %d" % (
+                    (len(self.terminals) + 31) // 32, ))
+                self.emit("self._farthest_extra = []")
+        if self.farthest_failure:
+            self.emit("_terminals = %r" % (self.terminals, ))
+            self.emit("_terminal_ids = %r" % (self.terminal_ids, ))
         if self.matchers:
             self.emit_regex_code()
         self.end_block("class")
@@ -412,9 +568,11 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 self.emit("_runner = self._Runner(self._inputstream, self._pos)")
                 self.emit("_i = _runner.recognize_%s(self._pos)" % (
                     abs(hash(regex)), ))
+                with self.block("if _runner.reached_end:"):
+                    self.emit("self._reached_end = True")
                 self.start_block("if _runner.last_matched_state == -1:")
                 self.revert(c)
-                self.emit("raise BacktrackException")
+                self.emit_backtrack()
                 self.end_block("if")
                 self.emit("_upto = _runner.last_matched_index + 1")
                 self.emit("_pos = self._pos")
@@ -431,6 +589,7 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 self.emit("self.last_matched_state = -1")
                 self.emit("self.last_matched_index = -1")
                 self.emit("self.state = -1")
+                self.emit("self.reached_end = False")
             for regex, matcher in self.matchers.iteritems():
                 matcher = str(matcher).replace(
                     "def recognize(runner, i)",
@@ -446,7 +605,17 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         argswithself = ", ".join(["self"] + otherargs)
         argswithoutself = ", ".join(otherargs)
         with self.block("def %s(%s):" % (name, argswithself)):
-            self.emit("return self._%s(%s).result" % (name, argswithoutself))
+            if self.memo_arrays:
+                call = "self._%s(%s)" % (name, argswithoutself)
+            else:
+                call = "self._%s(%s).result" % (name, argswithoutself)
+            if self.farthest_failure:
+                with self.block("try:"):
+                    self.emit("return %s" % (call, ))
+                with self.block("except BacktrackException:"):
+                    self.emit("raise BacktrackException(self._farthest_error())")
+            else:
+                self.emit("return %s" % (call, ))
         self.start_block("def _%s(%s):" % (name, argswithself, ))
         self.namecount = 0
         self.resultname = "_result"
@@ -473,7 +642,7 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 self.combine_error('_exc.error')
                 self.revert(c)
                 if i == len(possibilities) - 1:
-                    self.emit("raise BacktrackException(_error)")
+                    self.emit_backtrack("_error")
         self.dispatch(possibilities[-1])
         if len(possibilities) > 1:
             self.emit("break")
@@ -526,20 +695,31 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         self.namecount += 1
         child = t.children[0]
         self.emit("%s = _result" % (resultname, ))
+        if self.farthest_failure:
+            # failures below a negation are not what the input lacks
+            self.emit("self._farthest_silent += 1")
         with self.block("try:"):
             self.dispatch(child)
         with self.block("except BacktrackException:"):
+            if self.farthest_failure:
+                self.emit("self._farthest_silent -= 1")
             self.revert(c)
             self.emit("_result = %s" % (resultname, ))
         with self.block("else:"):
             # heuristic to get nice error messages sometimes
-            if isinstance(child, Symbol) and child.symbol == "QUOTE":
-
-                error = "self._ErrorInformation(%s, ['NOT %s'])" % (
-                        c, child.additional_info[1:-1], )
+            if self.farthest_failure:
+                self.emit("self._farthest_silent -= 1")
+                if isinstance(child, Symbol) and child.symbol == "QUOTE":
+                    self.emit_record_failure(
+                        c, "NOT %s" % (child.additional_info[1:-1], ))
+                self.emit_backtrack()
             else:
-                error = "None"
-            self.emit("raise BacktrackException(%s)" % (error, ))
+                if isinstance(child, Symbol) and child.symbol == "QUOTE":
+                    error = "self._ErrorInformation(%s, ['NOT %s'])" % (
+                            c, child.additional_info[1:-1], )
+                else:
+                    error = "None"
+                self.emit("raise BacktrackException(%s)" % (error, ))
 
     def visit_lookahead(self, t):
         resultname = "_stored_result%i" % (self.namecount, )
@@ -562,6 +742,10 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
             self.dispatch(t.children[0])
         with self.block("if not (%s):" % (
             t.children[-1].additional_info[1:-1], )):
+            if self.farthest_failure:
+                self.emit_record_failure("_startingpos", "condition not met")
+                self.emit_backtrack()
+                return
             self.emit("raise BacktrackException(")
             self.emit("    self._ErrorInformation(")
             self.emit("         _startingpos, ['condition not met']))")
@@ -573,9 +757,11 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 self.dispatch(t.children[2])
                 self.emit("break")
             with self.block("except BacktrackException, _exc:"):
+                if self.farthest_failure:
+                    self.emit("pass")
                 self.combine_error('_exc.error')
         with self.block("else:"):
-            self.emit("raise BacktrackException(_error)")
+            self.emit_backtrack("_error")
 
     def visit_call(self, t):
         self.have_call = True
@@ -583,12 +769,18 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                               for arg in t.children[1].children])
         if t.children[0].startswith("_"):
             callname = t.children[0]
+            if callname == "__any__":
+                self.add_terminal("anything")
             self.emit("_result = self.%s(%s)" % (callname, args))
         else:
             callname = "_" + t.children[0]
-            self.emit("_call_status = self.%s(%s)" % (callname, args))
-            self.emit("_result = _call_status.result")
-            self.combine_error('_call_status.error')
+            if self.memo_arrays:
+                self.emit("_result = self.%s(%s)" % (callname, args))
+                self.combine_error('self._last_error')
+            else:
+                self.emit("_call_status = self.%s(%s)" % (callname, args))
+                self.emit("_result = _call_status.result")
+                self.combine_error('_call_status.error')
 
     def visit_REGEX(self, t):
         r = t.additional_info[1:-1].replace('\\`', '`')
@@ -596,6 +788,7 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
         self.emit("_result = self._regex%s()" % (abs(hash(r)), ))
         
     def visit_QUOTE(self, t):
+        self.add_terminal(str(t.additional_info[1:-1]))
         self.emit("_result = self.__chars__(%r)" % (
                     str(t.additional_info[1:-1]), ))
 
@@ -609,11 +802,13 @@ class ParserBuilder(RPythonVisitor, Codebuilder):
                 "%s is not a valid regular expression" % regextext)
         automaton = regex.make_automaton().make_deterministic()
         automaton.optimize()
-        matcher = automaton.make_lexing_code()
+        matcher = automaton.make_lexing_code(record_end=True)
         self.matchers[r] = py.code.Source(matcher)
         return matcher
 
     def combine_error(self, newerror):
+        if self.farthest_failure:
+            return # the failure was recorded where it happened
         if self.created_error:
             self.emit(
                 "_error = self._combine_errors(_error, %s)" % (newerror, ))
@@ -648,7 +843,14 @@ class MetaPackratParser(type):
                 pass
             raise exc
         t = t.visit(TreeOptimizer())
-        visitor = ParserBuilder()
+        memo_arrays = dct.get('_memo_arrays_', False)
+        for base in bases:
+            memo_arrays = memo_arrays or getattr(base, '_memo_arrays_', False)
+        farthest_failure = dct.get('_farthest_failure_', False)
+        for base in bases:
+            farthest_failure = (farthest_failure or
+                                getattr(base, '_farthest_failure_', False))
+        visitor = ParserBuilder(memo_arrays, farthest_failure)
         t.visit(visitor)
         pcls = visitor.make_parser()
         forbidden = dict.fromkeys(("__weakref__ __doc__ "
@@ -680,18 +882,30 @@ class PackratParser(object):
     _ErrorInformation = ErrorInformation
     _BacktrackException = BacktrackException
 
+    # set _memo_arrays_ = True in a subclass to get array memo tables
+    _memo_arrays_ = False
+    _last_error = None
+
+    # set _farthest_failure_ = True in a subclass to only keep track of
+    # the farthest failure while parsing, see ParserBuilder
+    _farthest_failure_ = False
+    _prebuilt_backtrack = BacktrackException(None)
+
+    # set whenever a match looked at the end of the input; a result
+    # obtained while this is set might change if more input arrives
+    _reached_end = False
+
     def __chars__(self, chars):
         #print '__chars__(%s)' % (chars, ), self._pos
         try:
             for i in range(len(chars)):
                 if self._inputstream[self._pos + i] != chars[i]:
-                    raise BacktrackException(
-                        self._ErrorInformation(self._pos, [chars]))
+                    raise self._failure(self._pos, chars)
             self._pos += len(chars)
             return chars
         except IndexError:
-            raise BacktrackException(
-                self._ErrorInformation(self._pos, [chars]))
+            self._reached_end = True
+            raise self._failure(self._pos, chars)
 
     def  __any__(self):
         try:
@@ -699,8 +913,41 @@ class PackratParser(object):
             self._pos += 1
             return result
         except IndexError:
-            raise BacktrackException(
-                self._ErrorInformation(self._pos, ['anything']))
+            self._reached_end = True
+            raise self._failure(self._pos, 'anything')
+
+    def _failure(self, pos, expected):
+        if self._farthest_failure_:
+            self._record_failure(pos, expected)
+            return self._prebuilt_backtrack
+        return BacktrackException(self._ErrorInformation(pos, [expected]))
+
+    def _record_failure(self, pos, expected):
+        if self._farthest_silent or pos < self._farthest_pos:
+            return
+        bits = self._farthest_expected
+        if pos > self._farthest_pos:
+            self._farthest_pos = pos
+            for i in range(len(bits)):
+                bits[i] = 0
+            del self._farthest_extra[:]
+        terminal = self._terminal_ids.get(expected, -1)
+        if terminal >= 0:
+            bits[terminal >> 5] |= 1 << (terminal & 31)
+        elif expected not in self._farthest_extra:
+            # computed by the grammar, e.g. __chars__({a})
+            self._farthest_extra.append(expected)
+
+    def _farthest_error(self):
+        if self._farthest_pos < 0:
+            return None
+        bits = self._farthest_expected
+        expected = []
+        for terminal in range(len(self._terminals)):
+            if bits[terminal >> 5] & (1 << (terminal & 31)):
+                expected.append(self._terminals[terminal])
+        expected.extend(self._farthest_extra)
+        return self._ErrorInformation(self._farthest_pos, expected)
 
     def _combine_errors(self, error1, error2):
         if error1 is None:
@@ -719,6 +966,94 @@ class PackratParser(object):
                     expected.append(reason)
         return ErrorInformation(error1.pos, expected)
 
+class PackratStream(object):
+    """Feed source text to a packrat parser chunk by chunk.
+
+    'parse_form' is called with the parser and must match exactly one
+    top-level form starting at the parser's current position, returning
+    None once only the end of the input is left.  Completed forms are
+    returned by feed() as soon as no further input can change them; the
+    text they were parsed from is then dropped together with every
+    memoized result, so only the current incomplete form is kept around.
+
+    The memoized results are not kept between calls either: a result
+    may depend on where the input ended at the time.  So every feed()
+    parses the incomplete form again from its start, and a form that
+    arrives in k chunks costs k times the parsing of its text.  Feeding
+    the input in pieces like lines keeps this small; feeding a big form
+    one character at a time makes it quadratic.
+    """
+
+    def __init__(self, parser, parse_form):
+        self.parser = parser
+        self.parse_form = parse_form
+        self.buffer = ""
+        self.committed = 0      # absolute position of self.buffer[0]
+        self.lineno = 0         # line and column of self.buffer[0]
+        self.columnno = 0
+        self.eof = False
+
+    def feed(self, chunk):
+        """Add 'chunk' to the input and return the list of all forms that
+        were completed by it.  The incomplete form is parsed again from
+        its start, see the class docstring."""
+        assert not self.eof
+        self.buffer += chunk
+        return self._parse_forms()
+
+    def finish(self):
+        """Signal the end of the input and return the remaining forms.
+        Raises BacktrackException if the rest of the input doesn't parse."""
+        self.eof = True
+        return self._parse_forms()
+
+    def _parse_forms(self):
+        forms = []
+        parser = self.parser
+        while 1:
+            if not self.eof and not self.buffer:
+                break
+            parser.init_parser(self.buffer)
+            parser._reached_end = False
+            try:
+                form = self.parse_form(parser)
+            except BacktrackException, exc:
+                if parser._reached_end and not self.eof:
+                    break # might still match once more input arrives
+                if exc.error is not None:
+                    exc.error.pos += self.committed
+                raise
+            if parser._reached_end and not self.eof:
+                break
+            if form is None or parser._pos == 0:
+                break
+            self._commit(parser._pos)
+            forms.append(form)
+        return forms
+
+    def _commit(self, pos):
+        assert pos >= 0
+        consumed = self.buffer[:pos]
+        newlines = consumed.count("\n")
+        self.lineno += newlines
+        if newlines == 0:
+            self.columnno += len(consumed)
+        else:
+            self.columnno = pos - consumed.rfind("\n") - 1
+        self.buffer = self.buffer[pos:]
+        self.committed += pos
+
+    def get_line_column(self, error):
+        """Return the 0-based line and 1-based column of 'error', like
+        ErrorInformation.get_line_column() on the whole source."""
+        pos = error.pos - self.committed
+        assert pos >= 0
+        uptoerror = self.buffer[:pos]
+        newlines = uptoerror.count("\n")
+        if newlines == 0:
+            return self.lineno, self.columnno + pos + 1
+        return self.lineno + newlines, pos - uptoerror.rfind("\n")
+
 
 def test_generate():
     f = py.path.local(__file__).dirpath().join("pypackrat.py")
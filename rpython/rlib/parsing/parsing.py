@@ -1,6 +1,6 @@
 import py
 from rpython.rlib.parsing.lexer import SourcePos
-from rpython.rlib.parsing.tree import Node, Symbol, Nonterminal
+from rpython.rlib.parsing.tree import Node, Symbol, StreamSymbol, Nonterminal
 
 class Rule(object):
     def __init__(self, nonterminal, expansions):
@@ -93,24 +93,211 @@ def combine_errors(self, other):
                 failure_reasons.append(reason)
     return ErrorInformation(self.pos, failure_reasons)
 
+def expected_terminal(symbol):
+    # XXX hack unnice: handles the sort of token names that
+    # ebnfparse produces
+    if (symbol.startswith("__") and
+        symbol.split("_")[2][0] in "0123456789"):
+        return symbol.split("_")[-1]
+    return symbol
+
+class GrammarAnalysis(object):
+    """NOT_RPYTHON: nullable symbols, FIRST and FOLLOW sets of a grammar.
+
+    The FIRST lists are ordered by the first appearance of the terminals
+    in the grammar, so that error messages built from them are stable.
+    None in a FOLLOW set stands for the end of the input.
+    """
+
+    def __init__(self, rules, startsymbol):
+        self.rules = rules
+        self.startsymbol = startsymbol
+        self.nonterminal_to_rule = {}
+        for rule in rules:
+            self.nonterminal_to_rule[rule.nonterminal] = rule
+        self.compute_nullable()
+        self.compute_first()
+        self.compute_follow()
+
+    def is_nonterminal(self, symbol):
+        return symbol in self.nonterminal_to_rule
+
+    def is_nullable(self, symbols):
+        for symbol in symbols:
+            if symbol not in self.nullable:
+                return False
+        return True
+
+    def compute_nullable(self):
+        self.nullable = py.builtin.set()
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                if rule.nonterminal in self.nullable:
+                    continue
+                for expansion in rule.expansions:
+                    if self.is_nullable(expansion):
+                        self.nullable.add(rule.nonterminal)
+                        changed = True
+                        break
+
+    def compute_first(self):
+        self.first = {}
+        self.expansion_first = {}
+        for rule in self.rules:
+            firsts = [self._first_of(expansion, {rule.nonterminal: True})
+                          for expansion in rule.expansions]
+            self.expansion_first[rule.nonterminal] = firsts
+            self.first[rule.nonterminal] = self._union(firsts)
+
+    def _first_of(self, symbols, visiting):
+        result = []
+        for symbol in symbols:
+            if not self.is_nonterminal(symbol):
+                result.append(symbol)
+            elif symbol not in visiting:
+                visiting[symbol] = True
+                rule = self.nonterminal_to_rule[symbol]
+                result.extend([terminal for expansion in rule.expansions
+                                   for terminal in self._first_of(expansion,
+                                                                  visiting)])
+            if symbol not in self.nullable:
+                break
+        return self._union([result])
+
+    def _union(self, lists):
+        result = []
+        for l in lists:
+            for terminal in l:
+                if terminal not in result:
+                    result.append(terminal)
+        return result
+
+    def get_first(self, symbols):
+        return self._first_of(symbols, {})
+
+    def compute_follow(self):
+        self.follow = {}
+        for rule in self.rules:
+            self.follow[rule.nonterminal] = py.builtin.set()
+        self.follow[self.startsymbol].add(None)
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                for expansion in rule.expansions:
+                    for index, symbol in enumerate(expansion):
+                        if not self.is_nonterminal(symbol):
+                            continue
+                        rest = expansion[index + 1:]
+                        new = py.builtin.set(self.get_first(rest))
+                        if self.is_nullable(rest):
+                            new.update(self.follow[rule.nonterminal])
+                        if not new.issubset(self.follow[symbol]):
+                            self.follow[symbol].update(new)
+                            changed = True
+
+    def get_candidates(self, nonterminal, token):
+        """Return the indexes of the expansions of 'nonterminal' that can
+        match if the next token is 'token' (None for the end of the
+        input), in the order in which a packrat parser tries them.  A
+        nullable expansion always matches, the ones after it are never
+        tried."""
+        result = []
+        rule = self.nonterminal_to_rule[nonterminal]
+        for index, expansion in enumerate(rule.expansions):
+            if self.is_nullable(expansion):
+                result.append(index)
+                break
+            if token in self.expansion_first[nonterminal][index]:
+                result.append(index)
+        return result
+
+    def get_predictions(self, nonterminal):
+        """Return a dict mapping the tokens that can start 'nonterminal'
+        to their candidate expansions, and the candidates for every other
+        token."""
+        predictions = {}
+        for token in self.first[nonterminal]:
+            predictions[token] = self.get_candidates(nonterminal, token)
+        return predictions, self.get_candidates(nonterminal, None)
+
+    def is_predictive(self, nonterminal):
+        """True if one token of lookahead selects at most one expansion,
+        so that 'nonterminal' never has to backtrack over alternatives."""
+        predictions, default = self.get_predictions(nonterminal)
+        for candidates in predictions.values() + [default]:
+            if len(candidates) > 1:
+                return False
+        return True
+
+    def get_memoized(self):
+        """Return the set of nonterminals that can be tried twice at the
+        same position: those reachable from an expansion that is tried
+        after another one failed.  All others don't need to be
+        memoized."""
+        result = py.builtin.set()
+        todo = []
+        for rule in self.rules:
+            predictions, default = self.get_predictions(rule.nonterminal)
+            for candidates in predictions.values() + [default]:
+                for index in candidates[1:]:
+                    todo.extend(rule.expansions[index])
+        while todo:
+            symbol = todo.pop()
+            if self.is_nonterminal(symbol) and symbol not in result:
+                result.add(symbol)
+                for expansion in self.nonterminal_to_rule[symbol].expansions:
+                    todo.extend(expansion)
+        return result
+
+    def ll1_conflicts(self):
+        """Return the nonterminals for which the grammar is not LL(1),
+        taking FOLLOW into account for nullable expansions."""
+        result = []
+        for rule in self.rules:
+            nonterminal = rule.nonterminal
+            seen = py.builtin.set()
+            conflict = False
+            for index, expansion in enumerate(rule.expansions):
+                lookahead = py.builtin.set(
+                    self.expansion_first[nonterminal][index])
+                if self.is_nullable(expansion):
+                    lookahead.update(self.follow[nonterminal])
+                    lookahead.add("")    # at most one nullable expansion
+                if lookahead & seen:
+                    conflict = True
+                seen.update(lookahead)
+            if conflict:
+                result.append(nonterminal)
+        return result
+
+
 class LazyParseTable(object):
     def __init__(self, input, parser):
         self.parser = parser
         self.input = input
         self.matched = {}
         self.errorinformation = {}
+        self.transformer = None
 
     def match_symbol(self, i, symbol):
         #print i, symbol
         #print self.matched.keys()
-        if (i, symbol) in self.matched:
+        parser = self.parser
+        memoize = parser.needs_memo(symbol)
+        if memoize and (i, symbol) in self.matched:
             return self.matched[i, symbol]
         error = None # for the annotator
-        if self.parser.is_nonterminal(symbol):
-            rule = self.parser.get_rule(symbol)
+        if parser.is_nonterminal(symbol):
+            rule = parser.get_rule(symbol)
             subsymbol = None
             error = None
-            for expansion in rule.expansions:
+            token = self.lookahead(i)
+            candidates = parser.get_candidates(symbol, token)
+            for index in candidates:
+                expansion = rule.expansions[index]
                 curr = i
                 children = []
                 for subsymbol in expansion:
@@ -122,46 +309,118 @@ class LazyParseTable(object):
                     curr = next
                 else:
                     assert len(expansion) == len(children)
-                    result = (Nonterminal(symbol, children), curr, error)
-                    self.matched[i, symbol] = result
+                    node = self.make_nonterminal(symbol, index, children)
+                    result = (node, curr, error)
+                    if memoize:
+                        self.matched[i, symbol] = result
                     return result
-            self.matched[i, symbol] = None, 0, error
+            if len(candidates) < len(rule.expansions):
+                error = combine_errors(error, parser.get_skipped_error(
+                    i, symbol, candidates, token is None))
+            if memoize:
+                self.matched[i, symbol] = None, 0, error
             return None, 0, error
         else:
-            try:
-                input = self.input[i]
-                if self.terminal_equality(symbol, input):
-                    result = (Symbol(symbol, input.source, input), i + 1, error)
-                    self.matched[i, symbol] = result
-                    return result
-                else:
-                    # XXX hack unnice: handles the sort of token names that
-                    # ebnfparse produces
-                    if (symbol.startswith("__") and
-                        symbol.split("_")[2][0] in "0123456789"):
-                        expected = symbol.split("_")[-1]
-                    else:
-                        expected = symbol
-                    error = ErrorInformation(i, [expected])
-            except IndexError:
-                error = ErrorInformation(i)
+            return self.match_terminal(i, symbol)
+
+    def make_nonterminal(self, symbol, expansionindex, children):
+        transformer = self.transformer
+        if transformer is None:
+            return Nonterminal(symbol, children)
+        # the ToAST transformation of ebnfparse, fused into parsing
+        return transformer.fuse(self.parser.rule_numbers[symbol],
+                                expansionindex, children)
+
+    def lookahead(self, i):
+        try:
+            return self.input[i].name
+        except IndexError:
+            return None
+
+    def match_terminal(self, i, symbol):
+        error = None
+        try:
+            input = self.input[i]
+            if self.terminal_equality(symbol, input):
+                result = (Symbol(symbol, input.source, input), i + 1, error)
+                self.matched[i, symbol] = result
+                return result
+            else:
+                error = ErrorInformation(i, [expected_terminal(symbol)])
+        except IndexError:
+            error = ErrorInformation(i)
         return None, 0, error
-    
+
     def terminal_equality(self, symbol, input):
         return symbol == input.name
 
+class StreamParseTable(LazyParseTable):
+    """Parse table whose input is a lexer.TokenStream.  The terminals in
+    the parse tree are StreamSymbols, no Token objects are made."""
+
+    def match_terminal(self, i, symbol):
+        stream = self.input
+        if i >= stream.get_length():
+            return None, 0, ErrorInformation(i)
+        if symbol == stream.get_name(i):
+            node = StreamSymbol(symbol, stream.get_source(i), stream, i)
+            result = (node, i + 1, None)
+            self.matched[i, symbol] = result
+            return result
+        return None, 0, ErrorInformation(i, [expected_terminal(symbol)])
+
+    def lookahead(self, i):
+        stream = self.input
+        if i >= stream.get_length():
+            return None
+        return stream.get_name(i)
 
 class PackratParser(object):
+    """Packrat parser for a list of Rules.
+
+    With predictive=True the one token of lookahead selects the
+    expansions of a nonterminal that can match at all, see
+    GrammarAnalysis.get_candidates, and only the nonterminals that can be
+    tried twice at the same position are memoized.  This assumes that
+    the parse table compares terminals by token name.
+    """
     def __init__(self, rules, startsymbol, parsetablefactory=LazyParseTable,
-                 check_for_left_recursion=True):
+                 check_for_left_recursion=True, predictive=False):
         self.rules = rules
         self.nonterminal_to_rule = {}
-        for rule in rules:
+        self.rule_numbers = {}
+        for i, rule in enumerate(rules):
             self.nonterminal_to_rule[rule.nonterminal] = rule
+            self.rule_numbers[rule.nonterminal] = i
         self.startsymbol = startsymbol
         if check_for_left_recursion:
             assert not self.has_left_recursion()
         self.parsetablefactory = parsetablefactory
+        self.predictive = predictive
+        self.make_prediction_tables()
+
+    def make_prediction_tables(self):
+        """NOT_RPYTHON"""
+        analysis = GrammarAnalysis(self.rules, self.startsymbol)
+        memoized = analysis.get_memoized()
+        self.predictions = {}
+        self.default_candidates = {}
+        self.expected = {}
+        self.memoize = {}
+        for rule in self.rules:
+            nonterminal = rule.nonterminal
+            if self.predictive:
+                predictions, default = analysis.get_predictions(nonterminal)
+                self.memoize[nonterminal] = nonterminal in memoized
+            else:
+                predictions = {}
+                default = range(len(rule.expansions))
+                self.memoize[nonterminal] = True
+            self.predictions[nonterminal] = predictions
+            self.default_candidates[nonterminal] = default
+            self.expected[nonterminal] = [
+                [expected_terminal(terminal) for terminal in first]
+                    for first in analysis.expansion_first[nonterminal]]
 
     def is_nonterminal(self, symbol):
         return symbol in self.nonterminal_to_rule
@@ -169,18 +428,57 @@ class PackratParser(object):
     def get_rule(self, symbol):
         return self.nonterminal_to_rule[symbol]
 
-    def parse(self, tokeniterator, lazy=False):
+    def needs_memo(self, symbol):
+        # terminals are always memoized
+        return self.memoize.get(symbol, True)
+
+    def get_candidates(self, symbol, token):
+        if token is None:
+            return self.default_candidates[symbol]
+        return self.predictions[symbol].get(
+            token, self.default_candidates[symbol])
+
+    def get_skipped_error(self, i, symbol, candidates, at_end):
+        """The error that the expansions of 'symbol' that were not tried
+        at position i would have produced."""
+        if at_end:
+            return ErrorInformation(i)
+        failure_reasons = []
+        expected = self.expected[symbol]
+        for index in range(len(expected)):
+            if index in candidates:
+                continue
+            for reason in expected[index]:
+                if reason not in failure_reasons:
+                    failure_reasons.append(reason)
+        return ErrorInformation(i, failure_reasons)
+
+    def parse(self, tokeniterator, lazy=False, transformer=None):
+        """Parse the tokens.  If 'transformer' is an instance of a ToAST
+        class made by ebnfparse, the transformation is done while
+        parsing and its result is returned."""
         if lazy:
             input = LazyInputStream(tokeniterator)
         else:
             input = list(tokeniterator)
         table = self.parsetablefactory(input, self)
+        table.transformer = transformer
         result = table.match_symbol(0, self.startsymbol)
         if result[0] is None:
             error = result[2]
             raise ParseError(input[error.pos].source_pos, error)
         return result[0]
 
+    def parse_stream(self, stream, transformer=None):
+        """Parse a lexer.TokenStream, see Lexer.tokenize_compact."""
+        table = StreamParseTable(stream, self)
+        table.transformer = transformer
+        result = table.match_symbol(0, self.startsymbol)
+        if result[0] is None:
+            error = result[2]
+            raise ParseError(stream.get_source_pos(error.pos), error)
+        return result[0]
+
     def has_left_recursion(self):
         """NOT_RPYTHON"""
         follows = {}
@@ -269,27 +567,82 @@ class ParserCompiler(object):
             pass
         return None, i""" % vars())
 
+    def make_dispatch(self, symbol, failindex):
+        """Return the code that sets expansionindex to the first
+        expansion of 'symbol' that can match the next token."""
+        predictions = self.parser.predictions[symbol]
+        default = self.parser.default_candidates[symbol]
+        tokens_by_index = {}
+        for token, candidates in predictions.iteritems():
+            if candidates and candidates != default[:1]:
+                tokens_by_index.setdefault(candidates[0], []).append(token)
+        if default:
+            defaultindex = default[0]
+        else:
+            defaultindex = failindex
+        if not tokens_by_index:
+            return """\
+        expansionindex = %s""" % (defaultindex, )
+        code = ["""\
+        token = self.lookahead(i)"""]
+        keyword = "if"
+        for index, tokens in sorted(tokens_by_index.items()):
+            tokens.sort()
+            condition = " or ".join(["token == %r" % (token, )
+                                        for token in tokens])
+            code.append("""\
+        %(keyword)s %(condition)s:
+            expansionindex = %(index)s""" % vars())
+            keyword = "elif"
+        code.append("""\
+        else:
+            expansionindex = %(defaultindex)s""" % vars())
+        return "\n".join(code)
+
     def make_nonterminal_matcher(self, symbol):
         number = self.get_number(symbol)
         rule = self.parser.nonterminal_to_rule[symbol]
+        memoize = self.parser.needs_memo(symbol)
+        failindex = len(rule.expansions)
+        # without backtracking over alternatives a failed expansion
+        # means that the nonterminal fails
+        predictive = self.parser.predictive and (
+            max([len(candidates) for candidates in
+                     self.parser.predictions[symbol].values() +
+                     [self.parser.default_candidates[symbol]]]) <= 1)
+        if memoize:
+            store = "self.matched_nonterminals%s[i] = result" % (number, )
+        else:
+            store = "pass # not memoized"
         code = []
         code.append("""
     def match_nonterminal%(number)s(self, i):
-        # matcher for nonterminal %(number)s %(symbol)s
+        # matcher for nonterminal %(number)s %(symbol)s""" % vars())
+        if memoize:
+            code.append("""\
         if i in self.matched_nonterminals%(number)s:
-            return self.matched_nonterminals%(number)s[i]
-        last_failed_position = 0
-        subsymbol = None
-        expansionindex = 0
-        while 1:""" % vars())
+            return self.matched_nonterminals%(number)s[i]""" % vars())
+        code.append("""\
+        last_failed_position = i
+        subsymbol = None""")
+        if self.parser.predictive:
+            code.append(self.make_dispatch(symbol, failindex))
+        else:
+            code.append("""\
+        expansionindex = 0""")
+        code.append("""\
+        while 1:""")
         for expansionindex, expansion in enumerate(rule.expansions):
-            nextindex = expansionindex + 1
+            if predictive:
+                nextindex = failindex
+            else:
+                nextindex = expansionindex + 1
             code.append("""\
             if expansionindex == %s:""" % (expansionindex, ))
             if not expansion:
                 code.append("""\
-                result = (Nonterminal(symbol, []), i)
-                self.matched_nonterminals%(number)s[i] = result
+                result = (Nonterminal(%(symbol)r, []), i)
+                %(store)s
                 return result""" % vars())
                 continue
             code.append("""\
@@ -307,15 +660,16 @@ class ParserCompiler(object):
                     last_failed_position = next
                     expansionindex = %(nextindex)s
                     continue
+                children.append(node)
                 curr = next""" % vars())
             code.append("""\
                 result = (Nonterminal(%(symbol)r, children), curr)
-                self.matched_nonterminals%(number)s[i] = result
+                %(store)s
                 return result""" % vars())
         code.append("""\
-            if expansionindex == %(nextindex)s:
+            if expansionindex == %(failindex)s:
                 result = None, last_failed_position
-                self.matched_nonterminals%(number)s[i] = result
+                %(store)s
                 return result""" % vars())
         self.allcode.extend(code)
 
@@ -325,10 +679,13 @@ class ParserCompiler(object):
     def __init__(self):
         self.rules = [] # dummy
         self.nonterminal_to_rule = {} # dummy
+        self.rule_numbers = {} # dummy
         self.startsymbol = "" # dummy
         self.parsetablefactory = None # dummy"""]
         for symbol, number in self.symbol_to_number.iteritems():
             if self.parser.is_nonterminal(symbol):
+                if not self.parser.needs_memo(symbol):
+                    continue
                 name = "matched_nonterminals%s" % number
             else:
                 name = "matched_terminals%s" % number
@@ -342,6 +699,12 @@ class ParserCompiler(object):
         result = self.match_nonterminal%(startsymbol)s(0)
         if result[0] is None:
             raise ParseError(None, self.input[result[1]])
-        return result[0]""" % (vars()))
+        return result[0]
+
+    def lookahead(self, i):
+        try:
+            return self.input[i].name
+        except IndexError:
+            return None""" % (vars()))
         self.allcode.extend(code)
 
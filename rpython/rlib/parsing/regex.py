@@ -185,6 +185,9 @@ class NotExpression(RegularExpression):
     def __invert__(self):
         return self.reg
 
+    def __repr__(self):
+        return "NotExpression(%r)" % (self.reg, )
+
 
 class LexingOrExpression(RegularExpression):
     def __init__(self, regs, names):
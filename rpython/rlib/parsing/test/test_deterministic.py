@@ -141,6 +141,54 @@ def test_simplify():
     assert not r.recognize("111111011111111")
 
 
+def test_optimize_minimal():
+    # a chain of n states that all accept the same language (a*)
+    a = DFA()
+    n = 20
+    for i in range(n):
+        a.add_state(str(i), final=True)
+    for i in range(n - 1):
+        a[i, "a"] = i + 1
+    a[n - 1, "a"] = 0
+    assert a.optimize()
+    assert a.num_states == 1
+    assert a.transitions == {(0, "a"): 0}
+    assert not a.optimize()
+
+def test_optimize_missing_transitions():
+    a = DFA()
+    z0 = a.add_state("z0")
+    z1 = a.add_state("z1")
+    z2 = a.add_state("z2")
+    z3 = a.add_state("z3", final=True)
+    a[z0, "a"] = z1
+    a[z0, "b"] = z2
+    a[z1, "c"] = z3
+    a[z2, "c"] = z3
+    a[z2, "d"] = z3
+    # z1 and z2 differ only in z1 having no transition for "d"
+    assert not a.optimize()
+    assert a.num_states == 4
+
+def test_optimize_unmergeable():
+    a = DFA()
+    z0 = a.add_state("z0")
+    z1 = a.add_state("IF", final=True, unmergeable=True)
+    z2 = a.add_state("NAME", final=True, unmergeable=True)
+    z3 = a.add_state("z3", final=True)
+    z4 = a.add_state("z4", final=True)
+    a[z0, "i"] = z1
+    a[z0, "x"] = z2
+    a[z0, "y"] = z3
+    a[z0, "z"] = z4
+    assert a.optimize()
+    assert a.num_states == 4
+    assert sorted(a.names) == ["IF", "NAME", "z0", "z3, z4"]
+    r = a.get_runner()
+    assert r.recognize("i")
+    assert r.recognize("z")
+    assert not r.recognize("zz")
+
 def test_something():
     a = NFA()
     z0 = a.add_state("z0", start=True, final=True)
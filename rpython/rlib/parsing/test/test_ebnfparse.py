@@ -2,6 +2,7 @@ import py
 from rpython.rlib.parsing.tree import Nonterminal, Symbol, RPythonVisitor
 from rpython.rlib.parsing.parsing import PackratParser, Symbol, ParseError, Rule
 from rpython.rlib.parsing.ebnfparse import parse_ebnf, make_parse_function
+from rpython.rlib.parsing.lexer import SourcePos
 from rpython.rlib.parsing.test.test_parse import EvaluateVisitor
 
 from sets import Set
@@ -47,6 +48,47 @@ primary: "(" additive ")" | DECIMAL;
     tree = parse("0 +! 10 +! 999")
     assert tree.visit(MyEvalVisitor()) == 10 + 999
 
+def test_cached_lexer(monkeypatch, tmpdir):
+    from rpython.config import translationoption
+    monkeypatch.setattr(translationoption, "CACHE_DIR", str(tmpdir))
+    regexs, rules, transformer = parse_ebnf("""
+IGNORE: " ";
+NAME: "[a-z]+";
+DECIMAL: "0|[1-9][0-9]*";
+sum: primary "+" sum | primary;
+primary: NAME | DECIMAL;
+""")
+    for i in range(2):
+        parse = make_parse_function(regexs, rules, cache=True)
+        tree = parse("a + 12 + b")
+        assert len(tree.children) == 3
+        assert tree.children[0].children[0].additional_info == "a"
+    assert len(tmpdir.join("lexer_automaton_cache").listdir()) == 1
+
+def test_predictive():
+    regexs, rules, ToAST = parse_ebnf("""
+IGNORE: " ";
+NAME: "[a-z]+";
+DECIMAL: "0|[1-9][0-9]*";
+file: statement* EOF;
+statement: NAME "=" expr ";" | "print" expr ";";
+expr: atom "+" expr | atom;
+atom: NAME | DECIMAL | "(" expr ")";
+""")
+    parse = make_parse_function(regexs, rules, eof=True)
+    parse_predictive = make_parse_function(regexs, rules, eof=True,
+                                           predictive=True)
+    source = "a = 1 + (b + 2); print a + 3;"
+    tree = parse_predictive(source)
+    assert tree.symbol == "file"
+    assert str(tree) == str(parse(source))
+    for source in ["a = 1 + ;", "print (1 + 2;", "a = 1; b 2;"]:
+        exc1 = py.test.raises(ParseError, parse, source).value
+        exc2 = py.test.raises(ParseError, parse_predictive, source).value
+        assert exc1.source_pos == exc2.source_pos
+        assert (sorted(exc1.errorinformation.failure_reasons) ==
+                sorted(exc2.errorinformation.failure_reasons))
+
 def test_toast():
     regexs, rules, ToAST = parse_ebnf("""
 DECIMAL: "0|[1-9][0-9]*";
@@ -245,6 +287,28 @@ def test_jsonparse():
     t = ToAST().transform(t)
     print "\n".join(list(t.dot()))
 
+def test_parse_compact():
+    regexs, rules, ToAST = parse_ebnf("""
+    NUMBER: "0|[1-9][0-9]*";
+    IGNORE: " |\n";
+    additive: multitive "+" additive | <multitive>;
+    multitive: primary "*" multitive | <primary>;
+    primary: "(" additive ")" | <NUMBER>;
+    """)
+    parse = make_parse_function(regexs, rules, eof=True)
+    parse_compact = make_parse_function(regexs, rules, eof=True, compact=True)
+    source = "2 * (3 +\n 14)"
+    t1 = ToAST().transform(parse(source))
+    t2 = ToAST().transform(parse_compact(source))
+    assert str(t1) == str(t2)
+    number = t2.children[2].children[1].children[2]
+    assert number.additional_info == "14"
+    assert number.getsourcepos() == SourcePos(10, 1, 1)
+    excinfo1 = py.test.raises(ParseError, parse, "(2 *\n 3 + )")
+    excinfo2 = py.test.raises(ParseError, parse_compact, "(2 *\n 3 + )")
+    assert excinfo2.value.source_pos == excinfo1.value.source_pos
+    assert excinfo2.value.source_pos == SourcePos(8, 1, 3)
+
 def test_starparse():
     regexs, rules, ToAST = parse_ebnf("""
     QUOTED_STRING: "'[^\\']*'";
@@ -274,6 +338,37 @@ def test_double_star():
         t = ToAST().transform(t)
         assert [c.additional_info for c in t.children] == s.split()
 
+def test_fused_transform():
+    for grammar, sources in [("""
+    IGNORE: " |\n";
+    start: "a"* "b"* "c";
+""", ["a a a b b c", "a b b c", "a a c", "b b c", "c"]), ("""
+    STRING: "\\"[^\\\\"]*\\"";
+    NUMBER: "\-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][\+\-]?[0-9]+)?";
+    IGNORE: " |\n";
+    value: <STRING> | <NUMBER> | <object> | <array> | <"null"> |
+           <"true"> | <"false">;
+    object: ["{"] (entry [","])* entry ["}"];
+    array: ["["] (value [","])* value ["]"];
+    entry: STRING [":"] value;
+""", ['{"a": [1, 2, {"b": null}], "c": true}', '[false]', '12']), ("""
+    NUMBER: "0|[1-9][0-9]*";
+    IGNORE: " ";
+    additive: multitive "+" >additive< | <multitive>;
+    multitive: primary ["*"] multitive | <primary>;
+    primary: ["("] <additive> [")"] | NUMBER;
+""", ["1 + 2 + 3 * 4", "(1 + 2) * 3", "5"])]:
+        regexs, rules, ToAST = parse_ebnf(grammar)
+        parse = make_parse_function(regexs, rules, eof=True)
+        parse_fused = make_parse_function(regexs, rules, eof=True,
+                                          ToAST=ToAST)
+        parse_compact = make_parse_function(regexs, rules, eof=True,
+                                            compact=True, ToAST=ToAST)
+        for source in sources:
+            t = ToAST().transform(parse(source))
+            assert str(parse_fused(source)) == str(t)
+            assert str(parse_compact(source)) == str(t)
+
 def test_transform_star():
     #py.test.skip("This needs to be fixed - generated transformer is buggy")
     regexs, rules, ToAST = parse_ebnf("""
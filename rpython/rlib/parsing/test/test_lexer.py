@@ -133,6 +133,77 @@ class TestDirectLexer(object):
         assert tok.name == "WHITE"
         py.test.raises(deterministic.LexerError, runner.find_next_token)
 
+    def test_compact(self):
+        rexs = [StringExpression("if"), StringExpression("else"),
+                StringExpression("while"), StringExpression(":"),
+                StringExpression(" "), StringExpression("\n")]
+        names = ["IF", "ELSE", "WHILE", "COLON", "WHITE", "NL"]
+        l = self.get_lexer(rexs, names, ["WHITE"])
+        s = "if\nif if:\nelse while\n"
+        for eof in [False, True]:
+            stream = l.tokenize_compact(s, eof)
+            tokens = l.tokenize(s, eof)
+            assert stream.get_length() == len(tokens)
+            for i in range(len(tokens)):
+                assert stream.get_token(i) == tokens[i]
+        assert stream.get_name(0) == "IF"
+        assert stream.get_source(2) == "if"
+        assert stream.get_name(9) == "EOF"
+        assert stream.get_source_pos(7) == SourcePos(15, 2, 5)
+        assert stream.starts[:3] == [0, 2, 3]
+        assert stream.ends[:3] == [2, 3, 5]
+
+    def test_compact_errors(self):
+        rexs = [StringExpression("if"), StringExpression(" "),
+                StringExpression("\n")]
+        l = self.get_lexer(rexs, ["IF", "WHITE", "NL"])
+        for s in ["if\n if x", "if\n i"]:
+            exc1 = py.test.raises(deterministic.LexerError,
+                                  l.tokenize_compact, s).value
+            exc2 = py.test.raises(deterministic.LexerError,
+                                  l.tokenize, s).value
+            assert exc1.source_pos == exc2.source_pos
+
+    def test_cache(self, monkeypatch, tmpdir):
+        from rpython.config import translationoption
+        monkeypatch.setattr(translationoption, "CACHE_DIR", str(tmpdir))
+        rexs = [StringExpression("if"), StringExpression(" ")]
+        l1 = Lexer(rexs, ["IF", "WHITE"], cache=True)
+        files = tmpdir.join("lexer_automaton_cache").listdir()
+        assert len(files) == 1
+        l2 = Lexer(rexs, ["IF", "WHITE"], cache=True)
+        assert repr(l2.automaton) == repr(l1.automaton)
+        assert [t.name for t in l2.tokenize("if if")] == ["IF", "WHITE", "IF"]
+        Lexer(rexs, ["IF", "SPACE"], cache=True)
+        assert len(tmpdir.join("lexer_automaton_cache").listdir()) == 2
+        # a broken file is rebuilt
+        files[0].write("DFA(1, {}, set(), set(), [])")
+        l3 = Lexer(rexs, ["IF", "WHITE"], cache=True)
+        assert repr(l3.automaton) == repr(l1.automaton)
+        assert files[0].read() != "DFA(1, {}, set(), set(), [])"
+
+    def test_cache_key(self, monkeypatch, tmpdir):
+        from rpython.config import translationoption
+        monkeypatch.setattr(translationoption, "CACHE_DIR", str(tmpdir))
+        def make_rexs():
+            return [~StringExpression("a"), StringExpression("b").kleene()]
+        assert repr(make_rexs()) == repr(make_rexs())
+        Lexer(make_rexs(), ["NOTA", "BS"], cache=True)
+        Lexer(make_rexs(), ["NOTA", "BS"], cache=True)
+        assert len(tmpdir.join("lexer_automaton_cache").listdir()) == 1
+
+    def test_dump_load_automaton(self):
+        from rpython.rlib.parsing.lexer import make_automaton
+        from rpython.rlib.parsing.lexer import dump_automaton, load_automaton
+        rexs = [StringExpression("if"), StringExpression("\xff\n")]
+        a = make_automaton(rexs, ["IF", "ODD"])
+        b = load_automaton(dump_automaton(a))
+        assert repr(b) == repr(a)
+        assert b.names == a.names
+        assert type(b.names[0]) is str
+        py.test.raises(ValueError, load_automaton, "[1, 2]")
+        py.test.raises(ValueError, load_automaton, "DFA(1, {})")
+
 class TestSourcePos(object):
     def test_copy(self):
         base = SourcePos(1, 2, 3)
@@ -156,3 +227,29 @@ class TestToken(object):
         copy = base.copy()
         copy.source_pos.i = 0 # changes base too
         assert base==copy
+
+
+class TestTableLexer(TestDirectLexer):
+    def get_lexer(self, rexs, names, ignore=None):
+        return Lexer(rexs, names, ignore, table=True)
+
+    def test_char_classes(self):
+        rexs = [StringExpression("if"), StringExpression("ab"),
+                RangeExpression("a", "z").kleene()]
+        l = self.get_lexer(rexs, ["IF", "AB", "ATOM"])
+        char_to_class, classes = l.automaton.get_char_classes()
+        assert len(char_to_class) == 256
+        assert char_to_class[ord("0")] == 0
+        assert char_to_class[ord("c")] == char_to_class[ord("z")]
+        assert char_to_class[ord("c")] != char_to_class[ord("a")]
+        assert char_to_class[ord("c")] != char_to_class[ord("i")]
+        assert len(classes) == 6
+
+    def test_dummy_repr(self):
+        rexs = [StringExpression("if"), StringExpression(" ")]
+        l = self.get_lexer(rexs, ["IF", "WHITE"], ["WHITE"])
+        d = {'DummyLexer': DummyLexer}
+        exec py.code.Source(l.get_dummy_repr()).compile() in d
+        dummy = d['lexer']
+        assert ([t.name for t in dummy.tokenize("if  if")] ==
+                [t.name for t in l.tokenize("if  if")] == ["IF", "IF"])
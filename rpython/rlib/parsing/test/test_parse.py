@@ -79,3 +79,103 @@ def test_epsilon():
                         for i, c, in enumerate("xx")]) is not None
     t = p.parse([Token(c, i, SourcePos(i, 0, i))
                      for i, c, in enumerate("xxxxxx")])
+
+def make_tokens(s):
+    return [Token(c, i, SourcePos(i, 0, i)) for i, c in enumerate(s)]
+
+def test_grammar_analysis():
+    r1 = Rule("S", [["A", "B", "z"], ["B", "y"]])
+    r2 = Rule("A", [["a", "A"], []])
+    r3 = Rule("B", [["b"], ["A", "c"]])
+    analysis = GrammarAnalysis([r1, r2, r3], "S")
+    assert analysis.nullable == py.builtin.set(["A"])
+    assert analysis.first["A"] == ["a"]
+    assert analysis.first["B"] == ["b", "a", "c"]
+    assert analysis.expansion_first["S"] == [["a", "b", "c"], ["b", "a", "c"]]
+    assert analysis.follow["S"] == py.builtin.set([None])
+    assert analysis.follow["A"] == py.builtin.set(["b", "a", "c"])
+    assert analysis.follow["B"] == py.builtin.set(["z", "y"])
+    assert analysis.get_candidates("S", "b") == [0, 1]
+    assert analysis.get_candidates("S", "x") == []
+    # the nullable expansion always matches
+    assert analysis.get_candidates("A", "a") == [0, 1]
+    assert analysis.get_candidates("A", "x") == [1]
+    assert analysis.get_candidates("B", "c") == [1]
+    assert not analysis.is_predictive("S")
+    assert analysis.is_predictive("B")
+    assert analysis.get_memoized() == py.builtin.set(["A", "B"])
+    assert analysis.ll1_conflicts() == ["S", "A"]
+    r4 = Rule("C", [["A", "b"], ["c"]])
+    analysis = GrammarAnalysis([r4, r2], "C")
+    # A is only ever tried once at a position
+    assert analysis.get_memoized() == py.builtin.set()
+
+def test_predictive_memoization():
+    r1 = Rule("additive", [["multitive", "+", "additive"], ["multitive"]])
+    r2 = Rule("multitive", [["primary", "*", "multitive"], ["primary"]])
+    r3 = Rule("primary", [["(", "additive", ")"], ["decimal"]])
+    r4 = Rule("decimal", [[symb] for symb in "0123456789"])
+    r5 = Rule("list", [["[", "items", "]"]])
+    r6 = Rule("items", [["decimal", "items"], []])
+    p = PackratParser([r1, r2, r3, r4, r5, r6], "additive", predictive=True)
+    assert not p.needs_memo("list")
+    assert not p.needs_memo("items")
+    assert p.needs_memo("multitive")
+    assert p.get_candidates("primary", "(") == [0]
+    assert p.get_candidates("primary", "+") == []
+    p2 = PackratParser([r5, r6, r4], "list", predictive=True)
+    assert not p2.needs_memo("decimal")
+    t = p2.parse(make_tokens("[123]"))
+    assert [c.symbol for c in t.children] == ["[", "items", "]"]
+
+def test_predictive_same_result():
+    r0 = Rule("expression", [["additive", "EOF"]])
+    r1 = Rule("additive", [["multitive", "+", "additive"], ["multitive"]])
+    r2 = Rule("multitive", [["primary", "*", "multitive"], ["primary"]])
+    r3 = Rule("primary", [["(", "additive", ")"], ["decimal"]])
+    r4 = Rule("decimal", [[symb] for symb in "0123456789"])
+    rules = [r0, r1, r2, r3, r4]
+    p1 = PackratParser(rules, "expression", predictive=False)
+    p2 = PackratParser(rules, "expression", predictive=True)
+    for s in ["2*(3+4)", "2*2*2*(7*3+4+5*6)", "1+2"]:
+        tokens = make_tokens(list(s) + ["EOF"])
+        assert str(p1.parse(tokens)) == str(p2.parse(tokens))
+    for s in ["2*(3+)", "+", "(1*2", "12"]:
+        tokens = make_tokens(list(s) + ["EOF"])
+        exc1 = py.test.raises(ParseError, p1.parse, tokens).value
+        exc2 = py.test.raises(ParseError, p2.parse, tokens).value
+        assert exc1.source_pos == exc2.source_pos
+        reasons1 = exc1.errorinformation.failure_reasons
+        reasons2 = exc2.errorinformation.failure_reasons
+        assert sorted(reasons1) == sorted(reasons2)
+
+def test_compiled_parser():
+    r0 = Rule("expression", [["additive", "EOF"]])
+    r1 = Rule("additive", [["multitive", "+", "additive"], ["multitive"]])
+    r2 = Rule("multitive", [["primary", "*", "multitive"], ["primary"]])
+    r3 = Rule("primary", [["(", "additive", ")"], ["decimal"]])
+    r4 = Rule("decimal", [[symb] for symb in "0123456789"])
+    p = PackratParser([r0, r1, r2, r3, r4], "expression", predictive=True)
+    compiler = ParserCompiler(p)
+    kls = compiler.compile()
+    code = "\n".join(compiler.allcode)
+    assert "token = self.lookahead(i)" in code
+    # the start symbol is never tried twice at the same position
+    assert "self.matched_nonterminals%s" % (
+        compiler.get_number("expression"), ) not in code
+    tree = kls().parse(make_tokens(list("2*(3+4)") + ["EOF"]))
+    assert tree.symbol == "expression"
+    assert [c.symbol for c in tree.children] == ["additive", "EOF"]
+
+def test_compiled_parser_error_position():
+    r0 = Rule("s", [["a", "b", "EOF"]])
+    r1 = Rule("a", [["X"]])
+    r2 = Rule("b", [["Y", "Z"], ["Z"]])
+    tokens = make_tokens(["X", "Q", "EOF"])
+    positions = []
+    for predictive in [False, True]:
+        p = PackratParser([r0, r1, r2], "s", predictive=predictive)
+        kls = ParserCompiler(p).compile()
+        exc = py.test.raises(ParseError, kls().parse, tokens).value
+        positions.append(exc.errorinformation.source_pos)
+    assert positions[0] == positions[1] == tokens[1].source_pos
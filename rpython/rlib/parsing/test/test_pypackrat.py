@@ -549,3 +549,153 @@ class TestPackrat(object):
         p = parser('''from __future__ import (division as d, \ngenerators)\n''')
         lines = p.fromimport()
         assert lines == ['division', 'generators']
+
+
+class ArrayMemoPackratParser(PackratParser):
+    _memo_arrays_ = True
+
+class TestPackratMemoArrays(TestPackrat):
+    def setup_method(self, method):
+        global PackratParser
+        self.orig_parser_class = PackratParser
+        PackratParser = ArrayMemoPackratParser
+
+    def teardown_method(self, method):
+        global PackratParser
+        PackratParser = self.orig_parser_class
+
+    def test_code(self):
+        class parser(PackratParser):
+            """
+            a: b 'a' | b;
+            b: 'b';
+            """
+        assert "Status()" not in parser._code
+        assert "_memo_result_a" in parser._code
+        # b calls no other rule and is not memoized
+        assert "_memo_result_b" not in parser._code
+        p = parser("ba")
+        # the memo tables are allocated by the first call
+        assert p._memo_status_a is None
+        assert p.a() == 'a'
+        assert len(p._memo_status_a) == 3
+        assert p._memo_status_a[0] == Status.NORMAL
+        assert p._memo_status_a[1] == Status.UNKNOWN
+
+
+class FarthestPackratParser(PackratParser):
+    _farthest_failure_ = True
+
+class TestPackratFarthestFailure(TestPackrat):
+    def setup_method(self, method):
+        global PackratParser
+        self.orig_parser_class = PackratParser
+        PackratParser = FarthestPackratParser
+
+    def teardown_method(self, method):
+        global PackratParser
+        PackratParser = self.orig_parser_class
+
+    def test_code(self):
+        class parser(PackratParser):
+            """
+            a: b 'a' | b 'c';
+            b: 'b' !'x';
+            """
+        assert "ErrorInformation" not in parser._code
+        assert "_combine_errors" not in parser._code
+        assert parser._terminals == ['a', 'c', 'b', 'x', 'NOT x']
+        p = parser("bd")
+        excinfo = py.test.raises(BacktrackException, p.a)
+        assert excinfo.value.error.pos == 1
+        assert excinfo.value.error.expected == ['a', 'c']
+        assert p._farthest_expected == [1 | 2]
+
+    def test_farthest_in_maybe(self):
+        class parser(PackratParser):
+            """
+            a: 'x' 'y'? 'z';
+            """
+        p = parser("xw")
+        excinfo = py.test.raises(BacktrackException, p.a)
+        assert excinfo.value.error.pos == 1
+        assert excinfo.value.error.expected == ['y', 'z']
+
+    def test_many_terminals(self):
+        names = ["t%s" % (i, ) for i in range(40)]
+        class parser(PackratParser):
+            __doc__ = "a: %s;" % (" | ".join(["'%s'" % (name, )
+                                             for name in names]), )
+        p = parser("t3")
+        assert p.a() == "t3"
+        p = parser("tx")
+        excinfo = py.test.raises(BacktrackException, p.a)
+        assert excinfo.value.error.pos == 0
+        assert excinfo.value.error.expected == names
+
+
+class TestPackratStream(object):
+    def make_stream(self):
+        from rpython.rlib.parsing.makepackrat import PackratStream
+        class parser(PackratParser):
+            """
+            IGNORE:
+                ` |\n`;
+            NAME:
+                n = `[a-z]+`
+                IGNORE*
+                return {n};
+            EOF:
+                !__any__;
+            form:
+                IGNORE*
+                f = sexpr
+                return {f}
+              | IGNORE*
+                EOF
+                return {None};
+            sexpr:
+                '('
+                IGNORE*
+                l = sexpr*
+                ')'
+                IGNORE*
+                return {l}
+              | NAME;
+            """
+        return PackratStream(parser(""), parser.form)
+
+    def test_chunks(self):
+        s = self.make_stream()
+        forms = s.feed("(a (b")
+        assert forms == []
+        forms = s.feed(" c)) (d")
+        assert forms == [['a', ['b', 'c']]]
+        assert s.buffer == "(d"
+        forms = s.feed(") ef")
+        assert forms == [['d']]
+        # 'ef' could still continue in the next chunk
+        assert s.buffer == "ef"
+        forms = s.feed("g\n")
+        assert forms == []
+        forms = s.feed("(x")
+        assert forms == ['efg']
+        py.test.raises(BacktrackException, s.finish)
+
+    def test_finish(self):
+        s = self.make_stream()
+        forms = s.feed("a b")
+        assert forms == ['a']
+        forms = s.finish()
+        assert forms == ['b']
+        assert s.committed == 3
+
+    def test_error_position(self):
+        s = self.make_stream()
+        forms = s.feed("(a)\n  (b")
+        assert forms == [['a']]
+        assert s.committed == 6
+        assert (s.lineno, s.columnno) == (1, 2)
+        exc = py.test.raises(BacktrackException, s.feed, ")) c").value
+        assert exc.error.pos == 9
+        assert s.get_line_column(exc.error) == (1, 6)
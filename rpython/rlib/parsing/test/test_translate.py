@@ -40,6 +40,10 @@ class TestTranslateLexer(object):
         res = lex("if A a 12341 0 else", True).split("-%-")
         assert res == "KEYWORD VAR ATOM INT INT KEYWORD".split()
 
+class TestTranslateTableLexer(TestTranslateLexer):
+    def get_lexer(self, rexs, names, ignore=None):
+        return Lexer(rexs, names, ignore, table=True)
+
 
 def test_translate_parser():
     r0 = Rule("expression", [["additive", "EOF"]])
@@ -109,6 +113,25 @@ primary: "(" <additive> ")" | <DECIMAL>;
     assert res1 == res2
 
 
+def test_translate_fused_ast_visitor():
+    from rpython.rlib.parsing.ebnfparse import parse_ebnf, make_parse_function
+    regexs, rules, ToAST = parse_ebnf("""
+DECIMAL: "0|[1-9][0-9]*";
+IGNORE: " ";
+additive: multitive ["+!"] additive | <multitive>;
+multitive: primary ["*!"] multitive | <primary>; #nonsense!
+primary: "(" <additive> ")" | <DECIMAL>;
+""")
+    parse = make_parse_function(regexs, rules, ToAST=ToAST)
+    def f():
+        tree = parse("(0 +! 10) *! (999 +! 10) +! 1")
+        return tree.symbol + " " + "-&-".join([c.symbol for c in tree.children])
+    res1 = f()
+    assert res1 == "additive multitive-&-DECIMAL"
+    func = compile(f, [])
+    res2 = func()
+    assert res1 == res2
+
 def test_translate_pypackrat():
     from rpython.rlib.parsing.pypackrat import PackratParser
     class parser(PackratParser):
@@ -158,3 +181,61 @@ def test_translate_pypackrat_regex():
     assert res == '12345'
     res = func("0")
     assert res == '0'
+
+def test_translate_pypackrat_memo_arrays():
+    from rpython.rlib.parsing.pypackrat import PackratParser
+    class parser(PackratParser):
+        """
+        expr:
+            additive;
+        additive:
+            a = additive
+            '-'
+            b = simple
+            return {'(%s - %s)' % (a, b)}
+          | simple;
+        simple:
+            `[0-9]+`;
+        """
+        _memo_arrays_ = True
+    print parser._code
+    def parse(s):
+        p = parser(s)
+        return p.expr()
+    res = parse("5-15-5")
+    assert res == '((5 - 15) - 5)'
+    func = compile(parse, [str])
+    res = func("5-15-5")
+    assert res == '((5 - 15) - 5)'
+
+def test_translate_pypackrat_farthest_failure():
+    from rpython.rlib.parsing.pypackrat import PackratParser
+    class parser(PackratParser):
+        """
+        expr:
+            a = additive
+            !__any__
+            return {a};
+        additive:
+            a = simple
+            '-'
+            b = additive
+            return {'(%s - %s)' % (a, b)}
+          | simple;
+        simple:
+            `[0-9]+`
+          | '(' a = additive ')' return {a};
+        """
+        _farthest_failure_ = True
+    print parser._code
+    def parse(s):
+        p = parser(s)
+        try:
+            return p.expr()
+        except BacktrackException, e:
+            return "%s: %s" % (e.error.pos, "/".join(e.error.expected))
+    assert parse("5-(15-5)") == '(5 - (15 - 5))'
+    assert parse("5-(15+5)") == '5: -/)'
+    func = compile(parse, [str])
+    assert func("5-(15-5)") == '(5 - (15 - 5))'
+    assert func("5-(15+5)") == '5: -/)'
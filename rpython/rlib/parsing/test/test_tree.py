@@ -1,6 +1,7 @@
 import py
 
-from rpython.rlib.parsing.tree import Nonterminal, Symbol
+from rpython.rlib.parsing.tree import Nonterminal, Symbol, TreeArena
+from rpython.rlib.parsing.tree import VisitError, make_arena_visitor
 from rpython.rlib.parsing.lexer import Token, SourcePos
 
 class TestTreeAppLevel(object):
@@ -47,6 +48,56 @@ class TestTreeAppLevel(object):
         assert len(tree.children) != 0 # the not-so-trivial part.
         py.test.raises(IndexError, tree.getsourcepos)
 
+class CountVisitor(object):
+    def visit_a(self, arena, node):
+        result = 0
+        for i in range(arena.get_length(node)):
+            result += self.dispatch(arena, arena.get_child(node, i))
+        return result
+
+    def visit_B(self, arena, node):
+        return len(arena.get_additional_info(node))
+
+class TestTreeArena(object):
+    kinds = ["a", "c", "B"]
+
+    def make_tree(self):
+        pos = SourcePos(1, 2, 3)
+        token = Token(name="B", source="bb", source_pos=pos)
+        return Nonterminal("a", [Symbol("B", "bb", token),
+                                 Nonterminal("c", []),
+                                 Nonterminal("a", [Symbol("B", "bbb", token)])])
+
+    def test_add_tree(self):
+        arena = TreeArena(self.kinds)
+        tree = self.make_tree()
+        node = arena.add_tree(tree)
+        assert arena.get_symbol(node) == "a"
+        assert arena.get_kind(node) == 0
+        assert arena.get_length(node) == 3
+        child = arena.get_child(node, 0)
+        assert not arena.is_nonterminal(child)
+        assert arena.get_additional_info(child) == "bb"
+        assert arena.get_token(child) is tree.children[0].token
+        assert arena.get_length(child) == 0
+        assert arena.get_length(arena.get_child(node, 1)) == 0
+        assert arena.is_nonterminal(arena.get_child(node, 1))
+        # all children share one list
+        assert len(arena.children) == 4
+        assert str(arena.to_tree(node)) == str(tree)
+        py.test.raises(KeyError, arena.add_symbol, "D", "d", None)
+
+    def test_visitor(self):
+        arena = TreeArena(self.kinds)
+        node = arena.add_tree(self.make_tree())
+        visitor = make_arena_visitor(CountVisitor, self.kinds)()
+        py.test.raises(VisitError, visitor.dispatch, arena, node)
+        class GeneralCountVisitor(CountVisitor):
+            def general_visit(self, arena, node):
+                return 100
+        visitor = make_arena_visitor(GeneralCountVisitor, self.kinds)()
+        assert visitor.dispatch(arena, node) == 105
+
 class TestTreeTranslated(object):
     def compile(self, f):
         from rpython.translator.c.test.test_genc import compile
@@ -79,3 +130,21 @@ class TestTreeTranslated(object):
                 return -42
         f = self.compile(foo)
         assert f() == -42
+
+    def test_arena_visitor(self):
+        kinds = ["a", "c", "B"]
+        class GeneralCountVisitor(CountVisitor):
+            def general_visit(self, arena, node):
+                return 100
+        visitor = make_arena_visitor(GeneralCountVisitor, kinds)()
+        def foo():
+            arena = TreeArena(kinds)
+            b1 = arena.add_symbol("B", "bb", None)
+            c = arena.add_nonterminal("c", [])
+            b2 = arena.add_symbol("B", "bbb", None)
+            inner = arena.add_nonterminal("a", [b2])
+            node = arena.add_nonterminal("a", [b1, c, inner])
+            return visitor.dispatch(arena, node)
+        assert foo() == 105
+        f = self.compile(foo)
+        assert f() == 105
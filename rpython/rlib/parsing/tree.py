@@ -47,6 +47,18 @@ class Symbol(Node):
             return self
         return method(self)
 
+class StreamSymbol(Symbol):
+    """A Symbol for the index-th token of a lexer.TokenStream.  It has no
+    Token object, the source position is computed when asked for."""
+
+    def __init__(self, symbol, additional_info, stream, index):
+        Symbol.__init__(self, symbol, additional_info, None)
+        self.stream = stream
+        self.index = index
+
+    def getsourcepos(self):
+        return self.stream.get_source_pos(self.index)
+
 class Nonterminal(Node):
     def __init__(self, symbol, children):
         self.children = children
@@ -138,3 +150,118 @@ class CreateDispatchDictionaryMetaclass(type):
 
 class RPythonVisitor(object):
     __metaclass__ = CreateDispatchDictionaryMetaclass
+
+
+class TreeArena(object):
+    """Compact storage for parse trees.
+
+    A node is a small int.  Its kind is the index of its symbol in the
+    list of kinds the arena was made with, and the children of a
+    nonterminal are a slice of the flat list self.children that is
+    shared by all nodes.  Symbols keep their additional_info and token
+    in two more parallel lists.
+    """
+
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.kind_numbers = {}
+        for i in range(len(kinds)):
+            self.kind_numbers[kinds[i]] = i
+        self.node_kinds = []
+        self.node_starts = []   # into self.children, or into self.infos
+        self.node_lengths = []  # number of children, -1 for symbols
+        self.children = []
+        self.infos = []
+        self.tokens = []
+
+    def get_kind_number(self, symbol):
+        return self.kind_numbers[symbol]
+
+    def add_symbol(self, symbol, additional_info, token):
+        node = len(self.node_kinds)
+        self.node_kinds.append(self.kind_numbers[symbol])
+        self.node_starts.append(len(self.infos))
+        self.node_lengths.append(-1)
+        self.infos.append(additional_info)
+        self.tokens.append(token)
+        return node
+
+    def add_nonterminal(self, symbol, children):
+        node = len(self.node_kinds)
+        self.node_kinds.append(self.kind_numbers[symbol])
+        self.node_starts.append(len(self.children))
+        self.node_lengths.append(len(children))
+        self.children.extend(children)
+        return node
+
+    def get_kind(self, node):
+        return self.node_kinds[node]
+
+    def get_symbol(self, node):
+        return self.kinds[self.node_kinds[node]]
+
+    def is_nonterminal(self, node):
+        return self.node_lengths[node] >= 0
+
+    def get_length(self, node):
+        length = self.node_lengths[node]
+        if length < 0:
+            return 0
+        return length
+
+    def get_child(self, node, i):
+        assert 0 <= i < self.node_lengths[node]
+        return self.children[self.node_starts[node] + i]
+
+    def get_additional_info(self, node):
+        assert self.node_lengths[node] < 0
+        return self.infos[self.node_starts[node]]
+
+    def get_token(self, node):
+        assert self.node_lengths[node] < 0
+        return self.tokens[self.node_starts[node]]
+
+    def add_tree(self, tree):
+        """Store the tree made of Nonterminals and Symbols 'tree' in the
+        arena and return its node."""
+        if isinstance(tree, Nonterminal):
+            children = [self.add_tree(child) for child in tree.children]
+            return self.add_nonterminal(tree.symbol, children)
+        assert isinstance(tree, Symbol)
+        return self.add_symbol(tree.symbol, tree.additional_info, tree.token)
+
+    def to_tree(self, node):
+        """Return the tree of Nonterminals and Symbols for 'node'."""
+        if self.is_nonterminal(node):
+            children = [self.to_tree(self.get_child(node, i))
+                            for i in range(self.get_length(node))]
+            return Nonterminal(self.get_symbol(node), children)
+        return Symbol(self.get_symbol(node), self.get_additional_info(node),
+                      self.get_token(node))
+
+def make_arena_dispatch_function(table):
+    def dispatch(self, arena, node):
+        return table[arena.node_kinds[node]](self, arena, node)
+    return dispatch
+
+def make_arena_visitor(cls, kinds):
+    """NOT_RPYTHON: return a subclass of 'cls' whose dispatch(arena,
+    node) calls the visit_<symbol>(self, arena, node) method for nodes of
+    a TreeArena(kinds) through a list indexed by the kind of the node.
+    Kinds without a visit method go to general_visit."""
+    general = getattr(cls, "general_visit", None)
+    if general is None:
+        def general(self, arena, node):
+            raise VisitError(arena.to_tree(node))
+    else:
+        general = general.im_func
+    table = []
+    for kind in kinds:
+        method = getattr(cls, "visit_" + kind, None)
+        if method is None:
+            table.append(general)
+        else:
+            table.append(method.im_func)
+    dct = {"dispatch": make_arena_dispatch_function(table),
+           "kinds": kinds}
+    return type(cls.__name__, (cls, ), dct)
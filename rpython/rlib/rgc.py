@@ -441,6 +441,35 @@ def dump_rpy_heap(fd):
     "NOT_RPYTHON"
     raise NotImplementedError
 
+def dump_rpy_heap_compact(fd, compress):
+    "NOT_RPYTHON"
+    raise NotImplementedError
+
+# The events for which the GC keeps statistics, see get_gc_stat().
+GCSTAT_MINOR_PAUSE = 0      # duration of minor collections, in ticks
+GCSTAT_MAJOR_STEP = 1       # duration of major collection steps, in ticks
+GCSTAT_PROMOTED = 2         # bytes moved out of the nursery
+GCSTAT_CARD_SCANS = 3       # card pages scanned by a minor collection
+GCSTAT_PINNED = 4           # pinned objects left in the nursery
+GCSTAT_NUM_EVENTS = 5
+
+# For each event: the number of times it occurred, the sum and the
+# maximum of its values, and a histogram in which the bucket
+# GCSTAT_HISTOGRAM + i counts the values between 2**(i-1) and 2**i - 1.
+GCSTAT_COUNT = 0
+GCSTAT_TOTAL = 1
+GCSTAT_MAX = 2
+GCSTAT_HISTOGRAM = 3
+GCSTAT_NUM_BUCKETS = 48
+GCSTAT_SIZE = GCSTAT_HISTOGRAM + GCSTAT_NUM_BUCKETS
+
+def get_gc_stat(event, index):
+    """Return the 'index' entry of the statistics about the GC 'event',
+    cumulated since the start of the program.  The ticks are the ones
+    of rtimer.read_timestamp().  Returns -1 if the GC doesn't keep
+    statistics."""
+    return -1
+
 def get_typeids_z():
     "NOT_RPYTHON"
     raise NotImplementedError
@@ -678,6 +707,27 @@ class Entry(ExtRegistryEntry):
         hop.exception_is_here()
         return hop.genop('gc_dump_rpy_heap', vlist, resulttype = hop.r_result)
 
+class Entry(ExtRegistryEntry):
+    _about_ = dump_rpy_heap_compact
+    def compute_result_annotation(self, s_fd, s_compress):
+        from rpython.annotator.model import s_Bool
+        return s_Bool
+    def specialize_call(self, hop):
+        vlist = hop.inputargs(lltype.Signed, lltype.Bool)
+        hop.exception_is_here()
+        return hop.genop('gc_dump_rpy_heap_compact', vlist,
+                         resulttype = hop.r_result)
+
+class Entry(ExtRegistryEntry):
+    _about_ = get_gc_stat
+    def compute_result_annotation(self, s_event, s_index):
+        from rpython.annotator import model as annmodel
+        return annmodel.SomeInteger()
+    def specialize_call(self, hop):
+        vlist = hop.inputargs(lltype.Signed, lltype.Signed)
+        hop.exception_cannot_occur()
+        return hop.genop('gc_get_stat', vlist, resulttype=hop.r_result)
+
 class Entry(ExtRegistryEntry):
     _about_ = get_typeids_z
 
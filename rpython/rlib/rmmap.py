@@ -70,6 +70,8 @@ if _POSIX:
     CConfig.MREMAP_MAYMOVE = (
         rffi_platform.DefinedConstantInteger("MREMAP_MAYMOVE"))
     CConfig.has_mremap = rffi_platform.Has('mremap(NULL, 0, 0, 0)')
+    CConfig.MADV_DONTNEED = (
+        rffi_platform.DefinedConstantInteger("MADV_DONTNEED"))
     # a dirty hack, this is probably a macro
 
 elif _MS_WINDOWS:
@@ -154,6 +156,8 @@ if _POSIX:
     if has_mremap:
         c_mremap, _ = external('mremap',
                                [PTR, size_t, size_t, rffi.ULONG], PTR)
+    _, c_madvise_safe = external('madvise', [PTR, size_t, rffi.INT],
+                                 rffi.INT)
 
     # this one is always safe
     _pagesize = rffi_platform.getintegerfunctionresult('getpagesize',
@@ -709,6 +713,31 @@ if _POSIX:
         res = c_mmap_safe(addr, map_size, prot, flags, -1, 0)
         return res == addr
 
+    def alloc_pages(map_size):
+        """Allocate zero-filled, non-executable pages.  This is intended
+        to be used by the GC.  Returns NULL if out of memory."""
+        flags = MAP_PRIVATE | MAP_ANONYMOUS
+        prot = PROT_READ | PROT_WRITE
+        if we_are_translated():
+            flags = NonConstant(flags)
+            prot = NonConstant(prot)
+        res = c_mmap_safe(lltype.nullptr(PTR.TO), map_size, prot, flags, -1, 0)
+        if res == rffi.cast(PTR, -1):
+            res = lltype.nullptr(PTR.TO)
+        return res
+
+    def free_pages(addr, map_size):
+        c_munmap_safe(rffi.cast(PTR, addr), map_size)
+
+    def release_pages(addr, map_size):
+        """Give the physical memory of these pages back to the OS.  They
+        stay mapped, and read as zeroes the next time they are used."""
+        if MADV_DONTNEED is not None:
+            res = c_madvise_safe(rffi.cast(PTR, addr), map_size, MADV_DONTNEED)
+            if res == 0:
+                return
+        clear_large_memory_chunk_aligned(addr, map_size)
+
     # XXX is this really necessary?
     class Hint:
         pos = -0x4fff0000   # for reproducible results
@@ -3,7 +3,8 @@ from rpython.rlib.debug import check_nonneg
 from rpython.rlib.unroll import unrolling_iterable
 from rpython.rlib.rsre import rsre_char
 from rpython.tool.sourcetools import func_with_new_name
-from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.objectmodel import we_are_translated, r_dict
+from rpython.rlib.objectmodel import compute_identity_hash
 from rpython.rlib import jit
 from rpython.rlib.rsre.rsre_jit import install_jitdriver, install_jitdriver_spec
 
@@ -82,6 +83,15 @@ class Error(Exception):
     def __init__(self, msg):
         self.msg = msg
 
+class BacktrackingLimit(Exception):
+    """Raised when the backtracking matcher used up its budget on a
+    pattern that rsre_nfa can match instead."""
+
+# The backtracking matcher may backtrack this many times, plus this many
+# per character of the string, before switching to rsre_nfa.
+BACKTRACK_BUDGET = 10000
+BACKTRACK_BUDGET_PER_CHAR = 32
+
 class AbstractMatchContext(object):
     """Abstract base class"""
     _immutable_fields_ = ['pattern[*]', 'flags', 'end']
@@ -89,6 +99,8 @@ class AbstractMatchContext(object):
     match_end = 0
     match_marks = None
     match_marks_flat = None
+    pattern_cache = None
+    backtracks_left = sys.maxint
 
     def __init__(self, pattern, match_start, end, flags):
         # 'match_start' and 'end' must be known to be non-negative
@@ -192,8 +204,10 @@ class BufMatchContext(AbstractMatchContext):
         return rsre_char.getlower(c, self.flags)
 
     def fresh_copy(self, start):
-        return BufMatchContext(self.pattern, self._buffer, start,
-                               self.end, self.flags)
+        ctx = BufMatchContext(self.pattern, self._buffer, start,
+                              self.end, self.flags)
+        ctx.pattern_cache = self.pattern_cache
+        return ctx
 
 class StrMatchContext(AbstractMatchContext):
     """Concrete subclass for matching in a plain string."""
@@ -215,8 +229,10 @@ class StrMatchContext(AbstractMatchContext):
         return rsre_char.getlower(c, self.flags)
 
     def fresh_copy(self, start):
-        return StrMatchContext(self.pattern, self._string, start,
-                               self.end, self.flags)
+        ctx = StrMatchContext(self.pattern, self._string, start,
+                              self.end, self.flags)
+        ctx.pattern_cache = self.pattern_cache
+        return ctx
 
 class UnicodeMatchContext(AbstractMatchContext):
     """Concrete subclass for matching in a unicode string."""
@@ -236,8 +252,52 @@ class UnicodeMatchContext(AbstractMatchContext):
         return rsre_char.getlower(c, self.flags)
 
     def fresh_copy(self, start):
-        return UnicodeMatchContext(self.pattern, self._unicodestr, start,
-                                   self.end, self.flags)
+        ctx = UnicodeMatchContext(self.pattern, self._unicodestr, start,
+                                  self.end, self.flags)
+        ctx.pattern_cache = self.pattern_cache
+        return ctx
+
+# ____________________________________________________________
+
+class PatternCache(object):
+    """What is computed from a pattern before matching with it.  Code
+    that uses the same pattern many times, like rsre_re.RSREPattern,
+    keeps one PatternCache next to the pattern and passes it to match()
+    and search(), so that this is done only once.  Without one, the
+    PatternCache comes from a small global table keyed by the identity
+    of the pattern, see get_pattern_cache()."""
+
+    def __init__(self):
+        self.search_info = None
+        self.program = None            # see rsre_nfa.get_program()
+        self.program_compiled = False
+
+# the global table is emptied when it reaches this size
+MAX_CACHED_PATTERNS = 100
+
+def _pattern_eq(pattern1, pattern2):
+    return pattern1 is pattern2
+
+def _pattern_hash(pattern):
+    return compute_identity_hash(pattern)
+
+_pattern_caches = r_dict(_pattern_eq, _pattern_hash)
+
+@jit.elidable
+def lookup_pattern_cache(pattern):
+    cache = _pattern_caches.get(pattern, None)
+    if cache is None:
+        if len(_pattern_caches) >= MAX_CACHED_PATTERNS:
+            _pattern_caches.clear()
+        cache = PatternCache()
+        _pattern_caches[pattern] = cache
+    return cache
+
+def get_pattern_cache(ctx):
+    cache = ctx.pattern_cache
+    if cache is None:
+        cache = lookup_pattern_cache(ctx.pattern)
+    return cache
 
 # ____________________________________________________________
 
@@ -419,6 +479,7 @@ class MaxUntilMatchResult(AbstractUntilMatchResult):
                 self.num_pending -= 1
                 ptr = p.ptr
                 marks = p.marks
+                count_backtrack(ctx)
                 enum = p.enum.move_to_next_result(ctx)
             #
             min = ctx.pat(ppos+1)
@@ -496,6 +557,7 @@ class MinUntilMatchResult(AbstractUntilMatchResult):
                 self.num_pending -= 1
                 ptr = p.ptr
                 marks = p.marks
+                count_backtrack(ctx)
                 enum = p.enum.move_to_next_result(ctx)
 
             # matched one more 'item'.  record it and continue
@@ -504,6 +566,24 @@ class MinUntilMatchResult(AbstractUntilMatchResult):
             ptr = ctx.match_end
             marks = ctx.match_marks
 
+def count_backtrack(ctx):
+    ctx.backtracks_left -= 1
+    if ctx.backtracks_left < 0:
+        backtracking_limit_reached(ctx)
+
+@jit.dont_look_inside
+def backtracking_limit_reached(ctx):
+    # the budget is exceeded: patterns with a REPEAT whose body can match
+    # in several ways go on with rsre_nfa, whose time is linear.  The
+    # other patterns don't have a faster way and go on backtracking.
+    if rsre_nfa.get_program(ctx) is not None:
+        raise BacktrackingLimit
+    ctx.backtracks_left = sys.maxint
+
+def set_backtracking_budget(ctx):
+    ctx.backtracks_left = (BACKTRACK_BUDGET + BACKTRACK_BUDGET_PER_CHAR *
+                                              (ctx.end - ctx.match_start))
+
 # ____________________________________________________________
 
 @specializectx
@@ -999,17 +1079,19 @@ def _adjust(start, end, length):
     elif end > length: end = length
     return start, end
 
-def match(pattern, string, start=0, end=sys.maxint, flags=0):
+def match(pattern, string, start=0, end=sys.maxint, flags=0, cache=None):
     start, end = _adjust(start, end, len(string))
     ctx = StrMatchContext(pattern, string, start, end, flags)
+    ctx.pattern_cache = cache
     if match_context(ctx):
         return ctx
     else:
         return None
 
-def search(pattern, string, start=0, end=sys.maxint, flags=0):
+def search(pattern, string, start=0, end=sys.maxint, flags=0, cache=None):
     start, end = _adjust(start, end, len(string))
     ctx = StrMatchContext(pattern, string, start, end, flags)
+    ctx.pattern_cache = cache
     if search_context(ctx):
         return ctx
     else:
@@ -1023,13 +1105,25 @@ def match_context(ctx):
     ctx.original_pos = ctx.match_start
     if ctx.end < ctx.match_start:
         return False
+    set_backtracking_budget(ctx)
     ctx.jitdriver_Match.jit_merge_point(ctx=ctx)
-    return sre_match(ctx, 0, ctx.match_start, None) is not None
+    try:
+        return sre_match(ctx, 0, ctx.match_start, None) is not None
+    except BacktrackingLimit:
+        return rsre_nfa.nfa_match(ctx, rsre_nfa.get_program(ctx), True)
 
 def search_context(ctx):
     ctx.original_pos = ctx.match_start
     if ctx.end < ctx.match_start:
         return False
+    set_backtracking_budget(ctx)
+    try:
+        return search_strategy(ctx)
+    except BacktrackingLimit:
+        ctx.match_start = ctx.original_pos
+        return rsre_nfa.nfa_match(ctx, rsre_nfa.get_program(ctx), False)
+
+def search_strategy(ctx):
     base = 0
     charset = False
     if ctx.pat(base) == OPCODE_INFO:
@@ -1040,12 +1134,247 @@ def search_context(ctx):
         else:
             charset = (flags & rsre_char.SRE_INFO_CHARSET)
         base += 1 + ctx.pat(1)
+    info = get_search_info(ctx, base)
+    if info.literal is not None:
+        return required_literal_search(ctx, base, info)
     if ctx.pat(base) == OPCODE_LITERAL:
         return literal_search(ctx, base)
     if charset:
         return charset_search(ctx, base)
+    first_ppos = info.first_ppos
+    if first_ppos >= 0:
+        return first_char_search(ctx, base, first_ppos)
     return regular_search(ctx, base)
 
+# ____________________________________________________________
+# Search pre-analysis
+
+class SearchInfo(object):
+    """What can be known about the top-level sequence of a pattern
+    before searching with it.  'literal' is the longest run of
+    consecutive LITERAL opcodes that every match must contain (or None
+    if shorter than 2 characters); it starts 'offset' characters after
+    the start of the match, or at least 'min_offset' characters after
+    it if 'offset' is -1.  'first_ppos' is the position of a
+    single-character opcode that must match the first character of any
+    match, or -1.
+    """
+    _immutable_fields_ = ['literal[*]', 'skip[*]', 'offset', 'min_offset',
+                          'first_ppos']
+
+    def __init__(self, literal, offset, min_offset, first_ppos):
+        self.literal = literal
+        self.offset = offset
+        self.min_offset = min_offset
+        self.first_ppos = first_ppos
+        self.skip = None
+        if literal is not None:
+            self.skip = make_horspool_table(literal)
+
+def make_horspool_table(literal):
+    # Bad-character shifts for the Boyer-Moore-Horspool search.  The
+    # table is indexed by the low 8 bits of the character, so that it
+    # also works for unicode strings: characters sharing a slot get the
+    # smallest of their shifts, which is always safe.
+    m = len(literal)
+    skip = [m] * 256
+    for i in range(m - 1):
+        skip[literal[i] & 0xff] = m - 1 - i
+    return skip
+
+def _is_char_checker(op):
+    for op1, checkerfn in unroll_char_checker:
+        if op1 == op:
+            return True
+    return False
+
+@jit.elidable
+def analyze_search(pattern, base):
+    ppos = base
+    offset = 0          # fixed width consumed so far, or -1 if variable
+    min_offset = 0      # minimum width consumed so far
+    run = []
+    run_offset = 0
+    run_min_offset = 0
+    best = []
+    best_offset = 0
+    best_min_offset = 0
+    first_ppos = -1
+    at_start = True
+    while True:
+        op = pattern[ppos]
+        if op == OPCODE_LITERAL:
+            if not run:
+                run_offset = offset
+                run_min_offset = min_offset
+            run.append(pattern[ppos + 1])
+            if len(run) > len(best):
+                best = run[:]
+                best_offset = run_offset
+                best_min_offset = run_min_offset
+            if at_start:
+                first_ppos = ppos
+            minwidth = maxwidth = 1
+            nextppos = ppos + 2
+        elif op == OPCODE_MARK or op == OPCODE_AT:
+            # zero-width: doesn't break a run of literals
+            minwidth = maxwidth = 0
+            nextppos = ppos + 2
+        elif op == OPCODE_ASSERT or op == OPCODE_ASSERT_NOT:
+            minwidth = maxwidth = 0
+            nextppos = ppos + 1 + pattern[ppos + 1]
+        elif (op == OPCODE_ANY or op == OPCODE_ANY_ALL or
+              op == OPCODE_IN or op == OPCODE_IN_IGNORE or
+              op == OPCODE_LITERAL_IGNORE or op == OPCODE_NOT_LITERAL or
+              op == OPCODE_NOT_LITERAL_IGNORE or op == OPCODE_CATEGORY):
+            run = []
+            if at_start and _is_char_checker(op):
+                first_ppos = ppos
+            minwidth = maxwidth = 1
+            if op == OPCODE_IN or op == OPCODE_IN_IGNORE:
+                nextppos = ppos + 1 + pattern[ppos + 1]
+            elif op == OPCODE_ANY or op == OPCODE_ANY_ALL:
+                nextppos = ppos + 1
+            else:
+                nextppos = ppos + 2
+        elif op == OPCODE_REPEAT_ONE or op == OPCODE_MIN_REPEAT_ONE:
+            # <REPEAT_ONE> <skip> <1=min> <2=max> item <SUCCESS> tail
+            run = []
+            minwidth = pattern[ppos + 2]
+            maxwidth = pattern[ppos + 3]
+            if at_start and minwidth > 0 and _is_char_checker(pattern[ppos + 4]):
+                first_ppos = ppos + 4
+            nextppos = ppos + 1 + pattern[ppos + 1]
+        elif op == OPCODE_REPEAT:
+            # <REPEAT> <skip> <1=min> <2=max> item <UNTIL> tail
+            run = []
+            minwidth = 0
+            maxwidth = -1
+            nextppos = ppos + 1 + pattern[ppos + 1] + 1
+        elif op == OPCODE_BRANCH:
+            # <BRANCH> <0=skip> code <JUMP> ... <NULL>
+            run = []
+            minwidth = 0
+            maxwidth = -1
+            nextppos = ppos + 1
+            while pattern[nextppos]:
+                nextppos += pattern[nextppos]
+            nextppos += 1
+        elif op == OPCODE_GROUPREF or op == OPCODE_GROUPREF_IGNORE:
+            run = []
+            minwidth = 0
+            maxwidth = -1
+            nextppos = ppos + 2
+        else:
+            # SUCCESS, or something we don't analyze further
+            break
+        if minwidth != maxwidth:
+            offset = -1
+        elif offset >= 0:
+            offset += minwidth
+        min_offset += minwidth
+        if maxwidth != 0:
+            at_start = False
+        ppos = nextppos
+    if len(best) < 2:
+        return SearchInfo(None, 0, 0, first_ppos)
+    return SearchInfo(best, best_offset, best_min_offset, first_ppos)
+
+def get_search_info(ctx, base):
+    cache = ctx.pattern_cache
+    if cache is None:
+        return lookup_search_info(ctx.pattern, base)
+    if cache.search_info is None:
+        cache.search_info = analyze_search(ctx.pattern, base)
+    return cache.search_info
+
+@jit.elidable
+def lookup_search_info(pattern, base):
+    # the SearchInfo from the global table: with a green 'pattern', the
+    # JIT turns this call into a constant
+    cache = lookup_pattern_cache(pattern)
+    if cache.search_info is None:
+        cache.search_info = analyze_search(pattern, base)
+    return cache.search_info
+
+@specializectx
+def find_literal(ctx, info, pos, end):
+    # Boyer-Moore-Horspool search for 'info.literal' in [pos, end).
+    # Returns the start position of the first occurrence, or -1.
+    literal = info.literal
+    skip = info.skip
+    m = len(literal)
+    last = literal[m - 1]
+    pos += m - 1
+    while pos < end:
+        assert pos >= 0
+        c = ctx.str(pos)
+        if c == last:
+            i = m - 2
+            j = pos - 1
+            while i >= 0:
+                assert j >= 0
+                if ctx.str(j) != literal[i]:
+                    break
+                i -= 1
+                j -= 1
+            else:
+                return j + 1
+        pos += skip[c & 0xff]
+    return -1
+
+install_jitdriver_spec("RequiredLiteralSearch",
+                       greens=['base', 'ctx.pattern'],
+                       reds=['start', 'found', 'ctx'],
+                       debugprint=(1, 0))
+@specializectx
+def required_literal_search(ctx, base, info):
+    # every match contains 'info.literal': look for it first, and only
+    # try to match at the positions that can reach an occurrence
+    start = ctx.match_start
+    found = find_literal(ctx, info, start + info.min_offset, ctx.end)
+    while found >= 0:
+        ctx.jitdriver_RequiredLiteralSearch.jit_merge_point(ctx=ctx,
+                start=start, found=found, base=base)
+        # 'info' is not a green: without a PatternCache, every search
+        # would have its own 'info' and so its own loop
+        info = get_search_info(ctx, base)
+        if info.offset >= 0:
+            # the literal is at a fixed offset: one candidate per occurrence
+            start = found - info.offset
+            assert start >= 0
+            if sre_match(ctx, base, start, None) is not None:
+                ctx.match_start = start
+                return True
+            found = find_literal(ctx, info, found + 1, ctx.end)
+        else:
+            if sre_match(ctx, base, start, None) is not None:
+                ctx.match_start = start
+                return True
+            start += 1
+            if start + info.min_offset > found:
+                found = find_literal(ctx, info, start + info.min_offset,
+                                     ctx.end)
+    return False
+
+install_jitdriver_spec("FirstCharSearch",
+                       greens=['base', 'ppos', 'ctx.pattern'],
+                       reds=['start', 'ctx'],
+                       debugprint=(2, 0, 1))
+@specializectx
+def first_char_search(ctx, base, ppos):
+    # every match starts with a character matched by the opcode at 'ppos'
+    start = ctx.match_start
+    while start < ctx.end:
+        ctx.jitdriver_FirstCharSearch.jit_merge_point(ctx=ctx, start=start,
+                                                      base=base, ppos=ppos)
+        if find_repetition_end(ctx, ppos, start, 1) > start:
+            if sre_match(ctx, base, start, None) is not None:
+                ctx.match_start = start
+                return True
+        start += 1
+    return False
+
 install_jitdriver('RegularSearch',
                   greens=['base', 'ctx.pattern'],
                   reds=['start', 'ctx'],
@@ -1151,3 +1480,6 @@ def fast_search(ctx):
         string_position += 1
         if string_position >= ctx.end:
             return False
+
+# imported last: the NFA matcher is built on top of this module
+from rpython.rlib.rsre import rsre_nfa
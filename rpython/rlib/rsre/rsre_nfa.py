@@ -0,0 +1,373 @@
+"""
+A backtracking-free matcher used by rsre_core for the patterns on which
+the backtracking matcher can take exponential time.
+
+These are the patterns with a general REPEAT whose body can match the
+same text in more than one way, like '(a|aa)*' or '(a+)+'.  If they use
+no backreferences and no lookaround, and if the body of every REPEAT
+consumes at least one character, they are compiled to a Thompson NFA.
+The NFA is simulated with one thread per NFA state, keeping the threads
+in the order in which the backtracking matcher would try them (a "Pike
+VM").  This finds the same match and the same groups, in a time that
+is linear in the length of the string.  The other patterns don't go
+through this module.
+
+The backtracking matcher always starts.  It counts how many times it
+backtracks, and only if that goes over a budget proportional to the
+length of the string does rsre_core continue with this module, see
+backtracking_limit_reached().  The Program is compiled at that point and
+kept on the PatternCache of the pattern.
+"""
+
+from rpython.rlib import jit
+from rpython.rlib.rsre import rsre_char
+from rpython.rlib.rsre.rsre_core import (
+    Mark, get_pattern_cache, specializectx, sre_at, unroll_char_checker,
+    OPCODE_ANY, OPCODE_ANY_ALL, OPCODE_AT, OPCODE_BRANCH, OPCODE_IN,
+    OPCODE_INFO, OPCODE_IN_IGNORE, OPCODE_JUMP, OPCODE_LITERAL,
+    OPCODE_LITERAL_IGNORE, OPCODE_MARK, OPCODE_MAX_UNTIL,
+    OPCODE_MIN_REPEAT_ONE, OPCODE_MIN_UNTIL, OPCODE_NOT_LITERAL,
+    OPCODE_NOT_LITERAL_IGNORE, OPCODE_REPEAT, OPCODE_REPEAT_ONE,
+    OPCODE_SUCCESS)
+
+
+# NFA instructions
+I_CHAR  = 0     # <ppos of a single-character opcode in the pattern>
+I_SPLIT = 1     # <preferred target> <other target>
+I_JMP   = 2     # <target>
+I_AT    = 3     # <atcode>
+I_MARK  = 4     # <gid>
+I_MATCH = 5
+
+# give up on patterns that would compile to bigger programs than that
+MAX_PROGRAM_SIZE = 10000
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Program(object):
+    """A compiled NFA."""
+    _immutable_fields_ = ['ops[*]', 'arg1[*]', 'arg2[*]']
+
+    def __init__(self, ops, arg1, arg2):
+        self.ops = ops
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+
+class ProgramBuilder(object):
+
+    def __init__(self, code):
+        self.code = code
+        self.ops = []
+        self.arg1 = []
+        self.arg2 = []
+        self.ambiguous_repeat = False
+
+    def emit(self, op, arg1=0, arg2=0):
+        if len(self.ops) >= MAX_PROGRAM_SIZE:
+            raise Unsupported
+        self.ops.append(op)
+        self.arg1.append(arg1)
+        self.arg2.append(arg2)
+        return len(self.ops) - 1
+
+    def here(self):
+        return len(self.ops)
+
+    def set_split(self, split, body, skip, lazy):
+        # the backtracking matcher tries the body first, unless lazy
+        if lazy:
+            self.arg1[split] = skip
+            self.arg2[split] = body
+        else:
+            self.arg1[split] = body
+            self.arg2[split] = skip
+
+    def build(self, ppos):
+        self.compile_sequence(ppos)
+        self.emit(I_MATCH)
+        return Program(self.ops[:], self.arg1[:], self.arg2[:])
+
+    def compile_sequence(self, ppos):
+        # compile the opcodes up to the SUCCESS, JUMP or *_UNTIL that ends
+        # the current sequence
+        code = self.code
+        while True:
+            op = code[ppos]
+            if (op == OPCODE_SUCCESS or
+                    op == OPCODE_JUMP or
+                    op == OPCODE_MAX_UNTIL or
+                    op == OPCODE_MIN_UNTIL):
+                return
+            elif (op == OPCODE_ANY or
+                  op == OPCODE_ANY_ALL):
+                self.emit(I_CHAR, ppos)
+                ppos += 1
+            elif (op == OPCODE_IN or
+                  op == OPCODE_IN_IGNORE):
+                self.emit(I_CHAR, ppos)
+                ppos += 1 + code[ppos + 1]
+            elif (op == OPCODE_LITERAL or
+                  op == OPCODE_LITERAL_IGNORE or
+                  op == OPCODE_NOT_LITERAL or
+                  op == OPCODE_NOT_LITERAL_IGNORE):
+                self.emit(I_CHAR, ppos)
+                ppos += 2
+            elif op == OPCODE_MARK:
+                self.emit(I_MARK, code[ppos + 1])
+                ppos += 2
+            elif op == OPCODE_INFO:
+                ppos += 1 + code[ppos + 1]
+            elif op == OPCODE_AT:
+                self.emit(I_AT, code[ppos + 1])
+                ppos += 2
+            elif op == OPCODE_BRANCH:
+                ppos = self.compile_branch(ppos)
+            elif (op == OPCODE_REPEAT_ONE or
+                  op == OPCODE_MIN_REPEAT_ONE):
+                # <REPEAT_ONE> <skip> <1=min> <2=max> item <SUCCESS> tail
+                self.compile_repeat(ppos + 4, code[ppos + 2], code[ppos + 3],
+                                    True, op == OPCODE_MIN_REPEAT_ONE)
+                ppos += 1 + code[ppos + 1]
+            elif op == OPCODE_REPEAT:
+                # <REPEAT> <skip> <1=min> <2=max> item <UNTIL> tail
+                until = ppos + 1 + code[ppos + 1]
+                self.compile_repeat(ppos + 4, code[ppos + 2], code[ppos + 3],
+                                    False, code[until] == OPCODE_MIN_UNTIL)
+                ppos = until + 1
+            else:
+                # backreferences, lookaround, GROUPREF_EXISTS...
+                raise Unsupported
+
+    def compile_branch(self, ppos):
+        # <BRANCH> <0=skip> code <JUMP> ... <NULL>
+        code = self.code
+        jumps = []
+        split = -1
+        ppos += 1
+        while code[ppos]:
+            if split >= 0:
+                self.arg2[split] = self.here()
+            if code[ppos + code[ppos]]:
+                split = self.emit(I_SPLIT, self.here() + 1)
+            else:
+                split = -1        # last alternative
+            self.compile_sequence(ppos + 1)
+            jumps.append(self.emit(I_JMP))
+            ppos += code[ppos]
+        if split >= 0:
+            self.arg2[split] = self.here()
+        for jump in jumps:
+            self.arg1[jump] = self.here()
+        return ppos + 1
+
+    def compile_item(self, ppos, single):
+        if single:
+            # the item of a REPEAT_ONE is a single-character opcode
+            op = self.code[ppos]
+            for op1, checkerfn in unroll_char_checker:
+                if op1 == op:
+                    break
+            else:
+                raise Unsupported
+            self.emit(I_CHAR, ppos)
+            return
+        start = self.here()
+        self.compile_sequence(ppos)
+        stop = self.here()
+        if self.can_skip(start, stop):
+            # the backtracking matcher stops repeating after an
+            # iteration that matched the empty string, which the
+            # threads here cannot express
+            raise Unsupported
+        for pc in range(start, stop):
+            if self.ops[pc] == I_SPLIT:
+                # the body can match the same text in several ways, so
+                # the backtracking matcher can take exponential time
+                self.ambiguous_repeat = True
+
+    def can_skip(self, start, stop):
+        # can we go from 'start' to 'stop' without consuming a character?
+        seen = {}
+        pending = [start]
+        while pending:
+            pc = pending.pop()
+            if pc == stop:
+                return True
+            if pc in seen:
+                continue
+            seen[pc] = None
+            op = self.ops[pc]
+            if op == I_SPLIT:
+                pending.append(self.arg1[pc])
+                pending.append(self.arg2[pc])
+            elif op == I_JMP:
+                pending.append(self.arg1[pc])
+            elif op == I_AT or op == I_MARK:
+                pending.append(pc + 1)
+        return False
+
+    def compile_repeat(self, ppos, min, max, single, lazy):
+        if min > MAX_PROGRAM_SIZE:
+            raise Unsupported
+        for i in range(min):
+            self.compile_item(ppos, single)
+        if max == rsre_char.MAXREPEAT:
+            loop = self.emit(I_SPLIT)
+            self.compile_item(ppos, single)
+            self.emit(I_JMP, loop)
+            self.set_split(loop, loop + 1, self.here(), lazy)
+        else:
+            if max - min > MAX_PROGRAM_SIZE:
+                raise Unsupported
+            splits = []
+            for i in range(max - min):
+                splits.append(self.emit(I_SPLIT))
+                self.compile_item(ppos, single)
+            for split in splits:
+                self.set_split(split, split + 1, self.here(), lazy)
+
+
+@jit.elidable
+def compile_program(code):
+    """Compile the pattern 'code' to a Program, or return None if it
+    cannot be done or if the backtracking matcher doesn't need the
+    protection (no REPEAT with an ambiguous body)."""
+    base = 0
+    if code[0] == OPCODE_INFO:
+        base = 1 + code[1]
+    builder = ProgramBuilder(code)
+    try:
+        prog = builder.build(base)
+    except Unsupported:
+        return None
+    if not builder.ambiguous_repeat:
+        return None
+    return prog
+
+def get_program(ctx):
+    """Return the Program to use for ctx.pattern, or None.  It is kept
+    on the PatternCache of the pattern."""
+    cache = get_pattern_cache(ctx)
+    if not cache.program_compiled:
+        cache.program = compile_program(ctx.pattern)
+        cache.program_compiled = True
+    return cache.program
+
+# ____________________________________________________________
+
+@specializectx
+def check_char(ctx, ppos, ptr):
+    assert ppos >= 0
+    op = ctx.pat(ppos)
+    for op1, checkerfn in unroll_char_checker:
+        if op1 == op:
+            return checkerfn(ctx, ptr, ppos)
+    return False
+
+class Threads(object):
+    """The threads at one position, in order of priority: the pc of an
+    I_CHAR or I_MATCH instruction, the position where the thread
+    started, and its marks."""
+
+    def __init__(self):
+        self.pcs = []
+        self.starts = []
+        self.marks = []
+
+    def add(self, pc, start, marks):
+        self.pcs.append(pc)
+        self.starts.append(start)
+        self.marks.append(marks)
+
+    def cut(self, i):
+        del self.pcs[i:]
+        del self.starts[i:]
+        del self.marks[i:]
+
+@specializectx
+def add_thread(ctx, prog, threads, seen, stamp, pc, start, marks, ptr):
+    # Add the threads of the epsilon-closure of 'pc' at position 'ptr'.
+    # The closure is walked depth-first, preferred targets first, which
+    # is the order in which the backtracking matcher tries them.  A pc
+    # already seen with this 'stamp' is skipped: a thread with a higher
+    # priority got there first, so this one cannot be the match found.
+    pcs = [pc]
+    markss = [marks]
+    while pcs:
+        pc = pcs.pop()
+        marks = markss.pop()
+        if seen[pc] == stamp:
+            continue
+        seen[pc] = stamp
+        op = prog.ops[pc]
+        if op == I_SPLIT:
+            pcs.append(prog.arg2[pc])
+            markss.append(marks)
+            pcs.append(prog.arg1[pc])
+            markss.append(marks)
+        elif op == I_JMP:
+            pcs.append(prog.arg1[pc])
+            markss.append(marks)
+        elif op == I_AT:
+            if sre_at(ctx, prog.arg1[pc], ptr):
+                pcs.append(pc + 1)
+                markss.append(marks)
+        elif op == I_MARK:
+            pcs.append(pc + 1)
+            markss.append(Mark(prog.arg1[pc], ptr, marks))
+        else:
+            threads.add(pc, start, marks)
+
+@specializectx
+@jit.dont_look_inside
+def nfa_match(ctx, prog, anchored):
+    """Find the match that the backtracking matcher would find: at
+    ctx.match_start if 'anchored', or else at the leftmost position from
+    there.  On success, set the span and the marks of 'ctx' and return
+    True.  Linear in the length of the string."""
+    seen = [-1] * len(prog.ops)
+    stamp = 0
+    threads = Threads()
+    newthreads = Threads()
+    found = False
+    match_start = match_end = 0
+    match_marks = None
+    ptr = ctx.match_start
+    end = ctx.end
+    while True:
+        if not found and (not anchored or ptr == ctx.match_start):
+            # a new thread starting here, with the lowest priority
+            add_thread(ctx, prog, threads, seen, stamp, 0, ptr, None, ptr)
+        for i in range(len(threads.pcs)):
+            if prog.ops[threads.pcs[i]] == I_MATCH:
+                # the threads after this one have a lower priority: the
+                # backtracking matcher would not try them
+                found = True
+                match_start = threads.starts[i]
+                match_end = ptr
+                match_marks = threads.marks[i]
+                threads.cut(i)
+                break
+        if ptr >= end:
+            break
+        if not threads.pcs and (found or anchored):
+            break
+        stamp += 1
+        newthreads.cut(0)
+        for i in range(len(threads.pcs)):
+            pc = threads.pcs[i]
+            if check_char(ctx, prog.arg1[pc], ptr):
+                add_thread(ctx, prog, newthreads, seen, stamp, pc + 1,
+                           threads.starts[i], threads.marks[i], ptr + 1)
+        threads, newthreads = newthreads, threads
+        ptr += 1
+    if not found:
+        return False
+    ctx.match_start = match_start
+    ctx.match_end = match_end
+    ctx.match_marks = match_marks
+    return True
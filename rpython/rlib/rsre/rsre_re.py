@@ -59,6 +59,7 @@ error = re.error
 
 
 class RSREPattern(object):
+    _cache = None
 
     def __init__(self, pattern, code, flags,
                  num_groups, groupindex, indexgroup):
@@ -69,15 +70,22 @@ class RSREPattern(object):
         self.groupindex = groupindex
         self._indexgroup = indexgroup
 
+    def _get_cache(self):
+        if self._cache is None:
+            self._cache = rsre_core.PatternCache()
+        return self._cache
+
     def match(self, string, pos=0, endpos=sys.maxint):
         return self._make_match(rsre_core.match(self._code, string,
                                                 pos, endpos,
-                                                flags=self.flags))
+                                                flags=self.flags,
+                                                cache=self._get_cache()))
 
     def search(self, string, pos=0, endpos=sys.maxint):
         return self._make_match(rsre_core.search(self._code, string,
                                                  pos, endpos,
-                                                 flags=self.flags))
+                                                 flags=self.flags,
+                                                 cache=self._get_cache()))
 
     def findall(self, string, pos=0, endpos=sys.maxint):
         matchlist = []
@@ -116,7 +124,7 @@ class RSREPattern(object):
         n = last_pos = 0
         while not count or n < count:
             match = rsre_core.search(self._code, string, start,
-                                     flags=self.flags)
+                                     flags=self.flags, cache=self._get_cache())
             if match is None:
                 break
             if last_pos < match.match_start:
@@ -163,7 +171,7 @@ class RSREPattern(object):
         last = 0
         while not maxsplit or n < maxsplit:
             match = rsre_core.search(self._code, string, start,
-                                     flags=self.flags)
+                                     flags=self.flags, cache=self._get_cache())
             if match is None:
                 break
             if match.match_start == match.match_end: # zero-width match
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+A benchmark for the switch from the backtracking matcher to rsre_nfa.
+For every case it times rsre_core.search(), which backtracks until its
+budget is used up and then goes on with rsre_nfa; the backtracking
+matcher alone; and rsre_nfa alone.  The backtracking matcher alone is
+not run on the cases where it takes exponential time, and rsre_nfa is
+not run on the patterns that it doesn't support.
+
+usage: targetrsrenfa-c [length] [iterations]
+"""
+import time
+from rpython.rlib.rsre import rsre_core, rsre_nfa
+from rpython.rlib.rsre.rpy import get_code
+
+
+class Case(object):
+    def __init__(self, regexp, unit, suffix, exponential):
+        self.regexp = regexp
+        self.r_code = get_code(regexp)
+        self.unit = unit
+        self.suffix = suffix
+        self.exponential = exponential
+
+    def make_string(self, length):
+        return self.unit * (length // len(self.unit)) + self.suffix
+
+cases = [
+    # patterns for which the backtracking matcher is fine
+    Case(r'(a|b)*c', 'ab', 'c', False),
+    Case(r'<(\w+)>', 'x', '<tag>', False),
+    Case(r'(?:ab|a)*c', 'ab', 'c', False),
+    Case(r'(a|aa)*b', 'a', 'b', False),
+    Case(r'^(\w+\s?)*$', 'word ', '', False),
+    # and the ones for which it takes exponential time
+    Case(r'(a|aa)*b', 'a', '', True),
+    Case(r'^(\w+\s?)*$', 'word ', '!', True),
+    Case(r'(x+x+)+y', 'x', '', True),
+]
+
+def search(r_code, s):
+    return rsre_core.search(r_code, s) is not None
+
+def backtracking_search(r_code, s):
+    # the ctx keeps the default budget, sys.maxint
+    ctx = rsre_core.StrMatchContext(r_code, s, 0, len(s), 0)
+    ctx.original_pos = 0
+    return rsre_core.search_strategy(ctx)
+
+def nfa_search(r_code, s):
+    ctx = rsre_core.StrMatchContext(r_code, s, 0, len(s), 0)
+    return rsre_nfa.nfa_match(ctx, rsre_nfa.compile_program(r_code), False)
+
+def measure(func, r_code, s, iterations):
+    start = time.time()
+    for i in range(iterations):
+        func(r_code, s)
+    return (time.time() - start) / iterations
+
+# __________  Entry point  __________
+
+def entry_point(argv):
+    length = 1000
+    iterations = 10
+    if len(argv) > 1:
+        length = int(argv[1])
+    if len(argv) > 2:
+        iterations = int(argv[2])
+    print "seconds per search of %d characters:" % (length,)
+    for case in cases:
+        s = case.make_string(length)
+        t_search = measure(search, case.r_code, s, iterations)
+        if case.exponential:
+            t_backtracking = "-"
+        else:
+            t_backtracking = "%f" % measure(backtracking_search,
+                                            case.r_code, s, iterations)
+        if rsre_nfa.compile_program(case.r_code) is None:
+            t_nfa = "-"
+        else:
+            t_nfa = "%f" % measure(nfa_search, case.r_code, s, iterations)
+        if case.exponential:
+            kind = "exponential"
+        else:
+            kind = "linear"
+        print "%s (%s): search %f, backtracking %s, nfa %s" % (
+            case.regexp, kind, t_search, t_backtracking, t_nfa)
+    return 0
+
+# _____ Define and setup target ___
+
+def target(*args):
+    return entry_point, None
+
+if __name__ == '__main__':
+    import sys
+    entry_point(sys.argv)
@@ -0,0 +1,129 @@
+import re, random
+from rpython.rlib.rsre import rsre_core, rsre_nfa
+from rpython.rlib.rsre.test.test_match import get_code, get_code_and_re
+
+
+def count_nfa_calls(monkeypatch):
+    calls = []
+    orig_nfa_match = rsre_nfa.nfa_match
+    def nfa_match(ctx, prog, anchored):
+        calls.append(anchored)
+        return orig_nfa_match(ctx, prog, anchored)
+    monkeypatch.setattr(rsre_nfa, 'nfa_match', nfa_match)
+    return calls
+
+def nfa_search(r_code, s, anchored):
+    ctx = rsre_core.StrMatchContext(r_code, s, 0, len(s), 0)
+    if rsre_nfa.nfa_match(ctx, rsre_nfa.compile_program(r_code), anchored):
+        return ctx
+    return None
+
+
+def test_compile_program():
+    assert rsre_nfa.compile_program(get_code(r'(a|aa)*b')) is not None
+    assert rsre_nfa.compile_program(get_code(r'(a+)+b')) is not None
+    assert rsre_nfa.compile_program(get_code(r'(?:ab|a)+$')) is not None
+    # the body of the REPEAT can match in one way only: the backtracking
+    # matcher is linear enough
+    assert rsre_nfa.compile_program(get_code(r'a*b|c')) is None
+    assert rsre_nfa.compile_program(get_code(r'(ab)*c')) is None
+    # a REPEAT body that can match the empty string is not supported
+    assert rsre_nfa.compile_program(get_code(r'(a*)*b')) is None
+    assert rsre_nfa.compile_program(get_code(r'(a|)+b')) is None
+    # backreferences and lookaround are not supported
+    assert rsre_nfa.compile_program(get_code(r'(a|b)*\1')) is None
+    assert rsre_nfa.compile_program(get_code(r'(a|b)*(?=c)')) is None
+    assert rsre_nfa.compile_program(get_code(r'(?<=x)(a|b)*')) is None
+
+def test_catastrophic_backtracking(monkeypatch):
+    calls = count_nfa_calls(monkeypatch)
+    r_code = get_code(r'(a|aa)*b')
+    assert rsre_core.search(r_code, 'a' * 100) is None
+    assert rsre_core.match(r_code, 'a' * 100) is None
+    res = rsre_core.search(r_code, 'x' + 'a' * 100 + 'b')
+    assert res.span() == (1, 102)
+    r_code = get_code(r'^(\w+\s?)*$')
+    assert rsre_core.match(r_code, 'abc def ' * 20 + '!') is None
+    assert calls == [False, True, True]
+
+def test_catastrophic_backtracking_with_a_match(monkeypatch):
+    calls = count_nfa_calls(monkeypatch)
+    r_code = get_code(r'(a|aa)*c|a*')
+    res = rsre_core.match(r_code, 'a' * 200)
+    assert res.span() == (0, 200)
+    assert res.span(1) == (-1, -1)
+    res = rsre_core.search(r_code, 'b' + 'a' * 200)
+    assert res.span() == (0, 0)
+    res = rsre_core.search(r_code, 'a' * 200 + 'c')
+    assert res.span() == (0, 201)
+    assert res.span(1) == (199, 200)
+    assert calls == [True]     # the searches don't need to backtrack
+
+def test_backtracking_budget(monkeypatch):
+    calls = count_nfa_calls(monkeypatch)
+    r_code = get_code(r'(a|aa)*b')
+    # a short string doesn't use up the budget
+    assert rsre_core.search(r_code, 'a' * 10) is None
+    assert calls == []
+    assert rsre_core.search(r_code, 'a' * 30) is None
+    assert calls == [False]
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET', 0)
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET_PER_CHAR', 0)
+    assert rsre_core.match(r_code, 'aaaab').span() == (0, 5)
+    assert calls == [False]           # no backtracking at all
+    assert rsre_core.match(r_code, 'aaaa') is None
+    assert calls == [False, True]
+    # a pattern that rsre_nfa doesn't support goes on backtracking
+    r_code = get_code(r'(a|aa)*(?=b)')
+    assert rsre_core.match(r_code, 'aaaac') is None
+    assert calls == [False, True]
+
+def test_program_is_cached(monkeypatch):
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET', 0)
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET_PER_CHAR', 0)
+    r_code = get_code(r'(?:x|yz)*w')
+    cache = rsre_core.PatternCache()
+    assert rsre_core.search(r_code, 'xyzxyzw', cache=cache).span() == (0, 7)
+    assert rsre_core.search(r_code, 'xyzxyz', cache=cache) is None
+    prog = cache.program
+    assert prog is not None
+    assert rsre_core.match(r_code, 'xyzx', cache=cache) is None
+    assert cache.program is prog
+    # without a PatternCache, the one of the global table keeps it
+    assert rsre_core.match(r_code, 'xyzx') is None
+    prog = rsre_core.lookup_pattern_cache(r_code).program
+    assert prog is not None
+    assert rsre_core.match(r_code, 'xyzx') is None
+    assert rsre_core.lookup_pattern_cache(r_code).program is prog
+    # a pattern that doesn't need it is also only looked at once
+    cache = rsre_core.PatternCache()
+    assert rsre_core.search(get_code(r'(ab)*c'), 'ababx', cache=cache) is None
+    assert cache.program is None
+    assert cache.program_compiled
+    # and a pattern that doesn't backtrack never looks
+    cache = rsre_core.PatternCache()
+    assert rsre_core.search(r_code, 'xyzxyzw', cache=cache)
+    assert not cache.program_compiled
+
+def test_same_result_as_re():
+    patterns = [r'(a|ab)*c', r'(?:a|ba)*?b', r'x(?:ab|a){2,3}y', r'(a|aa)*c|a*',
+                r'^(?:a|ab)+$', r'\b(?:ab|a)+\b', r'(?:[ab]c|a)+', r'(a|ba)+?c',
+                r'(?:a|bc){0,2}c', r'(?i)(?:ab|c)+D', r'((a)|(b)|ab)+',
+                r'(?:(a)|b)*c', r'(a+|b)*?(d|b)', r'(x|a+)+$', r'(a|bx)*x|(c)']
+    chars = 'abcdxyABD '
+    rnd = random.Random(42)
+    for pattern in patterns:
+        r_code, r = get_code_and_re(pattern)
+        assert rsre_nfa.compile_program(r_code) is not None, pattern
+        for i in range(200):
+            s = ''.join([rnd.choice(chars) for j in range(rnd.randrange(12))])
+            for anchored, rfn in [(False, r.search), (True, r.match)]:
+                res = nfa_search(r_code, s, anchored)
+                expected = rfn(s)
+                if expected is None:
+                    assert res is None, (pattern, s)
+                else:
+                    assert res is not None, (pattern, s)
+                    assert res.span() == expected.span(), (pattern, s)
+                    for g in range(1, r.groups + 1):
+                        assert res.span(g) == expected.span(g), (pattern, s)
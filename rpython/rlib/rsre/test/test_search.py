@@ -3,6 +3,13 @@ from rpython.rlib.rsre import rsre_core
 from rpython.rlib.rsre.test.test_match import get_code, get_code_and_re
 
 
+def analyze(code):
+    base = 0
+    if code[0] == rsre_core.OPCODE_INFO:
+        base = 1 + code[1]
+    return rsre_core.analyze_search(code, base)
+
+
 class TestSearch:
 
     def test_code1(self):
@@ -209,3 +216,88 @@ class TestSearch:
                 else:
                     assert match is None
                     assert res is None
+
+    def test_required_literal_analysis(self):
+        info = analyze(get_code(r'\w+ERROR'))
+        assert info.first_ppos >= 0
+        info = analyze(get_code(r'.*ERROR.*'))
+        assert info.literal == map(ord, 'ERROR')
+        assert info.offset == -1
+        assert info.first_ppos == -1
+        info = analyze(get_code(r'\d\d-(?:ab)*xyz'))
+        assert info.literal == map(ord, 'xyz')
+        assert info.offset == -1
+        assert info.min_offset == 3
+        info = analyze(get_code(r'[ab]\d{2}-(x)yz'))
+        assert info.literal == map(ord, '-xyz')
+        assert info.offset == 3
+        info = analyze(get_code(r'a|bc'))
+        assert info.literal is None
+
+    def test_required_literal_search(self):
+        for pattern, subjects in [
+                (r'.*ERROR.*', ['', 'no error here', 'an ERROR line',
+                                'ERRORERROR', 'ERRO', 'x' * 100 + 'ERROR']),
+                (r'[ab]\d{2}-(x)yz', ['a12-xyz', 'zzb99-xyzb99-xy',
+                                      'b99-xy', 'xyzxyza00-xyz']),
+                (r'\d+-abab', ['12-aba 3-abab', '1-ababab', 'abab',
+                               '--abab 5-abab']),
+                (r'(?<=a)bcd', ['bcd', 'abcd', 'xbcdabcd']),
+                (r'x\bfoo|barbaz', ['barbaz', 'x foo']),
+                (r'\w+q', ['hello world', 'a b cq']),
+                ]:
+            r_code, r = get_code_and_re(pattern)
+            for s in subjects:
+                for start in range(len(s) + 1):
+                    expected = r.search(s, start)
+                    res = rsre_core.search(r_code, s, start)
+                    if expected is None:
+                        assert res is None
+                    else:
+                        assert res is not None
+                        assert res.span() == expected.span()
+                    res = rsre_core.search(r_code, s, 0, start)
+                    expected = r.search(s, 0, start)
+                    assert (res is None) == (expected is None)
+
+    def test_horspool_unicode(self):
+        # u'\u0141' and u'\u0241' share a slot in the skip table
+        r_code = get_code(u'.*\u0141\u0241\u0141.*')
+        s = u'\u0141A\u0141' * 4
+        ctx = rsre_core.UnicodeMatchContext(r_code, s, 0, len(s), 0)
+        assert not rsre_core.search_context(ctx)
+        s += u'\u0141\u0241\u0141'
+        ctx = rsre_core.UnicodeMatchContext(r_code, s, 0, len(s), 0)
+        assert rsre_core.search_context(ctx)
+        assert ctx.span() == (0, 15)
+
+    def test_pattern_cache(self, monkeypatch):
+        seen = []
+        def analyze_search(pattern, base):
+            seen.append(pattern)
+            return orig_analyze_search(pattern, base)
+        orig_analyze_search = rsre_core.analyze_search
+        monkeypatch.setattr(rsre_core, 'analyze_search', analyze_search)
+        r_code1 = get_code(r'\d+-abab')
+        r_code2 = get_code(r'x+yz')
+        cache1 = rsre_core.PatternCache()
+        cache2 = rsre_core.PatternCache()
+        for s in ['12-abab', 'xxyz', '1-abab xyz']:
+            res1 = rsre_core.search(r_code1, s, cache=cache1)
+            res2 = rsre_core.search(r_code2, s, cache=cache2)
+            assert res1 is not None or res2 is not None
+        res1 = rsre_core.search(r_code1, '1-abab 22-abab', cache=cache1)
+        assert res1.span() == (0, 6)
+        ctx = res1.fresh_copy(1)
+        assert ctx.pattern_cache is cache1
+        assert rsre_core.search_context(ctx)
+        assert ctx.span() == (7, 14)
+        assert seen == [r_code1, r_code2]
+        # without a PatternCache, the one from the global table is used
+        rsre_core.search(r_code1, '12-abab')
+        rsre_core.search(r_code1, '12-abab')
+        assert seen == [r_code1, r_code2, r_code1]
+        info = rsre_core.lookup_pattern_cache(r_code1).search_info
+        assert info is not None
+        rsre_core.search(r_code1, '12-abab')
+        assert rsre_core.lookup_pattern_cache(r_code1).search_info is info
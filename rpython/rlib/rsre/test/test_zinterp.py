@@ -55,3 +55,19 @@ def test_translates():
         for x in rsre_re.split("a{2}", s):      print x
         return 0
     interpret(f, [3])  # assert does not crash
+
+def test_nfa_matcher(monkeypatch):
+    # switch to rsre_nfa at the first backtrack
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET', 0)
+    monkeypatch.setattr(rsre_core, 'BACKTRACK_BUDGET_PER_CHAR', 0)
+    m = compile("(a|aa)*b")
+    def f(i):
+        s = "a" * i
+        if i > 5:
+            s += "b"
+        g = m.search(s)
+        if g is None:
+            return -1
+        return g.end() - g.start()
+    assert interpret(f, [3]) == -1
+    assert interpret(f, [7]) == 8
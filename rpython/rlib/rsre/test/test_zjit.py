@@ -98,6 +98,13 @@ class TestJitRSre(support.LLJitMixin):
         assert res == 15
         self.check_resops(guard_value=0)
 
+    def test_required_literal_search_repeated(self):
+        # all the searches use the same loops, even without a PatternCache
+        s = "ab cd efg " * 10 + "xyz@example.org"
+        res = self.meta_interp_search(r"[a-z]+@example", s, repeat=10)
+        assert res == 100
+        self.check_jitcell_token_count(5)
+
     def test_regular_search(self):
         res = self.meta_interp_search(r"<\w+>", "eiofweoxdiwhdoh<foobar>ua")
         assert res == 15
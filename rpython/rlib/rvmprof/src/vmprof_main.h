@@ -34,6 +34,7 @@
 #ifdef __APPLE__
 #include "libunwind.h"
 #else
+#include <ucontext.h>
 #include "vmprof_unwind.h"
 #endif
 #include "vmprof_mt.h"
@@ -140,6 +141,7 @@ void vmprof_ignore_signals(int ignored)
 #define MARKER_TRAILER '\x03'
 #define MARKER_INTERP_NAME '\x04'   /* deprecated */
 #define MARKER_HEADER '\x05'
+#define MARKER_ALLOCATION '\x06'
 
 #define VERSION_BASE '\x00'
 #define VERSION_THREAD_ID '\x01'
@@ -151,6 +153,15 @@ struct prof_stacktrace_s {
     void *stack[];
 };
 
+/* an allocation sample: same as a stack trace, but instead of the
+   count it gives the type index and size of the object allocated */
+struct prof_allocation_s {
+    char padding[sizeof(long) - 1];
+    char marker;
+    long typeindex, size, depth;
+    void *stack[];
+};
+
 static long profile_interval_usec = 0;
 static char atfork_hook_installed = 0;
 
@@ -315,6 +326,49 @@ static void sigprof_handler(int sig_nr, siginfo_t* info, void *ucontext)
 }
 
 
+/* *************************************************************
+ * allocation samples, reported by the GC via pypy_alloc_sample_hook
+ * *************************************************************
+ */
+
+#ifndef RPYTHON_LL2CTYPES
+static void vmprof_record_allocation(long typeindex, long size)
+{
+    long val = __sync_fetch_and_add(&signal_handler_value, 2L);
+
+    if ((val & 1) == 0) {
+        int fd = profile_file;
+        struct profbuf_s *p = reserve_buffer(fd);
+        if (p != NULL) {
+            int depth;
+            ucontext_t uc;
+            struct prof_allocation_s *st =
+                (struct prof_allocation_s *)p->data;
+            st->marker = MARKER_ALLOCATION;
+            st->typeindex = typeindex;
+            st->size = size;
+#ifndef __APPLE__
+            getcontext(&uc);    /* on OS/X, get_stack_trace() does it */
+#endif
+            depth = get_stack_trace(st->stack, MAX_STACK_DEPTH-3, &uc);
+            st->depth = depth;
+            st->stack[depth++] = get_current_thread_id();
+            p->data_offset = offsetof(struct prof_allocation_s, marker);
+            p->data_size = (depth * sizeof(void *) +
+                            sizeof(struct prof_allocation_s) -
+                            offsetof(struct prof_allocation_s, marker));
+            commit_buffer(fd, p);
+        }
+    }
+
+    __sync_sub_and_fetch(&signal_handler_value, 2L);
+}
+#  define INSTALL_ALLOCATION_HOOK(f)   pypy_alloc_sample_hook = (f)
+#else
+#  define INSTALL_ALLOCATION_HOOK(f)   /* no GC when testing untranslated */
+#endif
+
+
 /* *************************************************************
  * the setup and teardown functions
  * *************************************************************
@@ -407,6 +461,7 @@ int vmprof_enable(void)
     if (install_sigprof_timer() == -1)
         goto error;
     vmprof_ignore_signals(0);
+    INSTALL_ALLOCATION_HOOK(vmprof_record_allocation);
     return 0;
 
  error:
@@ -500,6 +555,7 @@ static int close_profile(void)
 RPY_EXTERN
 int vmprof_disable(void)
 {
+    INSTALL_ALLOCATION_HOOK(NULL);
     vmprof_ignore_signals(1);
     profile_interval_usec = 0;
 
@@ -911,9 +911,15 @@ class LLFrame(object):
     def op_gc_dump_rpy_heap(self):
         raise NotImplementedError("gc_dump_rpy_heap")
 
+    def op_gc_dump_rpy_heap_compact(self):
+        raise NotImplementedError("gc_dump_rpy_heap_compact")
+
     def op_gc_typeids_z(self):
         raise NotImplementedError("gc_typeids_z")
 
+    def op_gc_get_stat(self, event, index):
+        return self.heap.get_gc_stat(event, index)
+
     def op_gc_typeids_list(self):
         raise NotImplementedError("gc_typeids_list")
 
@@ -327,6 +327,22 @@ def arena_free(arena_addr):
     assert not arena_addr.arena.objectptrs
     arena_addr.arena.mark_freed()
 
+def arena_mmap(nbytes):
+    """Allocate and return a new zero-initialized arena of whole pages,
+    directly from the OS.  Returns NULL if out of memory."""
+    return Arena(nbytes, True).getaddr(0)
+
+def arena_munmap(arena_addr, nbytes):
+    """Release an arena obtained with arena_mmap()."""
+    assert arena_addr.arena.nbytes == nbytes
+    arena_free(arena_addr)
+
+def arena_release(arena_addr, size):
+    """Free all objects in a page-aligned part of an arena obtained
+    with arena_mmap(), and give its memory back to the OS.  The range
+    can be reused, and then contains zeroes."""
+    arena_reset(arena_addr, size, 1)
+
 def arena_reset(arena_addr, size, zero):
     """Free all objects in the arena, which can then be reused.
     This can also be used on a subrange of the arena.
@@ -503,6 +519,48 @@ register_external(arena_free, [llmemory.Address], None, 'll_arena.arena_free',
                   llfakeimpl=arena_free,
                   sandboxsafe=True)
 
+if os.name == 'posix':
+    def llimpl_arena_mmap(nbytes):
+        from rpython.rlib import rmmap
+        return rffi.cast(llmemory.Address, rmmap.alloc_pages(nbytes))
+
+    def llimpl_arena_munmap(arena_addr, nbytes):
+        from rpython.rlib import rmmap
+        rmmap.free_pages(arena_addr, nbytes)
+
+    def llimpl_arena_release(arena_addr, size):
+        from rpython.rlib import rmmap
+        rmmap.release_pages(arena_addr, size)
+
+else:
+    # XXX use VirtualAlloc() and MEM_DECOMMIT on Windows
+    def llimpl_arena_mmap(nbytes):
+        return llimpl_arena_malloc(nbytes, 1)
+
+    def llimpl_arena_munmap(arena_addr, nbytes):
+        llimpl_free(arena_addr)
+
+    def llimpl_arena_release(arena_addr, size):
+        clear_large_memory_chunk(arena_addr, size)
+
+register_external(arena_mmap, [int], llmemory.Address,
+                  'll_arena.arena_mmap',
+                  llimpl=llimpl_arena_mmap,
+                  llfakeimpl=arena_mmap,
+                  sandboxsafe=True)
+
+register_external(arena_munmap, [llmemory.Address, int], None,
+                  'll_arena.arena_munmap',
+                  llimpl=llimpl_arena_munmap,
+                  llfakeimpl=arena_munmap,
+                  sandboxsafe=True)
+
+register_external(arena_release, [llmemory.Address, int], None,
+                  'll_arena.arena_release',
+                  llimpl=llimpl_arena_release,
+                  llfakeimpl=arena_release,
+                  sandboxsafe=True)
+
 def llimpl_arena_reset(arena_addr, size, zero):
     if zero:
         if zero == 1:
@@ -3,9 +3,17 @@
 and run it by:
 
 gcanalyze.py logfile [--plot]
+
+or analyze a heap dump written by rgc.dump_rpy_heap() or
+rgc.dump_rpy_heap_compact(), giving per-type retained sizes and the
+top of the dominator tree:
+
+gcanalyze.py --heap dumpfile [typeids.txt]
 """
 
-import sys
+import sys, struct, zlib
+from array import array
+from bisect import bisect_left
 from rpython.tool.logparser import parse_log
 
 NO_BUCKETS = 8
@@ -50,7 +58,355 @@ def format_output(all, plot=False):
         print " ".join(l1)
         print " ".join(l2)
 
+# ____________________________________________________________
+# heap dumps
+
+COMPACT_MAGIC = 'RPYHEAP\x01'     # see rpython/memory/gc/inspector.py
+COMPACT_ZLIB = 1
+CHUNK_SIZE = 65536
+ADDR_MASK = (1 << (8 * struct.calcsize('L'))) - 1
+
+class ByteReader(object):
+    """Reads the varints of a compact dump, decompressing on the fly."""
+
+    def __init__(self, f, data, compressed):
+        self.f = f
+        if compressed:
+            self.decompressor = zlib.decompressobj()
+            data = self.decompressor.decompress(data)
+        else:
+            self.decompressor = None
+        self.buf = data
+        self.pos = 0
+
+    def refill(self):
+        while self.pos == len(self.buf):
+            data = self.f.read(CHUNK_SIZE)
+            if self.decompressor is not None:
+                if data:
+                    data = self.decompressor.decompress(data)
+                else:
+                    data = self.decompressor.flush()
+                    self.decompressor = None
+            elif not data:
+                raise EOFError
+            self.buf = data
+            self.pos = 0
+
+    def read_varint(self):
+        result = 0
+        shift = 0
+        while True:
+            if self.pos == len(self.buf):
+                self.refill()
+            byte = ord(self.buf[self.pos])
+            self.pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def at_end(self):
+        try:
+            if self.pos == len(self.buf):
+                self.refill()
+        except EOFError:
+            return True
+        return False
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def read_heap_dump(f):
+    """Yield (addr, typeindex, size, refs) for every object in the dump,
+    and None for the marker that ends the objects found from the roots.
+    The file is read in chunks, not all at once; but to analyze it,
+    HeapGraph needs the whole graph in memory."""
+    data = f.read(len(COMPACT_MAGIC) + 2)
+    if data.startswith(COMPACT_MAGIC):
+        flags = ord(data[len(COMPACT_MAGIC)])
+        wordbits = ord(data[len(COMPACT_MAGIC) + 1]) * 8
+        reader = ByteReader(f, '', flags & COMPACT_ZLIB)
+        return _read_compact_dump(reader, (1 << wordbits) - 1)
+    return _read_raw_dump(f, data)
+
+def _read_compact_dump(reader, mask):
+    addr = 0
+    typeindex = 0
+    while not reader.at_end():
+        value = reader.read_varint()
+        if value == 0:
+            yield None
+            continue
+        addr = (addr + unzigzag(value - 1)) & mask
+        typeindex += unzigzag(reader.read_varint())
+        size = reader.read_varint()
+        refs = []
+        while True:
+            value = reader.read_varint()
+            if value == 0:
+                break
+            refs.append((addr + unzigzag(value - 1)) & mask)
+        yield (addr, typeindex, size, refs)
+
+def _read_raw_dump(f, data):
+    # the format written by HeapDumper: words in the native byte order
+    wordsize = struct.calcsize('l')
+    record = []
+    while True:
+        more = f.read(CHUNK_SIZE * wordsize)
+        data += more
+        usable = len(data) - len(data) % wordsize
+        words = array('l')
+        words.fromstring(data[:usable])
+        data = data[usable:]
+        for word in words:
+            if word != -1 or len(record) < 3:
+                record.append(word)
+                continue
+            if record == [0, 0, 0]:
+                yield None
+            else:
+                yield (record[0], record[1], record[2], record[3:])
+            record = []
+        if not more:
+            break
+
+class HeapGraph(object):
+    """The object graph of a heap dump, stored in flat arrays.  Node 0 is
+    a virtual root pointing to all the objects found from the roots.
+
+    The whole graph is kept in memory: one machine word per reference,
+    and six per object (address, type, size, offset of the references,
+    and the index by address).  The analysis adds about ten words per
+    object and one per reference, plus a Python list as deep as the
+    graph, so that a dump of N objects and R references needs at least
+    16*N + 2*R words: some 8 GB for 50 million objects with two
+    references each on a 64-bit machine."""
+
+    def __init__(self, records):
+        self.addrs = array('L', [0])
+        self.typeindexes = array('l', [-1])
+        self.sizes = array('l', [0])
+        self.edge_start = array('l', [0])
+        edges = array('L')
+        roots = array('l')
+        in_roots = True
+        for record in records:
+            if record is None:
+                in_roots = False
+                continue
+            addr, typeindex, size, refs = record
+            if in_roots:
+                roots.append(len(self.addrs))
+            self.addrs.append(addr & ADDR_MASK)
+            self.typeindexes.append(typeindex)
+            self.sizes.append(size)
+            self.edge_start.append(len(edges))
+            edges.extend([ref & ADDR_MASK for ref in refs])
+        self.edge_start.append(len(edges))
+        self._build_address_index()
+        # node 0 is the virtual root, whose edges are the roots
+        num_roots = len(roots)
+        self.edges = roots
+        for addr in edges:
+            self.edges.append(self.node_at(addr))
+        del edges
+        for i in range(1, len(self.edge_start)):
+            self.edge_start[i] += num_roots
+
+    def _build_address_index(self):
+        # the nodes sorted by address, to find them with a binary search
+        # instead of a dict, which would take several times more memory
+        nodes = range(1, len(self.addrs))
+        nodes.sort(key=self.addrs.__getitem__)
+        self.nodes_by_addr = array('l', nodes)
+        del nodes
+        self.sorted_addrs = array('L')
+        for node in self.nodes_by_addr:
+            self.sorted_addrs.append(self.addrs[node])
+
+    def node_at(self, addr):
+        """The node of the object at 'addr', or 0 if it is not in the dump."""
+        i = bisect_left(self.sorted_addrs, addr)
+        if i < len(self.sorted_addrs) and self.sorted_addrs[i] == addr:
+            return self.nodes_by_addr[i]
+        return 0
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def successors(self, node):
+        return self.edges[self.edge_start[node]:self.edge_start[node + 1]]
+
+    def compute_dominators(self):
+        """Cooper, Harvey and Kennedy's iterative algorithm.  Returns
+        'idom', with idom[node] == -1 for the unreachable nodes."""
+        n = len(self)
+        order = self.reverse_postorder()
+        rpo_number = array('l', [-1]) * n
+        for i, node in enumerate(order):
+            rpo_number[node] = i
+        preds_start = array('l', [0]) * (n + 1)
+        for node in order:
+            for succ in self.successors(node):
+                preds_start[succ + 1] += 1
+        for i in range(n):
+            preds_start[i + 1] += preds_start[i]
+        preds = array('l', [0]) * preds_start[n]
+        fill = array('l', preds_start)
+        for node in order:
+            for succ in self.successors(node):
+                preds[fill[succ]] = node
+                fill[succ] += 1
+        #
+        idom = array('l', [-1]) * n
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for node in order:
+                if node == 0:
+                    continue
+                new_idom = -1
+                for i in range(preds_start[node], preds_start[node + 1]):
+                    pred = preds[i]
+                    if idom[pred] == -1:
+                        continue
+                    if new_idom == -1:
+                        new_idom = pred
+                        continue
+                    a = pred
+                    b = new_idom
+                    while a != b:
+                        while rpo_number[a] > rpo_number[b]:
+                            a = idom[a]
+                        while rpo_number[b] > rpo_number[a]:
+                            b = idom[b]
+                    new_idom = a
+                if idom[node] != new_idom:
+                    idom[node] = new_idom
+                    changed = True
+        return idom, order
+
+    def reverse_postorder(self):
+        n = len(self)
+        visited = array('b', [0]) * n
+        postorder = array('l')
+        visited[0] = 1
+        stack = [(0, self.edge_start[0])]
+        while stack:
+            node, i = stack[-1]
+            if i < self.edge_start[node + 1]:
+                stack[-1] = (node, i + 1)
+                succ = self.edges[i]
+                if not visited[succ]:
+                    visited[succ] = 1
+                    stack.append((succ, self.edge_start[succ]))
+            else:
+                stack.pop()
+                postorder.append(node)
+        postorder.reverse()
+        return postorder
+
+    def retained_sizes(self, idom, order):
+        retained = array('l', self.sizes)
+        for i in range(len(order) - 1, 0, -1):
+            node = order[i]
+            retained[idom[node]] += retained[node]
+        return retained
+
+    def dominator_children(self, idom, order):
+        """Returns (start, children): the children of 'node' in the
+        dominator tree are children[start[node]:start[node + 1]]."""
+        n = len(self)
+        start = array('l', [0]) * (n + 1)
+        for node in order:
+            if node != 0:
+                start[idom[node] + 1] += 1
+        for i in range(n):
+            start[i + 1] += start[i]
+        children = array('l', [0]) * start[n]
+        fill = array('l', start)
+        for node in order:
+            if node != 0:
+                parent = idom[node]
+                children[fill[parent]] = node
+                fill[parent] += 1
+        return start, children
+
+    def type_summary(self, idom, order, retained):
+        """Returns {typeindex: [count, shallow size, retained size]}.  The
+        retained size of a type counts the objects of that type that are
+        not themselves dominated by another object of the same type."""
+        summary = {}
+        start, children = self.dominator_children(idom, order)
+        active = {}
+        stack = [(0, False)]
+        while stack:
+            node, leaving = stack.pop()
+            t = self.typeindexes[node]
+            if leaving:
+                active[t] -= 1
+                continue
+            if node != 0:
+                entry = summary.setdefault(t, [0, 0, 0])
+                entry[0] += 1
+                entry[1] += self.sizes[node]
+                if not active.get(t):
+                    entry[2] += retained[node]
+                active[t] = active.get(t, 0) + 1
+                stack.append((node, True))
+            for i in range(start[node], start[node + 1]):
+                stack.append((children[i], False))
+        return summary
+
+def read_typeids(filename):
+    names = {}
+    for line in open(filename):
+        if line.startswith('member'):
+            index, name = line[len('member'):].split(None, 1)
+            names[int(index)] = name.strip()
+    return names
+
+def analyze_heap(dumpfile, typeids=None, top=20, depth=3):
+    names = {}
+    if typeids is not None:
+        names = read_typeids(typeids)
+    f = open(dumpfile, 'rb')
+    try:
+        graph = HeapGraph(read_heap_dump(f))
+    finally:
+        f.close()
+    idom, order = graph.compute_dominators()
+    retained = graph.retained_sizes(idom, order)
+    summary = graph.type_summary(idom, order, retained)
+    def name(typeindex):
+        return names.get(typeindex, 'member%d' % typeindex)
+    print "%d objects, %d bytes" % (len(graph) - 1, retained[0])
+    print
+    print "%12s %12s %12s  type" % ("count", "shallow", "retained")
+    items = sorted(summary.items(), key=lambda (t, e): -e[2])
+    for typeindex, (count, shallow, ret) in items[:top]:
+        print "%12d %12d %12d  %s" % (count, shallow, ret, name(typeindex))
+    print
+    print "dominator tree:"
+    start, children = graph.dominator_children(idom, order)
+    def show(node, level):
+        kids = sorted(children[start[node]:start[node + 1]],
+                      key=lambda n: -retained[n])
+        for kid in kids[:top]:
+            print "%s%d  %s at 0x%x" % ("  " * level, retained[kid],
+                                        name(graph.typeindexes[kid]),
+                                        graph.addrs[kid])
+            if level + 1 < depth:
+                show(kid, level + 1)
+    show(0, 0)
+
 if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--heap':
+        analyze_heap(*sys.argv[2:4])
+        sys.exit(0)
     if len(sys.argv) < 2 or len(sys.argv) > 3:
         print __doc__
         sys.exit(1)
@@ -0,0 +1,60 @@
+import struct
+from cStringIO import StringIO
+from rpython.tool.gcanalyze import read_heap_dump, HeapGraph
+
+
+def raw_dump(records):
+    words = []
+    for record in records:
+        if record is None:
+            words += [0, 0, 0, -1]
+        else:
+            addr, typeindex, size, refs = record
+            words += [addr, typeindex, size] + refs + [-1]
+    return StringIO(struct.pack('%dl' % len(words), *words))
+
+def test_read_raw_dump():
+    records = [(0x1000, 3, 16, [0x2000, 0x1000]), None, (0x2000, 4, 24, [])]
+    assert list(read_heap_dump(raw_dump(records))) == records
+
+def test_dominators():
+    # root -> A -> B -> D
+    #           -> C -> D
+    #              C -> E -> C
+    records = [(0xa0, 1, 10, [0xb0, 0xc0]),
+               None,
+               (0xb0, 2, 20, [0xd0]),
+               (0xc0, 2, 30, [0xd0, 0xe0]),
+               (0xd0, 3, 40, []),
+               (0xe0, 3, 50, [0xc0])]
+    graph = HeapGraph(iter(records))
+    idom, order = graph.compute_dominators()
+    node = dict([(graph.addrs[i], i) for i in range(1, len(graph))])
+    assert idom[node[0xa0]] == 0
+    assert idom[node[0xb0]] == node[0xa0]
+    assert idom[node[0xc0]] == node[0xa0]
+    assert idom[node[0xd0]] == node[0xa0]
+    assert idom[node[0xe0]] == node[0xc0]
+    retained = graph.retained_sizes(idom, order)
+    assert retained[0] == 150
+    assert retained[node[0xa0]] == 150
+    assert retained[node[0xc0]] == 80
+    assert retained[node[0xb0]] == 20
+    summary = graph.type_summary(idom, order, retained)
+    assert summary[1] == [1, 10, 150]
+    assert summary[2] == [2, 50, 100]
+    assert summary[3] == [2, 90, 90]
+
+def test_node_at():
+    # the objects are not in address order, and 0x50 is not in the dump
+    records = [(0x30, 1, 8, [0x10, 0x50]), None, (0x10, 1, 8, [0x20]),
+               (0x20, 2, 8, [])]
+    graph = HeapGraph(iter(records))
+    assert [graph.node_at(addr) for addr in [0x30, 0x10, 0x20]] == [1, 2, 3]
+    assert graph.node_at(0x50) == 0
+    assert list(graph.successors(1)) == [2, 0]
+    idom, order = graph.compute_dominators()
+    start, children = graph.dominator_children(idom, order)
+    assert list(children[start[0]:start[1]]) == [1]
+    assert list(children[start[1]:start[2]]) == [2]
+    assert list(children[start[2]:start[3]]) == [3]
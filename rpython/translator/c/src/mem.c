@@ -69,6 +69,19 @@ void pypy_debug_alloc_results(void)
 #endif /* RPY_ASSERT */
 
 
+/*** allocation samples from the GC ***/
+
+void (*pypy_alloc_sample_hook)(long, long) = NULL;
+
+RPY_EXTERN
+void pypy_report_alloc_sample(long typeindex, long size)
+{
+  void (*hook)(long, long) = pypy_alloc_sample_hook;
+  if (hook != NULL)
+    hook(typeindex, size);
+}
+
+
 /* Boehm GC helper functions */
 
 #ifdef PYPY_USING_BOEHM_GC
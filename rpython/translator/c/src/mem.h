@@ -76,6 +76,12 @@ RPY_EXTERN void pypy_debug_alloc_results(void);
 
 #endif /* RPY_ASSERT */
 
+/* allocation samples taken by incminimark (PYPY_GC_ALLOC_SAMPLE); they
+   are passed to the hook, which rvmprof installs while it is enabled */
+
+RPY_EXTERN void (*pypy_alloc_sample_hook)(long, long);
+RPY_EXTERN void pypy_report_alloc_sample(long, long);
+
 /* for Boehm GC */
 
 #ifdef PYPY_USING_BOEHM_GC
@@ -138,6 +144,7 @@ RPY_EXTERN void boehm_gc_finalizer_notifier(void);
 #define OP_GC_GET_RPY_TYPE_INDEX(x, r)   r = -1
 #define OP_GC_IS_RPY_INSTANCE(x, r)      r = 0
 #define OP_GC_DUMP_RPY_HEAP(fd, r)       r = 0
+#define OP_GC_DUMP_RPY_HEAP_COMPACT(fd, compress, r)  r = 0
 #define OP_GC_SET_EXTRA_THRESHOLD(x, r)  /* nothing */
 
 /****************************/
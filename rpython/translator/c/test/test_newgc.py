@@ -1150,6 +1150,52 @@ class UsingFrameworkTest(object):
         f.close()
         assert data1 == data2
 
+    filename_dump_compact = str(udir.join('test_dump_rpy_heap_compact'))
+    def define_dump_rpy_heap_compact(self):
+        U = lltype.GcForwardReference()
+        U.become(lltype.GcStruct('U', ('next', lltype.Ptr(U)),
+                                 ('x', lltype.Signed)))
+        S = lltype.GcStruct('S', ('u', lltype.Ptr(U)))
+        A = lltype.GcArray(lltype.Ptr(S))
+        filename = self.filename_dump_compact
+        open_flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+        def fn():
+            s = lltype.malloc(S)
+            s.u = lltype.malloc(U)
+            s.u.next = lltype.malloc(U)
+            s.u.next.next = lltype.malloc(U)
+            a = lltype.malloc(A, 1000)
+            s2 = lltype.malloc(S)
+            #
+            fd = os.open(filename, open_flags, 0666)
+            gc.collect()
+            rgc.dump_rpy_heap_compact(fd, True)
+            keepalive_until_here(s2)
+            keepalive_until_here(s)
+            keepalive_until_here(a)
+            os.close(fd)
+            return 0
+
+        return fn
+
+    def test_dump_rpy_heap_compact(self):
+        from rpython.tool.gcanalyze import read_heap_dump
+        self.run("dump_rpy_heap_compact")
+        f = open(self.filename_dump_compact, 'rb')
+        records = list(read_heap_dump(f))
+        f.close()
+        assert None in records
+        sizes = {}
+        for record in records:
+            if record is not None:
+                sizes[record[0]] = record[2]
+        for record in records:
+            if record is not None:
+                for ref in record[3]:
+                    assert ref in sizes
+        assert max(sizes.values()) >= 1000 * rffi.sizeof(lltype.Signed)
+
     filename_dump_typeids_z = str(udir.join('test_typeids_z'))
     def define_write_typeids_z(self):
         U = lltype.GcForwardReference()
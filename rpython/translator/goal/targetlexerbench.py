@@ -0,0 +1,75 @@
+"""
+A benchmark comparing the two lexer backends of rpython.rlib.parsing: the
+default one, which generates a chain of character comparisons per state,
+and the table-driven one (Lexer(..., table=True)).  Both lexers are built
+from the same ebnfparse grammar.
+
+usage: targetlexerbench-c <file> [iterations]
+"""
+
+import os
+import time
+
+from rpython.rlib.parsing.ebnfparse import parse_ebnf
+from rpython.rlib.parsing.lexer import Lexer
+
+grammar = r"""
+IGNORE: " |\n|\t|#[^\n]*";
+NAME: "[a-zA-Z_][a-zA-Z0-9_]*";
+NUMBER: "(0|[1-9][0-9]*)(\.[0-9]+)?";
+STRING: "\"([^\\\"]|\\.)*\"|'([^\\']|\\.)*'";
+OTHER: "[&\|\^~@;`\\]";
+file: token* EOF;
+token: "def" | "class" | "if" | "elif" | "else" | "while" | "for" | "in" |
+       "return" | "import" | "from" | "and" | "or" | "not" | "is" |
+       "(" | ")" | "[" | "]" | "{" | "}" | ":" | "," | "." | "=" | "==" |
+       "!=" | "<" | "<=" | ">" | ">=" | "+" | "-" | "*" | "/" | "%" |
+       NAME | NUMBER | STRING | OTHER;
+"""
+
+regexs, rules, ToAST = parse_ebnf(grammar)
+names, regexs = zip(*regexs)
+lexers = [("chained", Lexer(list(regexs), list(names), ignore=["IGNORE"])),
+          ("table", Lexer(list(regexs), list(names), ignore=["IGNORE"],
+                          table=True))]
+
+def read_file(fname):
+    fd = os.open(fname, os.O_RDONLY, 0777)
+    chunks = []
+    while 1:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(fd)
+    return "".join(chunks)
+
+# __________  Entry point  __________
+
+def entry_point(argv):
+    if len(argv) < 2:
+        print __doc__
+        return 1
+    if len(argv) > 2:
+        iterations = int(argv[2])
+    else:
+        iterations = 10
+    text = read_file(argv[1])
+    for name, lexer in lexers:
+        start = time.time()
+        count = 0
+        for i in range(iterations):
+            count = len(lexer.tokenize(text))
+        t = time.time() - start
+        print "%s: %d tokens, %f seconds per iteration" % (
+            name, count, t / iterations)
+    return 0
+
+# _____ Define and setup target ___
+
+def target(*args):
+    return entry_point, None
+
+if __name__ == '__main__':
+    import sys
+    entry_point(sys.argv)
@@ -0,0 +1,85 @@
+"""
+Allocation benchmark for multi-threaded RPython programs: every thread
+builds and drops linked lists, passing a GIL around every few thousand
+allocations.  Translate with --thread and incminimark, then compare
+runs with and without per-thread nursery chunks:
+
+    PYPY_GC_THREAD_CHUNK=0 ./targetthreadallocbench-c 4 200
+    PYPY_GC_THREAD_CHUNK=4096 ./targetthreadallocbench-c 4 200
+"""
+import os, time
+from rpython.rlib import rthread
+from rpython.rlib.debug import ll_assert
+from rpython.rlib.objectmodel import invoke_around_extcall
+
+
+class State:
+    pass
+state = State()
+
+def before():
+    ll_assert(not rthread.acquire_NOAUTO(state.ll_lock, False),
+              "lock not held!")
+    rthread.release_NOAUTO(state.ll_lock)
+
+def after():
+    rthread.acquire_NOAUTO(state.ll_lock, True)
+    rthread.gc_thread_run()
+
+
+class Node:
+    def __init__(self, value, next):
+        self.value = value
+        self.next = next
+
+def build_list(length):
+    head = None
+    for i in range(length):
+        head = Node(i, head)
+    return head
+
+def run_thread(rounds):
+    total = 0
+    for i in range(rounds):
+        lst = build_list(1000)
+        while lst is not None:
+            total += lst.value
+            lst = lst.next
+        if i % 5 == 0:
+            time.sleep(0.0)     # give the GIL to another thread
+    return total
+
+def bootstrap():
+    rthread.gc_thread_start()
+    run_thread(state.rounds)
+    state.finished += 1
+    rthread.gc_thread_die()
+
+def entry_point(argv):
+    if len(argv) != 3:
+        os.write(2, "usage: %s num_threads rounds\n" % (argv[0],))
+        return 2
+    num_threads = int(argv[1])
+    state.rounds = int(argv[2])
+    state.finished = 0
+    state.ll_lock = rthread.allocate_ll_lock()
+    after()
+    invoke_around_extcall(before, after)
+    start = time.time()
+    for i in range(num_threads):
+        rthread.start_new_thread(bootstrap, ())
+    while state.finished < num_threads:
+        time.sleep(0.001)
+    end = time.time()
+    os.write(1, "%d threads, %d rounds: %f seconds\n" % (
+        num_threads, state.rounds, end - start))
+    return 0
+
+# _____ Define and setup target ___
+
+def target(*args):
+    return entry_point, None
+
+if __name__ == '__main__':
+    import sys
+    entry_point(sys.argv)